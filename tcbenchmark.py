@@ -0,0 +1,331 @@
+# -*- coding: utf-8 -*-
+# -----------------------------------------------------------------------
+# Copyright (C) 2011
+# Marcelo Martins
+# http://www.cs.brown.edu/~martins/
+#
+# Permission is hereby granted, free of charge, to any person obtaining
+# a copy of this software and associated documentation files (the
+# "Software"), to deal in the Software without restriction, including
+# without limitation the rights to use, copy, modify, merge, publish,
+# distribute, sublicense, and/or sell copies of the Software, and to
+# permit persons to whom the Software is furnished to do so, subject to
+# the following conditions:
+#
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT
+# IN NO EVENT SHALL THE AUTHORS BE LIABLE FOR ANY CLAIM, DAMAGES OR
+# OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE,
+# ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR
+# OTHER DEALINGS IN THE SOFTWARE.
+# -----------------------------------------------------------------------
+
+
+"""Micro-benchmark of the TokyocabinetDriver transactions.
+
+Loads a small fixed-seed dataset into in-memory stand-in servers (see
+tyrantserver.py), then runs each of the five transactions a fixed number of
+times and reports throughput and latency per transaction and warehouse
+count. The results can be saved to a baseline file; later runs given the
+same file are compared against it and the script exits with status 1 when
+a transaction lost more than --threshold of its throughput or gained as
+much in p95 latency. Timings depend on the machine, so no baseline ships
+with the driver: record one on the machine that runs the comparisons.
+
+    python tcbenchmark.py --warehouses 1,4 --baseline base.json --save-baseline
+    python tcbenchmark.py --warehouses 1,4 --baseline base.json
+
+With --load-workers N the dataset is loaded by the driver's
+loadPartitioned, with N loader processes per server, instead of by a
+single loader in this process.
+
+With --async the measured runs go through the driver's executeAsync, on
+--terminals concurrent terminals of one event loop, instead of one
+executeTransaction after the other. Latencies then include the time a
+transaction waits for the loop while other terminals run.
+
+Like the driver, it runs inside py-tpcc's drivers directory and uses the
+framework's loader and parameter generators.
+"""
+
+from __future__ import with_statement
+
+import json
+import logging
+import optparse
+import os
+import random
+import sys
+import time
+
+## The py-tpcc framework (constants, runtime, util) is one level up
+sys.path.append(os.path.dirname(os.path.dirname(os.path.realpath(__file__))))
+
+import constants
+from runtime import executor, loader
+from util import nurand, rand, scaleparameters
+
+from tokyocabinetdriver import TokyocabinetDriver, TABLE_COLUMNS
+from tyrantcommit import CommitPolicy
+from tyrantserver import spawnServers
+from tyrantstats import Histogram
+
+## Run order: NEW_ORDER and PAYMENT first, so DELIVERY always finds new
+## orders and the later reads see the new rows
+TRANSACTIONS = [
+	(constants.TransactionTypes.NEW_ORDER, "generateNewOrderParams"),
+	(constants.TransactionTypes.PAYMENT, "generatePaymentParams"),
+	(constants.TransactionTypes.ORDER_STATUS, "generateOrderStatusParams"),
+	(constants.TransactionTypes.DELIVERY, "generateDeliveryParams"),
+	(constants.TransactionTypes.STOCK_LEVEL, "generateStockLevelParams"),
+]
+
+## Settings that must match for two runs to be compared
+SETTINGS = ("iterations", "scalefactor", "seed", "servers", "denormalize", "write_behind", "commit",
+		"async", "terminals")
+
+class ParameterStream(object):
+	"""Stands in for py-tpcc's Executor in executeAsync: hands out txn
+	   with each of params in turn, then None"""
+
+	def __init__(self, txn, params):
+		self.txn = txn
+		self.params = iter(params)
+
+	def doOne(self):
+		params = next(self.params, None)
+		return None if params is None else (self.txn, params)
+
+## CLASS
+
+class TimedResults(object):
+	"""Stands in for py-tpcc's Results in executeAsync and keeps the
+	   latency of every completed transaction in a Histogram, in
+	   microseconds"""
+
+	def __init__(self):
+		self.histogram = Histogram()
+		self.running = dict()
+		self.nextId = 0
+		self.aborted = 0
+		self.start = self.stop = None
+
+	def startBenchmark(self):
+		self.start = time.time()
+		return self.start
+
+	def stopBenchmark(self):
+		self.stop = time.time()
+
+	def startTransaction(self, txn):
+		self.nextId += 1
+		self.running[self.nextId] = time.time()
+		return self.nextId
+
+	def stopTransaction(self, txn_id):
+		self.histogram.record((time.time() - self.running.pop(txn_id)) * 1000000)
+
+	def abortTransaction(self, txn_id):
+		del self.running[txn_id]
+		self.aborted += 1
+
+## CLASS
+
+##-----------------------------------------------
+## makeDriver
+##-----------------------------------------------
+def makeDriver(options, databases):
+	"""A driver with the default configuration pointed at databases"""
+	ddl = os.path.join(os.path.dirname(os.path.dirname(os.path.realpath(__file__))), "tpcc.sql")
+	driver = TokyocabinetDriver(ddl)
+	config = dict((key, value[1]) for key, value in TokyocabinetDriver.DEFAULT_CONFIG.iteritems())
+	config["servers"] = databases
+	config["denormalize"] = options.denormalize
+	config["write_behind"] = options.write_behind
+	config["commit"] = options.commit
+	config["stats"] = options.stats
+	config["load_workers"] = max(options.load_workers, 1)
+	config["async_terminals"] = options.terminals
+	config["reset"] = False
+	driver.loadDefaultConfig(config)
+	return driver
+
+##-----------------------------------------------
+## runWarehouses
+##-----------------------------------------------
+def runWarehouses(options, warehouses):
+	"""Load warehouses warehouses into fresh servers and time every
+	   transaction. Returns {txn: {"tps": ..., "mean": ..., "p50": ...}},
+	   latencies in milliseconds"""
+	processes = [ ]
+	databases = dict()
+	try:
+		for i in xrange(options.servers):
+			process, tables = spawnServers(TABLE_COLUMNS.keys())
+			processes.append(process)
+			databases["Server%d" % (i+1)] = tables
+		## FOR
+		driver = makeDriver(options, databases)
+
+		random.seed(options.seed)
+		rand.setNURand(nurand.makeForLoad())
+		scaleParameters = scaleparameters.makeWithScaleFactor(warehouses, options.scalefactor)
+		start = time.time()
+		if options.load_workers:
+			driver.loadPartitioned(scaleParameters)
+		else:
+			loader.Loader(driver, scaleParameters, range(1, warehouses+1), True).execute()
+			driver.loadFinish()
+		logging.info("Loaded %d warehouses in %.2f sec" % (warehouses, time.time() - start))
+
+		generator = executor.Executor(driver, scaleParameters)
+		results = dict()
+		for i in xrange(len(TRANSACTIONS)):
+			txn, generate = TRANSACTIONS[i]
+			## Every transaction type sees the same parameter stream on every run
+			random.seed(options.seed * len(TRANSACTIONS) + i)
+			params = [ getattr(generator, generate)() for j in xrange(options.warmup + options.iterations) ]
+			for p in params[:options.warmup]:
+				driver.executeTransaction(txn, p)
+
+			if options.async:
+				r = driver.executeAsync(scaleParameters, None, ParameterStream(txn, params[options.warmup:]), TimedResults())
+				if r.aborted:
+					logging.warn("%d of the %s runs failed" % (r.aborted, txn))
+				histogram = r.histogram
+				duration = r.stop - r.start
+			else:
+				histogram = Histogram()
+				start = time.time()
+				for p in params[options.warmup:]:
+					t = time.time()
+					driver.executeTransaction(txn, p)
+					histogram.record((time.time() - t) * 1000000)
+				duration = time.time() - start
+			## IF
+
+			results[txn] = {
+				"tps": options.iterations / max(duration, 1e-9),
+				"mean": histogram.mean() / 1000.0,
+				"p50": histogram.percentile(50) / 1000.0,
+				"p95": histogram.percentile(95) / 1000.0,
+				"p99": histogram.percentile(99) / 1000.0,
+			}
+		## FOR
+		driver.executeFinish()
+		return results
+	finally:
+		for process in processes:
+			process.terminate()
+			process.join()
+	## TRY
+
+##-----------------------------------------------
+## compare
+##-----------------------------------------------
+def compare(current, baseline, threshold):
+	"""(warehouses, txn, reason) of every transaction that regressed
+	   beyond threshold against the baseline"""
+	regressions = [ ]
+	for warehouses, txns in sorted(current.iteritems()):
+		for txn, result in sorted(txns.iteritems()):
+			base = baseline.get(warehouses, { }).get(txn)
+			if base is None: continue
+			if result["tps"] < base["tps"] * (1.0 - threshold):
+				regressions.append((warehouses, txn, "throughput %.1f/s -> %.1f/s" % (base["tps"], result["tps"])))
+			if result["p95"] > base["p95"] * (1.0 + threshold):
+				regressions.append((warehouses, txn, "p95 latency %.2f ms -> %.2f ms" % (base["p95"], result["p95"])))
+		## FOR
+	## FOR
+	return regressions
+
+##-----------------------------------------------
+## report
+##-----------------------------------------------
+def report(current, baseline):
+	"""Results table, with the throughput change against the baseline"""
+	lines = [ "%-10s %-14s %10s %9s %9s %9s %9s %9s" % \
+			("WAREHOUSES", "TRANSACTION", "TXN/SEC", "MEAN", "P50", "P95", "P99", "VS BASE") ]
+	for warehouses, txns in sorted(current.iteritems(), key=lambda item: int(item[0])):
+		for txn, unused in TRANSACTIONS:
+			if not txn in txns: continue
+			r = txns[txn]
+			base = baseline.get(warehouses, { }).get(txn)
+			delta = "%+.1f%%" % ((r["tps"] / base["tps"] - 1.0) * 100) if base else "-"
+			lines.append("%-10s %-14s %10.1f %9.2f %9.2f %9.2f %9.2f %9s" % \
+					(warehouses, txn, r["tps"], r["mean"], r["p50"], r["p95"], r["p99"], delta))
+		## FOR
+	## FOR
+	return "\n".join(lines)
+
+##-----------------------------------------------
+## main
+##-----------------------------------------------
+def main():
+	parser = optparse.OptionParser(description="Micro-benchmark of the Tokyo Tyrant TPC-C transactions")
+	parser.add_option("--warehouses", default="1", help="comma-separated warehouse counts to run [%default]")
+	parser.add_option("--iterations", type="int", default=200, help="measured runs of each transaction [%default]")
+	parser.add_option("--warmup", type="int", default=20, help="unmeasured runs before each transaction [%default]")
+	parser.add_option("--scalefactor", type="float", default=50, help="py-tpcc scale factor of the dataset [%default]")
+	parser.add_option("--seed", type="int", default=0, help="random seed of the dataset and parameters [%default]")
+	parser.add_option("--servers", type="int", default=1, help="number of stand-in servers [%default]")
+	parser.add_option("--denormalize", action="store_true", default=False, help="run in denormalized mode")
+	parser.add_option("--write-behind", action="store_true", default=False, help="queue HISTORY inserts (see write_behind)")
+	parser.add_option("--commit", type="choice", choices=CommitPolicy.POLICIES, default="none",
+			help="commit policy (see commit) [%default]")
+	parser.add_option("--stats", action="store_true", default=False, help="log the driver's per-stage statistics")
+	parser.add_option("--load-workers", type="int", default=0,
+			help="load in parallel with this many processes per server (see load_workers); 0 loads in this process [%default]")
+	parser.add_option("--async", action="store_true", default=False,
+			help="run the measured transactions on executeAsync's event loop")
+	parser.add_option("--terminals", type="int", default=TokyocabinetDriver.DEFAULT_CONFIG["async_terminals"][1],
+			help="concurrent terminals under --async (see async_terminals) [%default]")
+	parser.add_option("--baseline", help="baseline file to compare against")
+	parser.add_option("--save-baseline", action="store_true", default=False, help="store this run in the --baseline file")
+	parser.add_option("--threshold", type="float", default=0.15, help="allowed fractional regression [%default]")
+	parser.add_option("--debug", action="store_true", default=False)
+	options, args = parser.parse_args()
+	if options.save_baseline and not options.baseline:
+		parser.error("--save-baseline needs --baseline")
+
+	logging.basicConfig(level=logging.DEBUG if options.debug else logging.INFO,
+			format="%(asctime)s [%(funcName)s:%(lineno)03d] %(levelname)-5s: %(message)s")
+	settings = dict((key, getattr(options, key)) for key in SETTINGS)
+
+	baseline = { }
+	if options.baseline and os.path.exists(options.baseline):
+		with open(options.baseline) as f:
+			stored = json.load(f)
+		if stored["settings"] == settings:
+			baseline = stored["results"]
+		else:
+			logging.warn("Baseline %s was recorded with %s; not comparing" % (options.baseline, stored["settings"]))
+	## IF
+
+	current = dict()
+	for warehouses in options.warehouses.split(","):
+		current[warehouses.strip()] = runWarehouses(options, int(warehouses))
+	print report(current, baseline)
+
+	if options.save_baseline:
+		if baseline:
+			for warehouses, txns in current.iteritems():
+				baseline.setdefault(warehouses, { }).update(txns)
+		else:
+			baseline = current
+		with open(options.baseline, "w") as f:
+			json.dump({"settings": settings, "results": baseline}, f, indent=2, sort_keys=True)
+		logging.info("Saved baseline to %s" % options.baseline)
+		return 0
+
+	regressions = compare(current, baseline, options.threshold)
+	for warehouses, txn, reason in regressions:
+		print "REGRESSION: %s with %s warehouses: %s" % (txn, warehouses, reason)
+	return 1 if regressions else 0
+
+if __name__ == "__main__":
+	sys.exit(main())
@@ -0,0 +1,83 @@
+# -*- coding: utf-8 -*-
+# -----------------------------------------------------------------------
+# Copyright (C) 2011
+# Marcelo Martins
+# http://www.cs.brown.edu/~martins/
+#
+# Permission is hereby granted, free of charge, to any person obtaining
+# a copy of this software and associated documentation files (the
+# "Software"), to deal in the Software without restriction, including
+# without limitation the rights to use, copy, modify, merge, publish,
+# distribute, sublicense, and/or sell copies of the Software, and to
+# permit persons to whom the Software is furnished to do so, subject to
+# the following conditions:
+#
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT
+# IN NO EVENT SHALL THE AUTHORS BE LIABLE FOR ANY CLAIM, DAMAGES OR
+# OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE,
+# ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR
+# OTHER DEALINGS IN THE SOFTWARE.
+# -----------------------------------------------------------------------
+"""Adds a Tyrant server to a running TokyocabinetDriver cluster.
+
+The new server must hold empty copies of every table. Each warehouse the
+partitioner assigns to it is fenced, copied and switched over while the
+benchmark clients keep running (see TokyocabinetDriver.rebalance); the
+clients pick up the change from the layout record in the LAYOUT table of
+the first server.
+
+    python tcrebalance.py --config cluster.json --server Server3 --tables server3.json
+
+cluster.json holds the driver settings the clients run with as a JSON
+object (at least "servers", with a LAYOUT table on the first server, and
+"rebalance": true); server3.json maps each table name to the host and
+port of the ttserver holding it on the new server.
+"""
+
+from __future__ import with_statement
+
+import json
+import logging
+import optparse
+import os
+import sys
+
+## The py-tpcc framework (constants, abstractdriver) is one level up
+sys.path.append(os.path.dirname(os.path.dirname(os.path.realpath(__file__))))
+
+from tokyocabinetdriver import TokyocabinetDriver
+
+def main():
+	parser = optparse.OptionParser(description="Add a server to a Tokyo Tyrant TPC-C cluster and move warehouses to it")
+	parser.add_option("--config", help="JSON file of the driver settings of the clients")
+	parser.add_option("--server", help="ID of the new server")
+	parser.add_option("--tables", help="JSON file mapping each table of the new server to its host and port")
+	parser.add_option("--debug", action="store_true", default=False)
+	options, args = parser.parse_args()
+	if not options.config or not options.server or not options.tables:
+		parser.error("--config, --server and --tables are required")
+
+	logging.basicConfig(level=logging.DEBUG if options.debug else logging.INFO,
+			format="%(asctime)s [%(funcName)s:%(lineno)03d] %(levelname)-5s: %(message)s")
+	with open(options.config) as f:
+		settings = json.load(f)
+	with open(options.tables) as f:
+		tables = json.load(f)
+
+	ddl = os.path.join(os.path.dirname(os.path.dirname(os.path.realpath(__file__))), "tpcc.sql")
+	driver = TokyocabinetDriver(ddl)
+	config = dict((key, value[1]) for key, value in TokyocabinetDriver.DEFAULT_CONFIG.iteritems())
+	config.update(settings)
+	## Never wipe the cluster being rebalanced
+	config["reset"] = False
+	driver.loadDefaultConfig(config)
+	driver.rebalance(options.server, tables)
+	return 0
+
+if __name__ == "__main__":
+	sys.exit(main())
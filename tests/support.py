@@ -0,0 +1,195 @@
+# -*- coding: utf-8 -*-
+# -----------------------------------------------------------------------
+# Copyright (C) 2011
+# Marcelo Martins
+# http://www.cs.brown.edu/~martins/
+#
+# Permission is hereby granted, free of charge, to any person obtaining
+# a copy of this software and associated documentation files (the
+# "Software"), to deal in the Software without restriction, including
+# without limitation the rights to use, copy, modify, merge, publish,
+# distribute, sublicense, and/or sell copies of the Software, and to
+# permit persons to whom the Software is furnished to do so, subject to
+# the following conditions:
+#
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT
+# IN NO EVENT SHALL THE AUTHORS BE LIABLE FOR ANY CLAIM, DAMAGES OR
+# OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE,
+# ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR
+# OTHER DEALINGS IN THE SOFTWARE.
+# -----------------------------------------------------------------------
+
+"""Stand-in clusters, driver configurations and a small TPC-C dataset for
+the tests"""
+
+from __future__ import with_statement
+
+import os
+import sys
+import threading
+import unittest
+
+from tyrantserver import startServers
+
+## The driver runs inside py-tpcc's drivers directory and imports the
+## framework from there (see tcbenchmark.py)
+sys.path.append(os.path.dirname(os.path.dirname(os.path.dirname(os.path.realpath(__file__)))))
+try:
+	import constants
+	import tokyocabinetdriver
+except ImportError:
+	constants = tokyocabinetdriver = None
+
+needsDriver = unittest.skipIf(tokyocabinetdriver is None, "the driver needs py-tpcc's abstractdriver and constants")
+try:
+	from runtime import loader
+	from util import scaleparameters
+except ImportError:
+	loader = scaleparameters = None
+
+needsLoader = unittest.skipIf(loader is None, "loadPartitioned needs py-tpcc's loader")
+
+## Size of the test dataset
+NUM_ITEMS = 50
+CUSTOMERS_PER_DISTRICT = 6
+LINES_PER_ORDER = 3
+## Orders of each district: one per customer, the last NEW_ORDERS of them
+## still undelivered
+NEW_ORDERS = 2
+
+## Seconds a test waits for its threads before it calls them deadlocked
+TIMEOUT = 30.0
+
+class Cluster(object):
+	"""numServers stand-in servers, each with a database per table and
+	   replicas replicas of every database. databases and replicaMaps are
+	   laid out like the servers and replicas settings of the driver."""
+
+	TABLES = ("ITEM", "WAREHOUSE", "DISTRICT", "CUSTOMER", "HISTORY", "STOCK",
+			"ORDERS", "NEW_ORDER", "ORDER_LINE", "LAYOUT")
+
+	def __init__(self, numServers=1, replicas=0):
+		self.servers = startServers(numServers * len(Cluster.TABLES), replicas=replicas)
+		self.databases = dict()
+		self.replicaMaps = dict()
+		for i in xrange(numServers):
+			servers = self.servers[i*len(Cluster.TABLES):(i+1)*len(Cluster.TABLES)]
+			serverId = "Server%d" % (i+1)
+			self.databases[serverId] = dict((tableName, address(s)) for tableName, s in zip(Cluster.TABLES, servers))
+			if replicas:
+				self.replicaMaps[serverId] = [ dict((tableName, address(s.replicas[j]))
+						for tableName, s in zip(Cluster.TABLES, servers)) for j in xrange(replicas) ]
+		## FOR
+
+	def addServer(self):
+		"""Start the databases of one more server and return its table map,
+		   for rebalancing"""
+		servers = startServers(len(Cluster.TABLES))
+		self.servers.extend(servers)
+		return dict((tableName, address(s)) for tableName, s in zip(Cluster.TABLES, servers))
+
+	def close(self):
+		servers = [ ]
+		for s in self.servers:
+			servers.append(s)
+			servers.extend(s.replicas)
+		runAll([ s.shutdown for s in servers ])
+		for s in servers:
+			s.server_close()
+
+## CLASS
+
+def address(server):
+	host, port = server.server_address
+	return {"host": host, "port": port}
+
+##-----------------------------------------------
+## runAll
+##-----------------------------------------------
+def runAll(functions, timeout=TIMEOUT):
+	"""Call every function in a thread of its own and wait for them.
+	   Returns the names of the threads still running after timeout
+	   seconds and the exceptions the others raised"""
+	errors = [ ]
+	def run(function):
+		try:
+			function()
+		except Exception, err:
+			errors.append(err)
+	threads = [ threading.Thread(target=run, args=(f,), name="Worker%d" % i) for i, f in enumerate(functions) ]
+	for t in threads:
+		t.daemon = True
+		t.start()
+	for t in threads:
+		t.join(timeout)
+	return [ t.name for t in threads if t.is_alive() ], errors
+
+##-----------------------------------------------
+## makeDriver
+##-----------------------------------------------
+def makeDriver(cluster, **settings):
+	"""A driver on cluster with the default configuration changed by
+	   settings"""
+	driver = tokyocabinetdriver.TokyocabinetDriver("tpcc.sql")
+	config = dict((key, value[1]) for key, value in tokyocabinetdriver.TokyocabinetDriver.DEFAULT_CONFIG.iteritems())
+	config["servers"] = dict(cluster.databases)
+	config["replicas"] = cluster.replicaMaps
+	config["stats"] = False
+	config["reset"] = False
+	config.update(settings)
+	driver.loadDefaultConfig(config)
+	return driver
+
+##-----------------------------------------------
+## loadWarehouses
+##-----------------------------------------------
+def loadWarehouses(driver, w_ids):
+	"""Load a small dataset for warehouses w_ids through the driver, as
+	   py-tpcc's loader does, and finish the load"""
+	now = "2011-01-01 00:00:00"
+	driver.loadTuples(constants.TABLENAME_ITEM, [ (i, i, "item%d" % i, 1.0 + i, "ORIGINAL" if i % 10 == 0 else "data%d" % i)
+			for i in xrange(1, NUM_ITEMS+1) ])
+	for w_id in w_ids:
+		driver.loadTuples(constants.TABLENAME_WAREHOUSE, [ (w_id, "w%d" % w_id, "s1", "s2", "city", "st", "123451111", 0.1, 300000.0) ])
+		driver.loadTuples(constants.TABLENAME_STOCK, [ (i, w_id, 50) + tuple("dist%02d" % d for d in xrange(1, 11)) + (0, 0, 0, "stock")
+				for i in xrange(1, NUM_ITEMS+1) ])
+		for d_id in xrange(1, constants.DISTRICTS_PER_WAREHOUSE+1):
+			numOrders = CUSTOMERS_PER_DISTRICT
+			driver.loadTuples(constants.TABLENAME_DISTRICT, [ (d_id, w_id, "d%d" % d_id, "s1", "s2", "city", "st",
+					"123451111", 0.05, 30000.0, numOrders+1) ])
+			driver.loadTuples(constants.TABLENAME_CUSTOMER, [ (c_id, d_id, w_id, "first%d" % c_id, "OE", "NAME%d" % (c_id % 3),
+					"s1", "s2", "city", "st", "123451111", "555", now, "BC" if c_id % 2 else "GC", 50000.0, 0.1,
+					-10.0, 10.0, 1, 0, "data") for c_id in xrange(1, CUSTOMERS_PER_DISTRICT+1) ])
+			driver.loadTuples(constants.TABLENAME_HISTORY, [ (c_id, d_id, w_id, d_id, w_id, now, 10.0, "history")
+					for c_id in xrange(1, CUSTOMERS_PER_DISTRICT+1) ])
+			driver.loadTuples(constants.TABLENAME_ORDERS, [ (o_id, o_id, d_id, w_id, now,
+					None if o_id > numOrders - NEW_ORDERS else 1, LINES_PER_ORDER, 1) for o_id in xrange(1, numOrders+1) ])
+			driver.loadTuples(constants.TABLENAME_NEW_ORDER, [ (o_id, d_id, w_id)
+					for o_id in xrange(numOrders - NEW_ORDERS + 1, numOrders+1) ])
+			driver.loadTuples(constants.TABLENAME_ORDER_LINE, [ (o_id, d_id, w_id, n, (o_id * n) % NUM_ITEMS + 1, w_id,
+					now, 5, 10.0, "info") for o_id in xrange(1, numOrders+1) for n in xrange(1, LINES_PER_ORDER+1) ])
+			driver.loadFinishDistrict(w_id, d_id)
+		## FOR
+	## FOR
+	driver.loadFinish()
+
+##-----------------------------------------------
+## Transaction parameters
+##-----------------------------------------------
+def newOrderParams(w_id, i_w_ids, d_id=1, c_id=1):
+	"""NEW_ORDER of one line per supplying warehouse in i_w_ids"""
+	return {"w_id": w_id, "d_id": d_id, "c_id": c_id, "o_entry_d": "2011-01-02 00:00:00",
+			"i_ids": [ (i * 7) % NUM_ITEMS + 1 for i in xrange(len(i_w_ids)) ],
+			"i_w_ids": list(i_w_ids), "i_qtys": [ 5 ] * len(i_w_ids)}
+
+def paymentParams(w_id, c_w_id=None, d_id=1, c_id=1, c_last=None):
+	return {"w_id": w_id, "d_id": d_id, "h_amount": 10.0, "c_w_id": c_w_id or w_id, "c_d_id": d_id,
+			"c_id": c_id if c_last is None else None, "c_last": c_last, "h_date": "2011-01-02 00:00:00"}
+
+def deliveryParams(w_id):
+	return {"w_id": w_id, "o_carrier_id": 3, "ol_delivery_d": "2011-01-02 00:00:00"}
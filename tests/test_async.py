@@ -0,0 +1,173 @@
+# -*- coding: utf-8 -*-
+# -----------------------------------------------------------------------
+# Copyright (C) 2011
+# Marcelo Martins
+# http://www.cs.brown.edu/~martins/
+#
+# Permission is hereby granted, free of charge, to any person obtaining
+# a copy of this software and associated documentation files (the
+# "Software"), to deal in the Software without restriction, including
+# without limitation the rights to use, copy, modify, merge, publish,
+# distribute, sublicense, and/or sell copies of the Software, and to
+# permit persons to whom the Software is furnished to do so, subject to
+# the following conditions:
+#
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT
+# IN NO EVENT SHALL THE AUTHORS BE LIABLE FOR ANY CLAIM, DAMAGES OR
+# OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE,
+# ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR
+# OTHER DEALINGS IN THE SOFTWARE.
+# -----------------------------------------------------------------------
+
+from __future__ import with_statement
+
+import time
+import unittest
+
+from tests.support import Cluster, needsDriver, makeDriver, loadWarehouses, newOrderParams, paymentParams, \
+		NUM_ITEMS, CUSTOMERS_PER_DISTRICT, constants, tokyocabinetdriver
+from tyrantasync import EventLoop, Future, Return
+from tyrantcodec import CUSTOMER_KEY, nextOrderIdKey
+from tyrantpool import ServerConnection
+
+class Transactions(object):
+	"""Stands in for py-tpcc's Executor: hands out the given (txn, params)
+	   in turn, then None"""
+
+	def __init__(self, txns):
+		self.txns = iter(txns)
+
+	def doOne(self):
+		return next(self.txns, None)
+
+## CLASS
+
+class Results(object):
+	"""Stands in for py-tpcc's Results"""
+
+	def __init__(self):
+		self.running = dict()
+		self.completed = [ ]
+		self.aborted = [ ]
+
+	def startBenchmark(self):
+		return time.time()
+
+	def stopBenchmark(self):
+		pass
+
+	def startTransaction(self, txn):
+		txn_id = len(self.running) + len(self.completed) + len(self.aborted)
+		self.running[txn_id] = txn
+		return txn_id
+
+	def stopTransaction(self, txn_id):
+		self.completed.append(self.running.pop(txn_id))
+
+	def abortTransaction(self, txn_id):
+		self.aborted.append(self.running.pop(txn_id))
+
+## CLASS
+
+class EventLoopTest(unittest.TestCase):
+	"""Generator tasks on the EventLoop"""
+
+	def testConcurrentTasks(self):
+		loop = EventLoop()
+		order = [ ]
+		def task(name, delay):
+			yield loop.sleep(delay)
+			order.append(name)
+			raise Return(name)
+		def main():
+			## A list of tasks runs them all at once
+			names = yield [ task("slow", 0.05), task("fast", 0.01) ]
+			raise Return(names)
+		start = time.time()
+		self.assertEqual(loop.runUntilComplete(main()), [ "slow", "fast" ])
+		self.assertEqual(order, [ "fast", "slow" ])
+		self.assertTrue(time.time() - start < 0.5)
+
+	def testErrorThrownIntoTask(self):
+		loop = EventLoop()
+		future = Future()
+		def fail():
+			yield loop.sleep(0)
+			raise KeyError("missing")
+		def main():
+			try:
+				yield fail()
+			except KeyError:
+				future.setResult("caught")
+			raise Return((yield future))
+		self.assertEqual(loop.runUntilComplete(main()), "caught")
+
+## CLASS
+
+@needsDriver
+class ExecuteAsyncTest(unittest.TestCase):
+	"""Transactions run by executeAsync's terminals"""
+
+	def setUp(self):
+		self.cluster = Cluster(1)
+		self.driver = makeDriver(self.cluster, async_terminals=4)
+		loadWarehouses(self.driver, [ 1 ])
+		self.conn = ServerConnection("Server1", self.cluster.databases["Server1"], codecs=tokyocabinetdriver.CODECS)
+
+	def tearDown(self):
+		self.conn.close()
+		self.driver.executeFinish()
+		self.cluster.close()
+
+	def runAsync(self, txns):
+		r = Results()
+		self.driver.executeAsync(None, None, Transactions(txns), r)
+		self.assertEqual(r.running, { })
+		return r
+
+	def customerPayments(self):
+		return [ self.conn["CUSTOMER"][CUSTOMER_KEY.encode(1, 1, c_id)]["C_YTD_PAYMENT"]
+				for c_id in xrange(1, CUSTOMERS_PER_DISTRICT+1) ]
+
+	def testNewOrderAndPayment(self):
+		c_ytd = self.customerPayments()
+		txns = [ ]
+		for c_id in xrange(1, CUSTOMERS_PER_DISTRICT+1):
+			txns.append((constants.TransactionTypes.NEW_ORDER, newOrderParams(1, [ 1, 1 ], c_id=c_id)))
+			txns.append((constants.TransactionTypes.PAYMENT, paymentParams(1, c_id=c_id)))
+		txns.append((constants.TransactionTypes.STOCK_LEVEL, {"w_id": 1, "d_id": 1, "threshold": 20}))
+		r = self.runAsync(txns)
+		self.assertEqual(r.aborted, [ ])
+		self.assertEqual(len(r.completed), len(txns))
+		## Every order got an ID of its own
+		next_o_id = int(self.conn["DISTRICT"].handle[nextOrderIdKey(1, 1)]["_num"])
+		self.assertEqual(next_o_id, 2 * CUSTOMERS_PER_DISTRICT + 1)
+		## Every customer was paid once. W_YTD and D_YTD are read and
+		## written back, as by doPayment, so concurrent PAYMENTs of a
+		## warehouse are only checked on their customers.
+		self.assertEqual(self.customerPayments(), [ ytd + paymentParams(1)["h_amount"] for ytd in c_ytd ])
+
+	def testItemsReadOnLoop(self):
+		## NEW_ORDER on the loop never takes a blocking connection, not even
+		## to fill the item cache
+		def blocked(serverId):
+			raise AssertionError("blocking connection to %s taken on the event loop" % serverId)
+		self.driver.pool.get = blocked
+		params = newOrderParams(1, [ 1 ])
+		params["i_ids"] = [ NUM_ITEMS + 1 ]
+		txns = [ (constants.TransactionTypes.NEW_ORDER, newOrderParams(1, [ 1, 1, 1 ])) for i in xrange(8) ]
+		r = self.runAsync(txns + [ (constants.TransactionTypes.NEW_ORDER, params) ])
+		self.assertEqual(r.aborted, [ ])
+		self.assertEqual(len(r.completed), 9)
+		self.assertEqual(len(self.driver.items), NUM_ITEMS)
+		self.assertEqual(self.driver.itemsLoading, None)
+
+## CLASS
+
+if __name__ == "__main__":
+	unittest.main()
@@ -0,0 +1,109 @@
+# -*- coding: utf-8 -*-
+# -----------------------------------------------------------------------
+# Copyright (C) 2011
+# Marcelo Martins
+# http://www.cs.brown.edu/~martins/
+#
+# Permission is hereby granted, free of charge, to any person obtaining
+# a copy of this software and associated documentation files (the
+# "Software"), to deal in the Software without restriction, including
+# without limitation the rights to use, copy, modify, merge, publish,
+# distribute, sublicense, and/or sell copies of the Software, and to
+# permit persons to whom the Software is furnished to do so, subject to
+# the following conditions:
+#
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT
+# IN NO EVENT SHALL THE AUTHORS BE LIABLE FOR ANY CLAIM, DAMAGES OR
+# OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE,
+# ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR
+# OTHER DEALINGS IN THE SOFTWARE.
+# -----------------------------------------------------------------------
+
+from __future__ import with_statement
+
+import unittest
+
+from tests.support import Cluster, needsDriver, makeDriver, loadWarehouses, newOrderParams, NUM_ITEMS, \
+		CUSTOMERS_PER_DISTRICT, constants
+from tyrantcache import ItemCache
+from tyrantpool import ServerConnection
+
+def item(i_id):
+	return {"I_ID": i_id, "I_IM_ID": i_id, "I_NAME": u"item%d" % i_id, "I_PRICE": 1.0 + i_id, "I_DATA": u"data%d" % i_id}
+
+class ItemCacheTest(unittest.TestCase):
+	"""The in-process copy of ITEM"""
+
+	def testGet(self):
+		cache = ItemCache()
+		## Out of order, with a gap at 3
+		cache.load([ item(i_id) for i_id in (5, 1, 2, 4) ])
+		self.assertEqual(len(cache), 4)
+		for i_id in (1, 2, 4, 5):
+			self.assertEqual(cache.get(i_id), (1.0 + i_id, u"item%d" % i_id, u"data%d" % i_id))
+		for i_id in (-1, 0, 3, 6, 1000):
+			self.assertEqual(cache.get(i_id), None)
+
+	def testEmpty(self):
+		cache = ItemCache()
+		cache.load([ ])
+		self.assertEqual(len(cache), 0)
+		self.assertEqual(cache.get(1), None)
+
+	def testEmptyStrings(self):
+		cache = ItemCache()
+		cache.load([ dict(item(1), I_NAME=u""), item(2), dict(item(3), I_DATA=u"") ])
+		self.assertEqual(cache.get(1), (2.0, u"", u"data1"))
+		self.assertEqual(cache.get(2), (3.0, u"item2", u"data2"))
+		self.assertEqual(cache.get(3), (4.0, u"item3", u""))
+
+## CLASS
+
+@needsDriver
+class DriverItemCacheTest(unittest.TestCase):
+	"""NEW_ORDER reading its items from the driver's ItemCache"""
+
+	def setUp(self):
+		self.cluster = Cluster(1)
+		self.driver = makeDriver(self.cluster)
+		loadWarehouses(self.driver, [ 1 ])
+
+	def tearDown(self):
+		self.driver.executeFinish()
+		self.cluster.close()
+
+	def newOrder(self, params):
+		return self.driver.executeTransaction(constants.TransactionTypes.NEW_ORDER, params)
+
+	def testItemsReadOnce(self):
+		params = newOrderParams(1, [ 1, 1, 1 ])
+		customerInfo, misc, first = self.newOrder(params)
+		self.assertEqual(len(self.driver.items), NUM_ITEMS)
+		self.assertEqual([ d[0] for d in first ], [ "item%d" % i_id for i_id in params["i_ids"] ])
+
+		## Later orders never go back to the ITEM table
+		conn = ServerConnection("Server1", self.cluster.databases["Server1"])
+		try:
+			conn[constants.TABLENAME_ITEM].clear()
+		finally:
+			conn.close()
+		customerInfo, misc, second = self.newOrder(params)
+		self.assertEqual([ (d[0], d[3]) for d in second ], [ (d[0], d[3]) for d in first ])
+
+	def testInvalidItemRollsBack(self):
+		params = newOrderParams(1, [ 1, 1 ])
+		params["i_ids"][-1] = NUM_ITEMS + 1
+		self.assertEqual(self.newOrder(params), None)
+		## Nothing was written: the next order gets the first free ID
+		customerInfo, misc, item_data = self.newOrder(newOrderParams(1, [ 1 ]))
+		self.assertEqual(misc[0][2], CUSTOMERS_PER_DISTRICT + 1)
+
+## CLASS
+
+if __name__ == "__main__":
+	unittest.main()
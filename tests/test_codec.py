@@ -0,0 +1,125 @@
+# -*- coding: utf-8 -*-
+# -----------------------------------------------------------------------
+# Copyright (C) 2011
+# Marcelo Martins
+# http://www.cs.brown.edu/~martins/
+#
+# Permission is hereby granted, free of charge, to any person obtaining
+# a copy of this software and associated documentation files (the
+# "Software"), to deal in the Software without restriction, including
+# without limitation the rights to use, copy, modify, merge, publish,
+# distribute, sublicense, and/or sell copies of the Software, and to
+# permit persons to whom the Software is furnished to do so, subject to
+# the following conditions:
+#
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT
+# IN NO EVENT SHALL THE AUTHORS BE LIABLE FOR ANY CLAIM, DAMAGES OR
+# OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE,
+# ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR
+# OTHER DEALINGS IN THE SOFTWARE.
+# -----------------------------------------------------------------------
+
+import itertools
+import unittest
+
+from tyrantcodec import KeyFormat, RecordCodec, DISTRICT_KEY, CUSTOMER_KEY, NEW_ORDER_KEY, ORDER_LINE_KEY, \
+		COLUMN_SEP, PACKED_COLUMN, nextOrderIdKey, customerNameKey, newOrderHeadKey
+
+class KeyFormatTest(unittest.TestCase):
+	"""Fixed-width primary keys"""
+
+	def testRoundTrip(self):
+		for values in [ (0, 0, 0, 0), (1, 10, 255, 15), (0xffff, 0xf, 0xffffff, 0xf) ]:
+			key = ORDER_LINE_KEY.encode(*values)
+			self.assertEqual(len(key), ORDER_LINE_KEY.width)
+			self.assertEqual(ORDER_LINE_KEY.decode(key), values)
+			self.assertEqual(type(key), str)
+
+	def testSortsLikeTuples(self):
+		values = list(itertools.product([ 1, 2, 10, 16, 300 ], [ 1, 9, 10 ], [ 1, 15, 16, 4096 ]))
+		keys = [ CUSTOMER_KEY.encode(*v) for v in values ]
+		self.assertEqual(sorted(values), [ CUSTOMER_KEY.decode(k) for k in sorted(keys) ])
+
+	def testPrefix(self):
+		fmt = KeyFormat(("A", 2), ("B", 3), ("C", 1))
+		self.assertEqual(fmt.prefix(), "")
+		self.assertEqual(fmt.prefix(1), "01")
+		self.assertEqual(fmt.prefix(1, 0x1a), "0101a")
+		self.assertEqual(fmt.prefix(1, 0x1a, 2), fmt.encode(1, 0x1a, 2))
+		## The prefix of one order never matches the lines of another order
+		## whose ID starts with the same digits
+		prefix = ORDER_LINE_KEY.prefix(1, 1, 1)
+		self.assertTrue(ORDER_LINE_KEY.encode(1, 1, 1, 5).startswith(prefix))
+		self.assertFalse(ORDER_LINE_KEY.encode(1, 1, 0x10, 1).startswith(prefix))
+		self.assertFalse(ORDER_LINE_KEY.encode(1, 1, 0x100000, 1).startswith(prefix))
+
+	def testSpecialKeys(self):
+		## Counter, name index and queue head records never collide with
+		## the rows of their tables, and sort after a whole district's rows
+		self.assertNotEqual(len(nextOrderIdKey(1, 1)), DISTRICT_KEY.width)
+		self.assertTrue(nextOrderIdKey(1, 1) > DISTRICT_KEY.encode(1, 1))
+		self.assertTrue(nextOrderIdKey(1, 1) < DISTRICT_KEY.encode(1, 2))
+		nameKey = customerNameKey(1, 1, "BARBARBAR")
+		self.assertTrue(nameKey.startswith(CUSTOMER_KEY.prefix(1, 1)))
+		self.assertTrue(nameKey > CUSTOMER_KEY.encode(1, 1, 0xffff))
+		headKey = newOrderHeadKey(1, 1)
+		self.assertTrue(headKey.startswith(NEW_ORDER_KEY.prefix(1, 1)))
+		self.assertTrue(headKey > NEW_ORDER_KEY.encode(1, 1, 0xffffff))
+		self.assertTrue(headKey < NEW_ORDER_KEY.encode(1, 2, 0))
+
+## CLASS
+
+class RecordCodecTest(unittest.TestCase):
+	"""Named and packed columns of table records"""
+
+	COLUMNS = [ ("O_ID", "INTEGER"), ("O_C_ID", "INTEGER"), ("O_ENTRY_D", "TIMESTAMP"),
+			("O_CARRIER_ID", "INTEGER"), ("O_OL_CNT", "INTEGER"), ("O_TOTAL", "FLOAT"), ("O_NOTE", "VARCHAR") ]
+
+	def setUp(self):
+		self.codec = RecordCodec(self.COLUMNS, [ "O_ID", "O_C_ID" ])
+
+	def columns(self, data):
+		elems = data.split(COLUMN_SEP)
+		return dict(zip(elems[::2], elems[1::2]))
+
+	def testRoundTrip(self):
+		row = (5, 7, "2011-01-01 00:00:00", None, 3, 10.5, "note")
+		data = self.codec.pack(row)
+		self.assertEqual(self.columns(data), {"O_ID": "5", "O_C_ID": "7", PACKED_COLUMN: '["2011-01-01 00:00:00",null,3,10.5,"note"]'})
+		record = self.codec.unpack(data)
+		self.assertEqual(record, dict(zip([ name for name, sqlType in self.COLUMNS ], row)))
+		self.assertEqual(type(record["O_TOTAL"]), float)
+		self.assertEqual(self.columns(self.codec.packRecord(record)), self.columns(data))
+
+	def testSmallerThanNamed(self):
+		row = (5, 7, "2011-01-01 00:00:00", 1, 3, 10.5, "note")
+		self.assertTrue(len(self.codec.pack(row)) < len(RecordCodec(self.COLUMNS).pack(row)))
+
+	def testNulls(self):
+		## Trailing NULLs are left out of the array; a record with no packed
+		## values has no packed column
+		data = self.codec.packRecord({"O_ID": 5, "O_ENTRY_D": "now"})
+		self.assertEqual(self.columns(data)[PACKED_COLUMN], '["now"]')
+		data = self.codec.packRecord({"O_ID": 5, "_num": 3})
+		self.assertEqual(self.columns(data), {"O_ID": "5", "_num": "3"})
+		record = self.codec.unpack(data)
+		self.assertEqual((record["O_ID"], record["O_NOTE"], record["_num"]), (5, None, "3"))
+		self.assertEqual(self.codec.unpack(""), dict.fromkeys(name for name, sqlType in self.COLUMNS))
+
+	def testDecode(self):
+		## Queries and searches return the stored columns as a dict
+		data = self.codec.pack((5, 7, None, None, 3, 10.0, None))
+		record = self.codec.decode(self.columns(data))
+		self.assertEqual(record, self.codec.unpack(data))
+		self.assertEqual(self.codec.stored, [ "O_ID", "O_C_ID", PACKED_COLUMN ])
+		self.assertEqual(RecordCodec(self.COLUMNS).stored, [ name for name, sqlType in self.COLUMNS ])
+
+## CLASS
+
+if __name__ == "__main__":
+	unittest.main()
@@ -0,0 +1,162 @@
+# -*- coding: utf-8 -*-
+# -----------------------------------------------------------------------
+# Copyright (C) 2011
+# Marcelo Martins
+# http://www.cs.brown.edu/~martins/
+#
+# Permission is hereby granted, free of charge, to any person obtaining
+# a copy of this software and associated documentation files (the
+# "Software"), to deal in the Software without restriction, including
+# without limitation the rights to use, copy, modify, merge, publish,
+# distribute, sublicense, and/or sell copies of the Software, and to
+# permit persons to whom the Software is furnished to do so, subject to
+# the following conditions:
+#
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT
+# IN NO EVENT SHALL THE AUTHORS BE LIABLE FOR ANY CLAIM, DAMAGES OR
+# OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE,
+# ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR
+# OTHER DEALINGS IN THE SOFTWARE.
+# -----------------------------------------------------------------------
+
+from __future__ import with_statement
+
+import threading
+import time
+import unittest
+
+from tests.support import Cluster, needsDriver, runAll, makeDriver, loadWarehouses, paymentParams, constants
+from tyrantasync import AsyncPool, EventLoop
+from tyrantcommit import CommitPolicy
+from tyrantpool import ConnectionPool
+
+class RecordingPolicy(CommitPolicy):
+	"""Notes when each sync finished and fails the first failures of them"""
+
+	def __init__(self, *args, **kwargs):
+		self.failures = kwargs.pop("failures", 0)
+		CommitPolicy.__init__(self, *args, **kwargs)
+		self.finished = [ ]
+
+	def sync(self, dirty, connection):
+		time.sleep(0.05)
+		if self.failures:
+			self.failures -= 1
+			raise IOError("sync failed")
+		CommitPolicy.sync(self, dirty, connection)
+		self.finished.append(time.time())
+
+## CLASS
+
+class GroupCommitTest(unittest.TestCase):
+
+	def setUp(self):
+		self.cluster = Cluster(1)
+		self.pool = ConnectionPool(self.cluster.databases, size=1)
+
+	def tearDown(self):
+		self.cluster.close()
+
+	def commitAll(self, policy, numThreads):
+		returned = [ ]
+		def commit():
+			policy.commit([ ("Server1", "STOCK"), ("Server1", "DISTRICT") ])
+			returned.append(time.time())
+		missing, errors = runAll([ commit ] * numThreads)
+		self.assertEqual(missing, [ ], "group commit deadlocked")
+		self.assertEqual(errors, [ ])
+		return returned
+
+	def testCommitWaitsForTheGroupSync(self):
+		policy = RecordingPolicy(self.pool, "group", groupSize=100, interval=0.05)
+		## Every connection of the pool is held: the group syncs on its own
+		held = self.pool.checkout("Server1")
+		try:
+			returned = self.commitAll(policy, 8)
+		finally:
+			self.pool.checkin(held)
+		policy.close()
+		self.assertTrue(policy.finished)
+		self.assertTrue(min(returned) >= policy.finished[0])
+		## One sync per table covers a whole group
+		self.assertEqual(policy.syncs, 2 * policy.groups)
+		self.assertTrue(policy.groups < 8)
+
+	def testFailedSyncIsRetried(self):
+		policy = RecordingPolicy(self.pool, "group", groupSize=100, interval=0.05, failures=1)
+		returned = self.commitAll(policy, 4)
+		policy.close()
+		self.assertEqual(len(policy.finished), policy.groups)
+		self.assertTrue(min(returned) >= policy.finished[0])
+
+	def testFailedLastSyncIsRaised(self):
+		policy = RecordingPolicy(self.pool, "group", groupSize=100, interval=10.0, failures=1)
+		errors = [ ]
+		def commit():
+			try:
+				policy.commit([ ("Server1", "STOCK") ])
+			except RuntimeError, err:
+				errors.append(err)
+		thread = threading.Thread(target=commit)
+		thread.daemon = True
+		thread.start()
+		time.sleep(0.1)
+		policy.close()
+		thread.join(5.0)
+		self.assertFalse(thread.is_alive())
+		self.assertEqual(len(errors), 1)
+
+	def testAsyncCommitWaitsForTheGroupSync(self):
+		policy = RecordingPolicy(self.pool, "group", groupSize=100, interval=0.05)
+		loop = EventLoop()
+		asyncPool = AsyncPool(loop, self.cluster.databases)
+		def task():
+			yield policy.commitAsync(asyncPool, [ ("Server1", "STOCK") ])
+			self.assertTrue(policy.finished)
+		loop.runUntilComplete([ task() for i in xrange(4) ])
+		policy.close()
+		asyncPool.close()
+		self.assertEqual(policy.groups, 1)
+
+## CLASS
+
+@needsDriver
+class DriverCommitTest(unittest.TestCase):
+	"""PAYMENT on more threads than the pool has connections"""
+
+	def setUp(self):
+		self.cluster = Cluster(1)
+
+	def tearDown(self):
+		self.cluster.close()
+
+	def runPayments(self, **settings):
+		driver = makeDriver(self.cluster, **settings)
+		loadWarehouses(driver, [ 1 ])
+		def terminal(d_id):
+			for i in xrange(5):
+				driver.executeTransaction(constants.TransactionTypes.PAYMENT, paymentParams(1, d_id=d_id))
+		missing, errors = runAll([ lambda d_id=d_id: terminal(d_id) for d_id in xrange(1, 9) ])
+		driver.executeFinish()
+		self.assertEqual(missing, [ ], "PAYMENT deadlocked with %s" % settings)
+		self.assertEqual(errors, [ ])
+		return driver
+
+	def testTransactionCommit(self):
+		for poolSize in (1, 4):
+			driver = self.runPayments(commit="transaction", pool_size=poolSize)
+			self.assertTrue(driver.committer.syncs >= 8 * 5)
+
+	def testGroupCommit(self):
+		driver = self.runPayments(commit="group", pool_size=1, group_interval=20)
+		self.assertTrue(driver.committer.groups > 0)
+
+## CLASS
+
+if __name__ == "__main__":
+	unittest.main()
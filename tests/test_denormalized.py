@@ -0,0 +1,115 @@
+# -*- coding: utf-8 -*-
+# -----------------------------------------------------------------------
+# Copyright (C) 2011
+# Marcelo Martins
+# http://www.cs.brown.edu/~martins/
+#
+# Permission is hereby granted, free of charge, to any person obtaining
+# a copy of this software and associated documentation files (the
+# "Software"), to deal in the Software without restriction, including
+# without limitation the rights to use, copy, modify, merge, publish,
+# distribute, sublicense, and/or sell copies of the Software, and to
+# permit persons to whom the Software is furnished to do so, subject to
+# the following conditions:
+#
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT
+# IN NO EVENT SHALL THE AUTHORS BE LIABLE FOR ANY CLAIM, DAMAGES OR
+# OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE,
+# ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR
+# OTHER DEALINGS IN THE SOFTWARE.
+# -----------------------------------------------------------------------
+
+from __future__ import with_statement
+
+import unittest
+
+from tests.support import Cluster, needsDriver, runAll, makeDriver, loadWarehouses, newOrderParams, paymentParams, \
+		deliveryParams, CUSTOMERS_PER_DISTRICT, LINES_PER_ORDER, constants
+from tyrantcodec import customerOrderKey
+from tyrantpool import ServerConnection
+
+@needsDriver
+class DenormalizedTest(unittest.TestCase):
+	"""Orders stored with their lines next to their customers"""
+
+	def setUp(self):
+		self.cluster = Cluster(1)
+		self.driver = makeDriver(self.cluster, denormalize=True)
+		loadWarehouses(self.driver, [ 1 ])
+		self.conn = ServerConnection("Server1", self.cluster.databases["Server1"])
+
+	def tearDown(self):
+		self.conn.close()
+		self.driver.executeFinish()
+		self.cluster.close()
+
+	def orderStatus(self, c_id, d_id=1):
+		return self.driver.executeTransaction(constants.TransactionTypes.ORDER_STATUS,
+				{"w_id": 1, "d_id": d_id, "c_id": c_id, "c_last": None})
+
+	def orderKeys(self, c_id, d_id=1):
+		return self.conn["CUSTOMER"].proto.fwmkeys(customerOrderKey(1, d_id, c_id), 1000)
+
+	def deliverAll(self):
+		while self.driver.executeTransaction(constants.TransactionTypes.DELIVERY, deliveryParams(1)):
+			pass
+
+	def testRoundTrip(self):
+		customer, order, lines = self.orderStatus(CUSTOMERS_PER_DISTRICT)
+		self.assertEqual(int(order["O_ID"]), CUSTOMERS_PER_DISTRICT)
+		self.assertEqual(order["O_CARRIER_ID"], None)
+		self.assertEqual(len(lines), LINES_PER_ORDER)
+
+		self.driver.executeTransaction(constants.TransactionTypes.NEW_ORDER, newOrderParams(1, [ 1, 1 ], c_id=1))
+		customer, order, lines = self.orderStatus(1)
+		self.assertEqual(int(order["O_ID"]), CUSTOMERS_PER_DISTRICT + 1)
+		self.assertEqual(len(lines), 2)
+		balance = customer["C_BALANCE"]
+
+		self.deliverAll()
+		customer, order, lines = self.orderStatus(1)
+		self.assertEqual(int(order["O_ID"]), CUSTOMERS_PER_DISTRICT + 1)
+		self.assertEqual(order["O_CARRIER_ID"], deliveryParams(1)["o_carrier_id"])
+		self.assertEqual(set(ol["OL_DELIVERY_D"] for ol in lines), set([ deliveryParams(1)["ol_delivery_d"] ]))
+		self.assertAlmostEqual(customer["C_BALANCE"], balance + sum(ol["OL_AMOUNT"] for ol in lines))
+
+	def testDeliveredOrdersArePruned(self):
+		for i in xrange(5):
+			self.driver.executeTransaction(constants.TransactionTypes.NEW_ORDER, newOrderParams(1, [ 1 ], c_id=1))
+		self.assertEqual(len(self.orderKeys(1)), 6)
+		self.deliverAll()
+		## Only the last order is left, delivered
+		self.assertEqual(self.orderKeys(1), [ customerOrderKey(1, 1, 1, CUSTOMERS_PER_DISTRICT + 5) ])
+		customer, order, lines = self.orderStatus(1)
+		self.assertEqual(int(order["O_ID"]), CUSTOMERS_PER_DISTRICT + 5)
+		self.assertEqual(order["O_CARRIER_ID"], deliveryParams(1)["o_carrier_id"])
+
+	def testConcurrentWritesKeepOrders(self):
+		## NEW_ORDER, PAYMENT and DELIVERY all write records of customer 1
+		def newOrders():
+			for i in xrange(20):
+				self.driver.executeTransaction(constants.TransactionTypes.NEW_ORDER, newOrderParams(1, [ 1 ], c_id=1))
+		def payments():
+			for i in xrange(20):
+				self.driver.executeTransaction(constants.TransactionTypes.PAYMENT, paymentParams(1, c_id=1))
+		def deliveries():
+			for i in xrange(20):
+				self.driver.executeTransaction(constants.TransactionTypes.DELIVERY, deliveryParams(1))
+		missing, errors = runAll([ newOrders, newOrders, payments, deliveries, deliveries ])
+		self.assertEqual(missing, [ ])
+		self.assertEqual(errors, [ ])
+		self.deliverAll()
+		customer, order, lines = self.orderStatus(1)
+		self.assertEqual(int(order["O_ID"]), CUSTOMERS_PER_DISTRICT + 40)
+		self.assertEqual(order["O_CARRIER_ID"], deliveryParams(1)["o_carrier_id"])
+		self.assertEqual(self.orderKeys(1), [ customerOrderKey(1, 1, 1, CUSTOMERS_PER_DISTRICT + 40) ])
+
+## CLASS
+
+if __name__ == "__main__":
+	unittest.main()
@@ -0,0 +1,97 @@
+# -*- coding: utf-8 -*-
+# -----------------------------------------------------------------------
+# Copyright (C) 2011
+# Marcelo Martins
+# http://www.cs.brown.edu/~martins/
+#
+# Permission is hereby granted, free of charge, to any person obtaining
+# a copy of this software and associated documentation files (the
+# "Software"), to deal in the Software without restriction, including
+# without limitation the rights to use, copy, modify, merge, publish,
+# distribute, sublicense, and/or sell copies of the Software, and to
+# permit persons to whom the Software is furnished to do so, subject to
+# the following conditions:
+#
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT
+# IN NO EVENT SHALL THE AUTHORS BE LIABLE FOR ANY CLAIM, DAMAGES OR
+# OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE,
+# ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR
+# OTHER DEALINGS IN THE SOFTWARE.
+# -----------------------------------------------------------------------
+
+from __future__ import with_statement
+
+import unittest
+
+from tests.support import Cluster, needsDriver, needsLoader, makeDriver, loadWarehouses, NUM_ITEMS, constants, \
+		scaleparameters
+from tokyocabinetdriver import CODECS, WAREHOUSE_COLUMNS, TABLE_INDEXES
+from tyrantcodec import ITEM_KEY
+from tyrantpool import ServerConnection
+
+@needsDriver
+class LoadTest(unittest.TestCase):
+	"""Loading warehouses onto two servers"""
+
+	def setUp(self):
+		self.cluster = Cluster(2)
+		self.driver = makeDriver(self.cluster, virtual_nodes=1)
+		self.conns = dict((sID, ServerConnection(sID, tables, codecs=CODECS)) for sID, tables in self.cluster.databases.iteritems())
+
+	def tearDown(self):
+		for conn in self.conns.itervalues():
+			conn.close()
+		self.driver.executeFinish()
+		self.cluster.close()
+
+	def testItemOnEveryServer(self):
+		loadWarehouses(self.driver, [ 1, 2 ])
+		for conn in self.conns.itervalues():
+			keys = conn[constants.TABLENAME_ITEM].proto.fwmkeys(ITEM_KEY.prefix(), 1000)
+			self.assertEqual(len(keys), NUM_ITEMS)
+
+	def testIndexes(self):
+		loadWarehouses(self.driver, [ 1, 2 ])
+		for i, tableName in enumerate(Cluster.TABLES):
+			for sID in ("Server1", "Server2"):
+				server = self.cluster.servers[(int(sID[-1]) - 1) * len(Cluster.TABLES) + i]
+				self.assertEqual(sorted(server.db.indexes.keys()), sorted(column for column, kind in TABLE_INDEXES.get(tableName, [ ])))
+		## FOR
+		self.assertEqual(sorted(TABLE_INDEXES.keys()), [ constants.TABLENAME_HISTORY, constants.TABLENAME_ORDERS ])
+
+	def testUnknownServer(self):
+		self.driver.partitioner.pin(1, "Server9")
+		self.assertRaises(KeyError, self.driver.loadTuples, constants.TABLENAME_WAREHOUSE,
+				[ (1, "w1", "s1", "s2", "city", "st", "123451111", 0.1, 300000.0) ])
+
+	@needsLoader
+	def testPartitionedLoad(self):
+		scaleParameters = scaleparameters.makeWithScaleFactor(2, 1000)
+		self.driver.loadPartitioned(scaleParameters)
+		self.assertEqual([ self.driver.getServer(w_id) for w_id in (1, 2) ], [ "Server1", "Server2" ])
+		for tableName, column in WAREHOUSE_COLUMNS.iteritems():
+			for w_id in (1, 2):
+				for sID, conn in self.conns.iteritems():
+					keys = self.driver.warehouseKeys(conn, tableName, w_id)
+					records = conn[tableName].multi_get(keys)
+					count = len([ key for key, record in records if record[column] == w_id ])
+					if sID == self.driver.getServer(w_id):
+						self.assertTrue(count > 0, "no %s rows of warehouse %d" % (tableName, w_id))
+					else:
+						self.assertEqual(count, 0, "%s rows of warehouse %d on server %s" % (tableName, w_id, sID))
+				## FOR
+			## FOR
+		## FOR
+		for conn in self.conns.itervalues():
+			keys = conn[constants.TABLENAME_ITEM].proto.fwmkeys(ITEM_KEY.prefix(), 1000)
+			self.assertEqual(len(keys), scaleParameters.items)
+
+## CLASS
+
+if __name__ == "__main__":
+	unittest.main()
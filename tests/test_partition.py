@@ -0,0 +1,305 @@
+# -*- coding: utf-8 -*-
+# -----------------------------------------------------------------------
+# Copyright (C) 2011
+# Marcelo Martins
+# http://www.cs.brown.edu/~martins/
+#
+# Permission is hereby granted, free of charge, to any person obtaining
+# a copy of this software and associated documentation files (the
+# "Software"), to deal in the Software without restriction, including
+# without limitation the rights to use, copy, modify, merge, publish,
+# distribute, sublicense, and/or sell copies of the Software, and to
+# permit persons to whom the Software is furnished to do so, subject to
+# the following conditions:
+#
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT
+# IN NO EVENT SHALL THE AUTHORS BE LIABLE FOR ANY CLAIM, DAMAGES OR
+# OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE,
+# ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR
+# OTHER DEALINGS IN THE SOFTWARE.
+# -----------------------------------------------------------------------
+
+from __future__ import with_statement
+
+import random
+import threading
+import unittest
+
+from tests.support import Cluster, needsDriver, runAll, makeDriver, loadWarehouses, newOrderParams, paymentParams, \
+		CUSTOMERS_PER_DISTRICT, constants
+from tyrantcodec import ORDERS_KEY, WAREHOUSE_KEY
+from tyrantpartition import RangePartitioner, ConsistentHashPartitioner, TerminalScheduler
+from tyrantlayout import SharedLayout, LAYOUT_TABLE
+from tyrantpool import ServerConnection
+from tyrantstats import WireStats
+
+class PartitionerTest(unittest.TestCase):
+
+	W_IDS = range(1, 65)
+
+	def checkAddServer(self, partitioner):
+		before = dict((w_id, partitioner.getServer(w_id)) for w_id in self.W_IDS)
+		partitioner.addServer("Server3")
+		moved = [ w_id for w_id in self.W_IDS if partitioner.getServer(w_id) != before[w_id] ]
+		self.assertTrue(moved)
+		## Warehouses only move to the new server
+		self.assertEqual(set(partitioner.getServer(w_id) for w_id in moved), set([ "Server3" ]))
+
+	def testRangeAddServer(self):
+		self.checkAddServer(RangePartitioner([ "Server1", "Server2" ], virtualNodes=4))
+
+	def testHashAddServer(self):
+		self.checkAddServer(ConsistentHashPartitioner([ "Server1", "Server2" ], virtualNodes=16))
+
+	def testPinTakesPrecedence(self):
+		partitioner = RangePartitioner([ "Server1", "Server2" ], virtualNodes=1)
+		self.assertEqual(partitioner.getServer(2), "Server2")
+		partitioner.pin(2, "Server1")
+		self.assertEqual(partitioner.getServer(2), "Server1")
+		partitioner.unpin(2)
+		self.assertEqual(partitioner.getServer(2), "Server2")
+
+	def testSchedulerCoversEveryWarehouse(self):
+		partitioner = RangePartitioner([ "Server1", "Server2" ], virtualNodes=4)
+		for numClients in (1, 2, 3, 5):
+			scheduler = TerminalScheduler(partitioner, self.W_IDS, numClients)
+			homes = [ scheduler.home(i) for i in xrange(numClients) ]
+			self.assertEqual(sorted(set(w_id for home in homes for w_id in home)), self.W_IDS)
+			if numClients >= 2:
+				## Every client stays on one server
+				for home in homes:
+					self.assertEqual(len(set(partitioner.getServer(w_id) for w_id in home)), 1)
+		## FOR
+
+## CLASS
+
+class TerminalSchedulerTest(unittest.TestCase):
+	"""Home warehouses of the client processes"""
+
+	def servers(self, partitioner, home):
+		return set(partitioner.getServer(w_id) for w_id in home)
+
+	def testClientsFollowWarehouses(self):
+		## Server1 holds 12 of the 16 warehouses, so it gets 3 of the 4
+		## clients, each with a contiguous slice of them
+		partitioner = RangePartitioner([ "Server1", "Server2" ], virtualNodes=1)
+		w_ids = range(1, 17)
+		for w_id in w_ids[:12]:
+			partitioner.pin(w_id, "Server1")
+		for w_id in w_ids[12:]:
+			partitioner.pin(w_id, "Server2")
+		scheduler = TerminalScheduler(partitioner, w_ids, 4)
+		self.assertEqual([ scheduler.home(i) for i in xrange(4) ],
+				[ range(1, 5), range(5, 9), range(9, 13), range(13, 17) ])
+		## Client IDs beyond numClients wrap around
+		self.assertEqual(scheduler.home(5), scheduler.home(1))
+
+	def testFewerClientsThanServers(self):
+		partitioner = ConsistentHashPartitioner([ "Server1", "Server2", "Server3" ], virtualNodes=16)
+		w_ids = range(1, 31)
+		scheduler = TerminalScheduler(partitioner, w_ids, 2)
+		homes = [ scheduler.home(i) for i in xrange(2) ]
+		self.assertEqual(sorted(homes[0] + homes[1]), w_ids)
+		## A client takes whole servers
+		self.assertFalse(self.servers(partitioner, homes[0]) & self.servers(partitioner, homes[1]))
+
+	def testMoreClientsThanWarehouses(self):
+		partitioner = RangePartitioner([ "Server1", "Server2" ], virtualNodes=1)
+		partitioner.pin(1, "Server1")
+		partitioner.pin(2, "Server2")
+		scheduler = TerminalScheduler(partitioner, [ 1, 2 ], 5)
+		for i in xrange(5):
+			home = scheduler.home(i)
+			self.assertTrue(home)
+			self.assertEqual(len(self.servers(partitioner, home)), 1)
+		## FOR
+
+	def testSameOnEveryClient(self):
+		partitioner = ConsistentHashPartitioner([ "Server1", "Server2" ], virtualNodes=16)
+		w_ids = range(1, 41)
+		shuffled = list(w_ids)
+		random.shuffle(shuffled)
+		one, other = TerminalScheduler(partitioner, w_ids, 3), TerminalScheduler(partitioner, shuffled, 3)
+		self.assertEqual([ one.home(i) for i in xrange(3) ], [ other.home(i) for i in xrange(3) ])
+
+## CLASS
+
+class LayoutTest(unittest.TestCase):
+
+	def setUp(self):
+		self.cluster = Cluster(1)
+		self.conn = ServerConnection("Server1", self.cluster.databases["Server1"])
+		self.drains = [ ]
+		self.layout = SharedLayout(self.conn, LAYOUT_TABLE, lambda state: None, 0.1,
+				lambda: self.drains.append(self.layout.version) or True)
+
+	def tearDown(self):
+		self.conn.close()
+		self.cluster.close()
+
+	def testDrainOnlyWhileFenced(self):
+		self.layout.ack()
+		self.layout.publish({"servers": [ ], "pinned": { }, "fenced": [ ]})
+		self.layout.ack()
+		self.assertEqual(self.drains, [ ])
+		self.layout.publish({"servers": [ ], "pinned": { }, "fenced": [ 1 ]})
+		self.layout.ack()
+		self.assertEqual(self.drains, [ 2 ])
+		self.layout.publish({"servers": [ ], "pinned": { 1: "Server1" }, "fenced": [ ]})
+		self.layout.ack()
+		self.assertEqual(self.drains, [ 2 ])
+		## Everything went to the layout table
+		self.assertEqual(len(self.conn[LAYOUT_TABLE].keys()), 2)
+		self.assertEqual(self.conn["WAREHOUSE"].keys(), [ ])
+
+	@needsDriver
+	def testNotFollowedWithoutRebalance(self):
+		driver = makeDriver(self.cluster)
+		loadWarehouses(driver, [ 1 ])
+		driver.executeTransaction(constants.TransactionTypes.PAYMENT, paymentParams(1))
+		self.assertTrue(driver.layout.thread is None)
+		self.assertEqual(self.conn[LAYOUT_TABLE].keys(), [ ])
+		driver.executeFinish()
+
+## CLASS
+
+@needsDriver
+class RebalanceTest(unittest.TestCase):
+	"""Adding a server while two client processes run transactions"""
+
+	W_IDS = [ 1, 2, 3, 4 ]
+
+	def setUp(self):
+		self.cluster = Cluster(2)
+		settings = {"rebalance": True, "layout_interval": 0.1, "virtual_nodes": 2}
+		self.clients = [ makeDriver(self.cluster, **settings), makeDriver(self.cluster, write_behind=True, **settings) ]
+		self.admin = makeDriver(self.cluster, **settings)
+		loadWarehouses(self.clients[0], self.W_IDS)
+
+	def tearDown(self):
+		for driver in self.clients:
+			driver.executeFinish()
+		self.cluster.close()
+
+	def testRebalanceUnderLoad(self):
+		## Two servers of two virtual nodes each: the third one takes W_ID 4
+		self.assertEqual([ self.admin.getServer(w_id) for w_id in self.W_IDS ], [ "Server1", "Server1", "Server2", "Server2" ])
+		done = threading.Event()
+		lock = threading.Lock()
+		newOrders = dict()
+		payments = dict()
+
+		def terminal(driver, seed):
+			rand = random.Random(seed)
+			while not done.is_set() or sum(newOrders.values()) < 20:
+				w_id = rand.choice(self.W_IDS)
+				d_id = rand.randint(1, constants.DISTRICTS_PER_WAREHOUSE)
+				if rand.random() < 0.5:
+					driver.executeTransaction(constants.TransactionTypes.NEW_ORDER,
+							newOrderParams(w_id, [ w_id, rand.choice(self.W_IDS) ], d_id=d_id))
+					counts = newOrders
+				else:
+					driver.executeTransaction(constants.TransactionTypes.PAYMENT,
+							paymentParams(w_id, rand.choice(self.W_IDS), d_id=d_id))
+					counts = payments
+				with lock:
+					counts[(w_id, d_id)] = counts.get((w_id, d_id), 0) + 1
+			## WHILE
+
+		def rebalance():
+			try:
+				self.admin.rebalance("Server3", self.cluster.addServer())
+			finally:
+				done.set()
+
+		functions = [ rebalance ]
+		for i in xrange(4):
+			functions.append(lambda i=i: terminal(self.clients[i % 2], i))
+		missing, errors = runAll(functions)
+		self.assertEqual(missing, [ ], "rebalance deadlocked")
+		self.assertEqual(errors, [ ])
+		for driver in self.clients:
+			driver.history.flush() if driver.history is not None else None
+			driver.layout.refresh()
+			self.assertEqual([ driver.getServer(w_id) for w_id in self.W_IDS ], [ "Server1", "Server1", "Server2", "Server3" ])
+
+		conns = dict((sID, ServerConnection(sID, self.admin.databases[sID])) for sID in self.admin.databases)
+		for w_id in self.W_IDS:
+			owner = self.admin.getServer(w_id)
+			for sID, conn in conns.iteritems():
+				keys = conn["WAREHOUSE"].proto.fwmkeys(WAREHOUSE_KEY.encode(w_id), 1000)
+				self.assertEqual(len(keys), 1 if sID == owner else 0, "warehouse %d on server %s" % (w_id, sID))
+			## FOR
+			for d_id in xrange(1, constants.DISTRICTS_PER_WAREHOUSE+1):
+				## No order committed before, during or after the move is lost
+				orders = conns[owner]["ORDERS"].proto.fwmkeys(ORDERS_KEY.prefix(w_id, d_id), 1000)
+				self.assertEqual(len(orders), CUSTOMERS_PER_DISTRICT + newOrders.get((w_id, d_id), 0))
+			## FOR
+			history = conns[owner]["HISTORY"].query.filter(H_W_ID=w_id).count()
+			self.assertEqual(history, CUSTOMERS_PER_DISTRICT * constants.DISTRICTS_PER_WAREHOUSE +
+					sum(n for (h_w_id, d_id), n in payments.iteritems() if h_w_id == w_id))
+		## FOR
+		for conn in conns.itervalues():
+			conn.close()
+
+## CLASS
+
+@needsDriver
+class HomeWarehouseTest(unittest.TestCase):
+	"""Transactions steered onto the home warehouses of two client
+	   processes"""
+
+	W_IDS = [ 1, 2, 3, 4 ]
+
+	def setUp(self):
+		self.cluster = Cluster(2)
+		settings = dict(virtual_nodes=1, home_warehouses=True, num_clients=2, stats=True)
+		self.clients = [ makeDriver(self.cluster, client_id=i, **settings) for i in xrange(2) ]
+		loadWarehouses(self.clients[0], self.W_IDS)
+
+	def tearDown(self):
+		for driver in self.clients:
+			driver.executeFinish()
+			driver.pool.close()
+		self.cluster.close()
+
+	def testHomes(self):
+		homes = [ driver.homeWarehouses() for driver in self.clients ]
+		self.assertEqual(sorted(homes[0] + homes[1]), self.W_IDS)
+		servers = [ set(driver.getServer(w_id) for w_id in home) for driver, home in zip(self.clients, homes) ]
+		self.assertEqual(sorted(servers), [ set([ "Server1" ]), set([ "Server2" ]) ])
+
+	def testSteer(self):
+		driver = self.clients[0]
+		homes = driver.homeWarehouses()
+		home = homes[0]
+		away = [ w_id for w_id in self.W_IDS if w_id not in homes ][0]
+		## The home warehouse takes the place of the generated one, which
+		## takes the home's place among the remote warehouses
+		params = driver.steer(newOrderParams(away, [ away, home ]), home)
+		self.assertEqual(params["w_id"], home)
+		self.assertEqual(params["i_w_ids"], [ home, away ])
+		self.assertEqual(driver.steer(paymentParams(away, home), home)["c_w_id"], away)
+		## Without a given home, one of the homes is picked
+		self.assertTrue(driver.steer(paymentParams(away))["w_id"] in homes)
+		params = paymentParams(home)
+		self.assertTrue(driver.steer(params) is params)
+
+	def testTransactionsStayHome(self):
+		driver = self.clients[1]
+		homeServers = set(driver.getServer(w_id) for w_id in driver.homeWarehouses())
+		for w_id in self.W_IDS:
+			driver.executeTransaction(constants.TransactionTypes.PAYMENT, paymentParams(w_id))
+			driver.executeTransaction(constants.TransactionTypes.NEW_ORDER, newOrderParams(w_id, [ w_id ] * 3))
+		## FOR
+		self.assertEqual(set(sID for txn, sID in driver.wire.counters.keys() if txn != WireStats.OTHER), homeServers)
+
+## CLASS
+
+if __name__ == "__main__":
+	unittest.main()
@@ -0,0 +1,198 @@
+# -*- coding: utf-8 -*-
+# -----------------------------------------------------------------------
+# Copyright (C) 2011
+# Marcelo Martins
+# http://www.cs.brown.edu/~martins/
+#
+# Permission is hereby granted, free of charge, to any person obtaining
+# a copy of this software and associated documentation files (the
+# "Software"), to deal in the Software without restriction, including
+# without limitation the rights to use, copy, modify, merge, publish,
+# distribute, sublicense, and/or sell copies of the Software, and to
+# permit persons to whom the Software is furnished to do so, subject to
+# the following conditions:
+#
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT
+# IN NO EVENT SHALL THE AUTHORS BE LIABLE FOR ANY CLAIM, DAMAGES OR
+# OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE,
+# ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR
+# OTHER DEALINGS IN THE SOFTWARE.
+# -----------------------------------------------------------------------
+
+from __future__ import with_statement
+
+import socket
+import threading
+import time
+import unittest
+
+from tests.support import Cluster, needsDriver, runAll, makeDriver, loadWarehouses, newOrderParams, paymentParams, constants
+from tyrantcodec import RecordCodec
+from tyrantpool import ConnectionPool, TypedTable, multiGetAll, CONNECTION_ERRORS
+
+class ConnectionPoolTest(unittest.TestCase):
+
+	def setUp(self):
+		self.cluster = Cluster(2)
+
+	def tearDown(self):
+		self.cluster.close()
+
+	def testCheckoutBlocksAtSize(self):
+		pool = ConnectionPool(self.cluster.databases, size=2)
+		conns = [ pool.checkout("Server1"), pool.checkout("Server1") ]
+		taken = [ ]
+		thread = threading.Thread(target=lambda: taken.append(pool.checkout("Server1")))
+		thread.daemon = True
+		thread.start()
+		thread.join(0.2)
+		self.assertTrue(thread.is_alive())
+		## The other server has slots of its own
+		pool.checkin(pool.checkout("Server2"))
+
+		pool.checkin(conns[0])
+		thread.join(5.0)
+		self.assertFalse(thread.is_alive())
+		self.assertTrue(taken[0] is conns[0])
+
+	def testGetHoldsOneConnectionPerThread(self):
+		pool = ConnectionPool(self.cluster.databases, size=1)
+		conn = pool.get("Server1")
+		self.assertTrue(pool.get("Server1") is conn)
+		pool.release()
+		## Released: another thread can check it out
+		taken = [ ]
+		missing, errors = runAll([ lambda: taken.append(pool.checkout("Server1")) ], timeout=5.0)
+		self.assertEqual(missing, [ ])
+		self.assertTrue(taken[0] is conn)
+
+	def testBrokenConnectionIsReplaced(self):
+		pool = ConnectionPool(self.cluster.databases, size=1)
+		try:
+			with pool.connection("Server1") as conn:
+				conn["WAREHOUSE"]["0001"] = {"W_ID": 1}
+				raise socket.error("connection reset")
+		except socket.error:
+			pass
+		with pool.connection("Server1") as fresh:
+			self.assertFalse(fresh is conn)
+			self.assertEqual(fresh["WAREHOUSE"]["0001"]["W_ID"], "1")
+
+	def testStaleConnectionIsPinged(self):
+		pool = ConnectionPool(self.cluster.databases, size=1, keepalive=0.0)
+		with pool.connection("Server1") as conn:
+			conn["ITEM"].get("00001")
+		with pool.connection("Server1") as again:
+			self.assertTrue(again is conn)
+
+	def testMultiGetAllAcrossServers(self):
+		pool = ConnectionPool(self.cluster.databases, codecs={"STOCK": RecordCodec([ ("S_I_ID", "INTEGER") ])})
+		for serverId in ("Server1", "Server2"):
+			with pool.connection(serverId) as conn:
+				conn["STOCK"].multi_set([ ("%s%d" % (serverId, i), {"S_I_ID": i}) for i in xrange(3) ])
+		stock1 = pool.get("Server1")["STOCK"]
+		stock2 = pool.get("Server2")["STOCK"]
+		self.assertTrue(isinstance(stock1, TypedTable))
+		first, second = multiGetAll([ (stock1, [ "Server11", "missing" ]), (stock2, [ "Server20", "Server22" ]) ])
+		self.assertEqual([ (key, record["S_I_ID"]) for key, record in first ], [ ("Server11", 1) ])
+		self.assertEqual([ record["S_I_ID"] for key, record in second ], [ 0, 2 ])
+		pool.release()
+
+## CLASS
+
+@needsDriver
+class DriverPoolTest(unittest.TestCase):
+	"""Transactions on more threads than the pool has connections"""
+
+	def setUp(self):
+		self.cluster = Cluster(1)
+
+	def tearDown(self):
+		self.cluster.close()
+
+	def testNewOrderWithOneConnection(self):
+		driver = makeDriver(self.cluster, pool_size=1)
+		loadWarehouses(driver, [ 1 ])
+		## The first NEW_ORDER fills the item cache
+		missing, errors = runAll([ lambda: driver.executeTransaction(constants.TransactionTypes.NEW_ORDER,
+				newOrderParams(1, [ 1, 1, 1 ])) ])
+		self.assertEqual(missing, [ ], "NEW_ORDER deadlocked on a pool of one connection")
+		self.assertEqual(errors, [ ])
+
+	def testNewOrderOnMoreThreadsThanConnections(self):
+		driver = makeDriver(self.cluster, pool_size=2)
+		loadWarehouses(driver, [ 1 ])
+		def terminal(d_id):
+			for i in xrange(5):
+				driver.executeTransaction(constants.TransactionTypes.NEW_ORDER, newOrderParams(1, [ 1, 1 ], d_id=d_id))
+		missing, errors = runAll([ lambda d_id=d_id: terminal(d_id) for d_id in xrange(1, 9) ])
+		self.assertEqual(missing, [ ], "NEW_ORDER deadlocked with 8 threads on 2 connections")
+		self.assertEqual(errors, [ ])
+
+	def breakIdleConnections(self, driver):
+		for conn in driver.pool.idle["Server1"].queue:
+			for handle in conn.handles.itervalues():
+				handle.proto._sock._sock.close()
+
+	def testReadRetriedAfterBrokenConnection(self):
+		driver = makeDriver(self.cluster, pool_size=2)
+		loadWarehouses(driver, [ 1 ])
+		params = {"w_id": 1, "d_id": 1, "c_id": 1, "c_last": None}
+		driver.executeTransaction(constants.TransactionTypes.ORDER_STATUS, params)
+		self.breakIdleConnections(driver)
+		result = driver.executeTransaction(constants.TransactionTypes.ORDER_STATUS, params)
+		self.assertTrue(result)
+		## Writes are not run twice
+		driver.executeTransaction(constants.TransactionTypes.PAYMENT, paymentParams(1))
+		self.breakIdleConnections(driver)
+		self.assertRaises(CONNECTION_ERRORS, driver.executeTransaction, constants.TransactionTypes.PAYMENT, paymentParams(1))
+		driver.executeTransaction(constants.TransactionTypes.PAYMENT, paymentParams(1))
+		driver.executeFinish()
+
+	def testUnknownServer(self):
+		driver = makeDriver(self.cluster)
+		loadWarehouses(driver, [ 1 ])
+		driver.partitioner.pin(1, "Server9")
+		self.assertRaises(KeyError, driver.executeTransaction, constants.TransactionTypes.PAYMENT, paymentParams(1))
+		self.assertRaises(KeyError, driver.executeTransaction, constants.TransactionTypes.STOCK_LEVEL,
+				{"w_id": 1, "d_id": 1, "threshold": 20})
+		driver.executeFinish()
+
+## CLASS
+
+@needsDriver
+class RemoteWarehouseTest(unittest.TestCase):
+	"""Transactions spanning two servers on a saturated pool"""
+
+	def setUp(self):
+		self.cluster = Cluster(2)
+
+	def tearDown(self):
+		self.cluster.close()
+
+	def testOppositeServerOrders(self):
+		## One virtual node per server: W_ID 1 is on Server1, W_ID 2 on Server2
+		driver = makeDriver(self.cluster, pool_size=1, virtual_nodes=1)
+		loadWarehouses(driver, [ 1, 2 ])
+		self.assertNotEqual(driver.getServer(1), driver.getServer(2))
+		def terminal(w_id, remote, d_id):
+			for i in xrange(10):
+				driver.executeTransaction(constants.TransactionTypes.NEW_ORDER, newOrderParams(w_id, [ w_id, remote ], d_id=d_id))
+				driver.executeTransaction(constants.TransactionTypes.PAYMENT, paymentParams(w_id, remote, d_id=d_id))
+		functions = [ ]
+		for d_id in xrange(1, 5):
+			functions.append(lambda d_id=d_id: terminal(1, 2, d_id))
+			functions.append(lambda d_id=d_id: terminal(2, 1, d_id))
+		missing, errors = runAll(functions)
+		self.assertEqual(missing, [ ], "remote NEW_ORDER and PAYMENT deadlocked on a pool of one connection")
+		self.assertEqual(errors, [ ])
+
+## CLASS
+
+if __name__ == "__main__":
+	unittest.main()
@@ -0,0 +1,154 @@
+# -*- coding: utf-8 -*-
+# -----------------------------------------------------------------------
+# Copyright (C) 2011
+# Marcelo Martins
+# http://www.cs.brown.edu/~martins/
+#
+# Permission is hereby granted, free of charge, to any person obtaining
+# a copy of this software and associated documentation files (the
+# "Software"), to deal in the Software without restriction, including
+# without limitation the rights to use, copy, modify, merge, publish,
+# distribute, sublicense, and/or sell copies of the Software, and to
+# permit persons to whom the Software is furnished to do so, subject to
+# the following conditions:
+#
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT
+# IN NO EVENT SHALL THE AUTHORS BE LIABLE FOR ANY CLAIM, DAMAGES OR
+# OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE,
+# ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR
+# OTHER DEALINGS IN THE SOFTWARE.
+# -----------------------------------------------------------------------
+
+from __future__ import with_statement
+
+import threading
+import unittest
+
+from tests.support import Cluster, needsDriver, runAll, makeDriver, loadWarehouses, newOrderParams, deliveryParams, \
+		CUSTOMERS_PER_DISTRICT, NEW_ORDERS, constants
+from tyrantcodec import NEW_ORDER_KEY
+
+## O_IDs of the loaded new orders of every district
+QUEUED = range(CUSTOMERS_PER_DISTRICT - NEW_ORDERS + 1, CUSTOMERS_PER_DISTRICT + 1)
+
+@needsDriver
+class NewOrderQueueTest(unittest.TestCase):
+	"""DELIVERY takes every queued order exactly once, in O_ID order,
+	   whatever gaps the queue has"""
+
+	def setUp(self):
+		self.cluster = Cluster(1)
+		self.driver = makeDriver(self.cluster)
+		loadWarehouses(self.driver, [ 1 ])
+
+	def tearDown(self):
+		self.driver.executeFinish()
+		self.cluster.close()
+
+	def deliver(self):
+		return dict(self.driver.executeTransaction(constants.TransactionTypes.DELIVERY, deliveryParams(1)))
+
+	def remove(self, d_id, o_id):
+		with self.driver.pool.connection("Server1") as conn:
+			del conn[constants.TABLENAME_NEW_ORDER][NEW_ORDER_KEY.encode(1, d_id, o_id)]
+
+	def restore(self, d_id, o_id):
+		"""Write a NEW_ORDER record late, as a slow NEW_ORDER would"""
+		with self.driver.pool.connection("Server1") as conn:
+			conn[constants.TABLENAME_NEW_ORDER][NEW_ORDER_KEY.encode(1, d_id, o_id)] = \
+					{"NO_O_ID": o_id, "NO_D_ID": d_id, "NO_W_ID": 1}
+
+	def testDeliveryTakesOrdersInTurn(self):
+		for o_id in QUEUED:
+			self.assertEqual(self.deliver(), dict((d_id, o_id) for d_id in xrange(1, constants.DISTRICTS_PER_WAREHOUSE+1)))
+		self.assertEqual(self.deliver(), { })
+
+	def testGapAtTheHeadIsSkipped(self):
+		self.remove(1, QUEUED[0])
+		self.assertEqual(self.deliver()[1], QUEUED[1])
+		self.assertFalse(1 in self.deliver())
+		## New orders queue up behind the moved head
+		self.driver.executeTransaction(constants.TransactionTypes.NEW_ORDER, newOrderParams(1, [ 1 ], d_id=1))
+		self.assertEqual(self.deliver()[1], CUSTOMERS_PER_DISTRICT + 1)
+
+	def testLateRecordsAreDelivered(self):
+		## Behind the head: the head stays put until the record shows up
+		self.remove(1, QUEUED[1])
+		self.assertEqual(self.deliver()[1], QUEUED[0])
+		self.assertFalse(1 in self.deliver())
+		self.restore(1, QUEUED[1])
+		self.assertEqual(self.deliver()[1], QUEUED[1])
+
+		## Below the head, after a later order moved it on
+		self.driver.executeTransaction(constants.TransactionTypes.NEW_ORDER, newOrderParams(1, [ 1 ], d_id=2))
+		self.driver.executeTransaction(constants.TransactionTypes.NEW_ORDER, newOrderParams(1, [ 1 ], d_id=2))
+		late, later = CUSTOMERS_PER_DISTRICT + 1, CUSTOMERS_PER_DISTRICT + 2
+		self.remove(2, late)
+		self.assertEqual(self.deliver()[2], later)
+		self.restore(2, late)
+		self.assertEqual(self.deliver()[2], late)
+		self.assertFalse(2 in self.deliver())
+
+	def testConcurrentDeliveries(self):
+		for i in xrange(3):
+			for d_id in xrange(1, constants.DISTRICTS_PER_WAREHOUSE+1):
+				self.driver.executeTransaction(constants.TransactionTypes.NEW_ORDER, newOrderParams(1, [ 1 ], d_id=d_id))
+		## A gap in the middle of a queue
+		self.remove(3, CUSTOMERS_PER_DISTRICT + 2)
+		lock = threading.Lock()
+		delivered = [ ]
+		def terminal():
+			while True:
+				result = self.deliver()
+				with lock:
+					delivered.extend(result.iteritems())
+				if not result: return
+		missing, errors = runAll([ terminal for i in xrange(4) ])
+		self.assertEqual(missing, [ ])
+		self.assertEqual(errors, [ ])
+
+		expected = [ (d_id, o_id) for d_id in xrange(1, constants.DISTRICTS_PER_WAREHOUSE+1)
+				for o_id in QUEUED + range(CUSTOMERS_PER_DISTRICT + 1, CUSTOMERS_PER_DISTRICT + 4)
+				if (d_id, o_id) != (3, CUSTOMERS_PER_DISTRICT + 2) ]
+		self.assertEqual(sorted(delivered), expected)
+
+	def testInterleavedDeliveries(self):
+		## A and B both read the head. A takes its order; B finds it gone,
+		## rescans and takes the next one, moving the head on; only then
+		## does A move the head. No order may be skipped.
+		for i in xrange(3):
+			self.driver.executeTransaction(constants.TransactionTypes.NEW_ORDER, newOrderParams(1, [ 1 ], d_id=1))
+		with self.driver.pool.connection("Server1") as conn:
+			newOrders = conn[constants.TABLENAME_NEW_ORDER]
+			class Interleaved(object):
+				"""newOrders, running delivery B right after A's delete"""
+				def __init__(self):
+					self.b = None
+				def __getitem__(self, key):
+					return newOrders[key]
+				def __setitem__(self, key, value):
+					newOrders[key] = value
+				def __delitem__(this, key):
+					del newOrders[key]
+					if this.b is None:
+						this.b = self.driver.popNewOrder(newOrders, 1, 1)
+				def __getattr__(self, name):
+					return getattr(newOrders, name)
+			## CLASS
+			interleaved = Interleaved()
+			a = self.driver.popNewOrder(interleaved, 1, 1)
+			self.assertEqual((a, interleaved.b), (QUEUED[0], QUEUED[1]))
+		## WITH
+		## The rest come out in order
+		rest = [ self.deliver().get(1) for i in xrange(4) ]
+		self.assertEqual(rest, range(CUSTOMERS_PER_DISTRICT + 1, CUSTOMERS_PER_DISTRICT + 4) + [ None ])
+
+## CLASS
+
+if __name__ == "__main__":
+	unittest.main()
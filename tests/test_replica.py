@@ -0,0 +1,142 @@
+# -*- coding: utf-8 -*-
+# -----------------------------------------------------------------------
+# Copyright (C) 2011
+# Marcelo Martins
+# http://www.cs.brown.edu/~martins/
+#
+# Permission is hereby granted, free of charge, to any person obtaining
+# a copy of this software and associated documentation files (the
+# "Software"), to deal in the Software without restriction, including
+# without limitation the rights to use, copy, modify, merge, publish,
+# distribute, sublicense, and/or sell copies of the Software, and to
+# permit persons to whom the Software is furnished to do so, subject to
+# the following conditions:
+#
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT
+# IN NO EVENT SHALL THE AUTHORS BE LIABLE FOR ANY CLAIM, DAMAGES OR
+# OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE,
+# ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR
+# OTHER DEALINGS IN THE SOFTWARE.
+# -----------------------------------------------------------------------
+
+from __future__ import with_statement
+
+import threading
+import time
+import unittest
+
+from tests.support import Cluster, needsDriver, runAll, makeDriver, loadWarehouses, TIMEOUT, constants
+from tyrantpool import ConnectionPool
+from tyrantreplica import ReplicaRouter
+
+def waitForCheck(router, replicaId="Server1/0"):
+	"""Wait until the replica check thread has checked replicaId"""
+	deadline = time.time() + TIMEOUT
+	while replicaId not in router.delays:
+		assert time.time() < deadline, "replica %s was never checked" % replicaId
+		time.sleep(0.01)
+	## WHILE
+
+class ReplicaRouterTest(unittest.TestCase):
+
+	def setUp(self):
+		self.cluster = Cluster(1, replicas=1)
+		self.pool = ConnectionPool(self.cluster.databases, size=1)
+
+	def tearDown(self):
+		self.cluster.close()
+
+	def testChecksInTheBackground(self):
+		router = ReplicaRouter(self.pool, self.cluster.replicaMaps, checkInterval=0.05)
+		threads = [ ]
+		check = router.check
+		def recordingCheck(replicaId):
+			threads.append(threading.current_thread().name)
+			return check(replicaId)
+		router.check = recordingCheck
+		## Nothing is checked before the first transaction, which reads
+		## the master
+		self.assertEqual(router.delays, { })
+		self.assertEqual(router.get("Server1").serverId, "Server1")
+		router.release()
+		self.pool.release()
+		waitForCheck(router)
+		self.assertEqual(router.get("Server1").serverId, "Server1/0")
+		router.release()
+		router.close()
+		self.assertFalse(router.thread.is_alive())
+		self.assertEqual(set(threads), set([ "ReplicaCheck" ]))
+
+	def testCheckDoesNotWaitForThePool(self):
+		router = ReplicaRouter(self.pool, self.cluster.replicaMaps, checkInterval=0.0)
+		## The only pooled connection to the replica is taken
+		held = router.replicaPool.checkout("Server1/0")
+		try:
+			delays = [ ]
+			missing, errors = runAll([ lambda: delays.append(router.check("Server1/0")) ], timeout=5.0)
+			self.assertEqual(missing, [ ], "the replica check waited for a pooled connection")
+			self.assertEqual(errors, [ ])
+			self.assertEqual(delays, [ 0.0 ])
+		finally:
+			router.replicaPool.checkin(held)
+		router.close()
+
+	def testUnreachableReplicaIsSkipped(self):
+		router = ReplicaRouter(self.pool, self.cluster.replicaMaps)
+		replica = self.cluster.servers[0].replicas[0]
+		replica.shutdown()
+		replica.server_close()
+		router.start()
+		waitForCheck(router)
+		self.assertEqual(router.delays["Server1/0"][1], None)
+		self.assertEqual(router.get("Server1").serverId, "Server1")
+		router.release()
+		self.pool.release()
+		router.close()
+
+## CLASS
+
+@needsDriver
+class DriverReplicaTest(unittest.TestCase):
+	"""Read-only transactions on more threads than the replicas have
+	   connections"""
+
+	def setUp(self):
+		self.cluster = Cluster(1, replicas=1)
+
+	def tearDown(self):
+		self.cluster.close()
+
+	def testReadsOnOneConnection(self):
+		driver = makeDriver(self.cluster, pool_size=1)
+		loadWarehouses(driver, [ 1 ])
+		def terminal(d_id):
+			for i in xrange(5):
+				driver.executeTransaction(constants.TransactionTypes.ORDER_STATUS,
+						{"w_id": 1, "d_id": d_id, "c_id": 1, "c_last": None})
+				driver.executeTransaction(constants.TransactionTypes.STOCK_LEVEL,
+						{"w_id": 1, "d_id": d_id, "threshold": 20})
+		missing, errors = runAll([ lambda d_id=d_id: terminal(d_id) for d_id in xrange(1, 9) ])
+		driver.executeFinish()
+		self.assertEqual(missing, [ ], "read-only transactions deadlocked on a pool of one connection")
+		self.assertEqual(errors, [ ])
+
+	def testFinishStopsChecks(self):
+		driver = makeDriver(self.cluster)
+		loadWarehouses(driver, [ 1 ])
+		driver.executeTransaction(constants.TransactionTypes.ORDER_STATUS,
+				{"w_id": 1, "d_id": 1, "c_id": 1, "c_last": None})
+		waitForCheck(driver.replicas)
+		driver.executeFinish()
+		self.assertFalse(driver.replicas.thread.is_alive())
+		self.assertEqual(driver.replicas.checkers, { })
+
+## CLASS
+
+if __name__ == "__main__":
+	unittest.main()
@@ -0,0 +1,74 @@
+# -*- coding: utf-8 -*-
+# -----------------------------------------------------------------------
+# Copyright (C) 2011
+# Marcelo Martins
+# http://www.cs.brown.edu/~martins/
+#
+# Permission is hereby granted, free of charge, to any person obtaining
+# a copy of this software and associated documentation files (the
+# "Software"), to deal in the Software without restriction, including
+# without limitation the rights to use, copy, modify, merge, publish,
+# distribute, sublicense, and/or sell copies of the Software, and to
+# permit persons to whom the Software is furnished to do so, subject to
+# the following conditions:
+#
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT
+# IN NO EVENT SHALL THE AUTHORS BE LIABLE FOR ANY CLAIM, DAMAGES OR
+# OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE,
+# ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR
+# OTHER DEALINGS IN THE SOFTWARE.
+# -----------------------------------------------------------------------
+
+from __future__ import with_statement
+
+import socket
+import struct
+import unittest
+
+import pyrant
+from pyrant.protocol import TyrantProtocol
+
+from tests.support import runAll
+from tyrantserver import startServers
+
+class TyrantServerTest(unittest.TestCase):
+
+	def setUp(self):
+		self.server = startServers(1)[0]
+		self.host, self.port = self.server.server_address
+
+	def tearDown(self):
+		self.server.shutdown()
+		self.server.server_close()
+
+	def testPartialRequestDoesNotBlockOthers(self):
+		## A client stalls in the middle of a put: the server waits for the
+		## rest of it without locking the database
+		stalled = socket.create_connection((self.host, self.port))
+		stalled.sendall(struct.pack(">BBII", 0xc8, TyrantProtocol.PUT, 3, 100) + "key")
+		try:
+			def other():
+				t = pyrant.Tyrant(self.host, self.port)
+				t["other"] = {"a": "1"}
+				self.assertEqual(t["other"]["a"], "1")
+			missing, errors = runAll([ other ], timeout=5.0)
+			self.assertEqual(missing, [ ], "a partial request locked the database")
+			self.assertEqual(errors, [ ])
+		finally:
+			stalled.close()
+
+	def testFailedRequestLeavesConnectionUsable(self):
+		t = pyrant.Tyrant(self.host, self.port)
+		self.assertRaises(KeyError, lambda: t["missing"])
+		t["present"] = {"a": "1"}
+		self.assertEqual(t["present"]["a"], "1")
+
+## CLASS
+
+if __name__ == "__main__":
+	unittest.main()
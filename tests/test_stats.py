@@ -0,0 +1,173 @@
+# -*- coding: utf-8 -*-
+# -----------------------------------------------------------------------
+# Copyright (C) 2011
+# Marcelo Martins
+# http://www.cs.brown.edu/~martins/
+#
+# Permission is hereby granted, free of charge, to any person obtaining
+# a copy of this software and associated documentation files (the
+# "Software"), to deal in the Software without restriction, including
+# without limitation the rights to use, copy, modify, merge, publish,
+# distribute, sublicense, and/or sell copies of the Software, and to
+# permit persons to whom the Software is furnished to do so, subject to
+# the following conditions:
+#
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT
+# IN NO EVENT SHALL THE AUTHORS BE LIABLE FOR ANY CLAIM, DAMAGES OR
+# OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE,
+# ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR
+# OTHER DEALINGS IN THE SOFTWARE.
+# -----------------------------------------------------------------------
+
+import threading
+import unittest
+
+from pyrant.protocol import TyrantProtocol
+
+from tests.support import Cluster
+from tyrantasync import AsyncPool, EventLoop
+from tyrantpool import ServerConnection
+from tyrantstats import Histogram, LatencyStats, WireStats, requestKind
+
+class HistogramTest(unittest.TestCase):
+	"""Log-linear latency histograms"""
+
+	def testPercentiles(self):
+		histogram = Histogram()
+		for value in xrange(1, 1001):
+			histogram.record(value)
+		self.assertEqual((histogram.count, histogram.min, histogram.max), (1000, 1, 1000))
+		self.assertAlmostEqual(histogram.mean(), 500.5)
+		## Exact below 2^SUB_BITS, within 1/2^(SUB_BITS-1) above
+		self.assertEqual(histogram.percentile(10), 100)
+		for p in (50, 95, 99):
+			self.assertTrue(abs(histogram.percentile(p) - 10 * p) <= 10 * p / float(Histogram.HALF_COUNT))
+		self.assertEqual(histogram.percentile(100), 1000)
+
+	def testMerge(self):
+		a, b = Histogram(), Histogram()
+		a.record(5)
+		b.record(1 << 20)
+		a.merge(b)
+		self.assertEqual((a.count, a.min, a.max), (2, 5, 1 << 20))
+		self.assertEqual(a.percentile(50), 5)
+
+## CLASS
+
+class LatencyStatsTest(unittest.TestCase):
+	"""Histograms shared by several threads"""
+
+	THREADS = 8
+	RECORDS = 20000
+
+	def testConcurrentRecords(self):
+		stats = LatencyStats()
+		def record():
+			for i in xrange(LatencyStatsTest.RECORDS):
+				stats.record("NEW_ORDER", LatencyStats.TOTAL, 0.000001 * (i % 100))
+		threads = [ threading.Thread(target=record) for i in xrange(LatencyStatsTest.THREADS) ]
+		for t in threads:
+			t.start()
+		for t in threads:
+			t.join()
+		histogram = stats.histograms[("NEW_ORDER", LatencyStats.TOTAL)]
+		self.assertEqual(histogram.count, LatencyStatsTest.THREADS * LatencyStatsTest.RECORDS)
+		self.assertEqual(sum(histogram.counts), histogram.count)
+
+	def testDisabled(self):
+		stats = LatencyStats(enabled=False)
+		stats.lap("NEW_ORDER")("stage")
+		stats.record("NEW_ORDER", LatencyStats.TOTAL, 1.0)
+		self.assertEqual(stats.histograms, { })
+
+## CLASS
+
+class WireStatsTest(unittest.TestCase):
+	"""Requests and bytes counted on blocking and async connections"""
+
+	def setUp(self):
+		self.cluster = Cluster(1)
+		self.wire = WireStats()
+
+	def tearDown(self):
+		self.cluster.close()
+
+	def counter(self, context):
+		return self.wire.counters[(context, "Server1")]
+
+	def kinds(self, context):
+		counter = self.counter(context)
+		return dict((kind, counter[self.wire.kindIndex[kind]]) for kind in self.wire.kindIndex)
+
+	def testRequestKind(self):
+		self.assertEqual(requestKind(TyrantProtocol.GET), "get")
+		self.assertEqual(requestKind(TyrantProtocol.ADDINT), "put")
+		self.assertEqual(requestKind(TyrantProtocol.FWMKEYS), "query")
+		self.assertEqual(requestKind(TyrantProtocol.MISC, "getlist"), "get")
+		self.assertEqual(requestKind(TyrantProtocol.MISC, "outlist"), "delete")
+		self.assertEqual(requestKind(TyrantProtocol.MISC, "search"), "query")
+		self.assertEqual(requestKind(TyrantProtocol.MISC, "genuid"), "other")
+		self.assertEqual(requestKind(TyrantProtocol.STAT), "other")
+
+	def testBlockingConnection(self):
+		conn = ServerConnection("Server1", self.cluster.databases["Server1"], wire=self.wire)
+		try:
+			proto = conn["ITEM"].proto
+			self.wire.context = "LOAD"
+			proto.misc("put", [ "k1", "I_NAME", "one" ])
+			proto.misc("put", [ "k2", "I_NAME", "two" ])
+			self.wire.context = "READ"
+			proto.get("k1")
+			proto.misc("getlist", [ "k1", "k2" ])
+			proto.fwmkeys("k", 10)
+			proto.out("k2")
+			self.wire.context = None
+			proto.rnum()
+		finally:
+			conn.close()
+		self.assertEqual(self.kinds("LOAD"), {"get": 0, "put": 2, "query": 0, "delete": 0, "other": 0})
+		self.assertEqual(self.kinds("READ"), {"get": 2, "put": 0, "query": 1, "delete": 1, "other": 0})
+		self.assertEqual(self.kinds(WireStats.OTHER)["other"], 1)
+		self.assertEqual(self.counter("READ")[WireStats.ROUND_TRIPS], 4)
+		## The getlist response carries both records
+		self.assertTrue(self.counter("READ")[WireStats.RECEIVED] > self.counter("LOAD")[WireStats.RECEIVED])
+		self.assertTrue(self.counter("LOAD")[WireStats.SENT] > 0)
+
+	def testAsyncContexts(self):
+		## Requests of interleaved tasks are charged to their own context
+		loop = EventLoop()
+		pool = AsyncPool(loop, self.cluster.databases, size=1, wire=self.wire)
+		def task(context, n):
+			loop.context = context
+			for i in xrange(n):
+				yield pool.get("Server1")["ITEM"].put("%s%d" % (context, i), {"I_NAME": "x"})
+				yield loop.sleep(0)
+			yield pool.get("Server1")["ITEM"].multiGet([ "%s%d" % (context, i) for i in xrange(n) ])
+		try:
+			loop.runUntilComplete([ task("A", 3), task("B", 5) ])
+		finally:
+			pool.close()
+		self.assertEqual(self.kinds("A"), {"get": 1, "put": 3, "query": 0, "delete": 0, "other": 0})
+		self.assertEqual(self.kinds("B"), {"get": 1, "put": 5, "query": 0, "delete": 0, "other": 0})
+		self.assertTrue(self.counter("B")[WireStats.RECEIVED] > self.counter("A")[WireStats.RECEIVED])
+
+	def testSummary(self):
+		self.wire.request("Server1", "get", "NEW_ORDER")
+		self.wire.request("Server2", "put", "NEW_ORDER")
+		self.wire.request("Server2", "put", "NEW_ORDER", roundTrip=False)
+		self.wire.sent("Server1", 2048, "NEW_ORDER")
+		lines = self.wire.summary({"NEW_ORDER": 2}).splitlines()
+		self.assertEqual(len(lines), 4)
+		self.assertEqual(lines[3].split()[:8], [ "NEW_ORDER", "*", "2", "1", "2", "0", "0", "0" ])
+		## Two round trips and 2 KB over two transactions
+		self.assertEqual(lines[3].split()[-2:], [ "1.00", "1.00" ])
+
+## CLASS
+
+if __name__ == "__main__":
+	unittest.main()
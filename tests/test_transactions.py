@@ -0,0 +1,314 @@
+# -*- coding: utf-8 -*-
+# -----------------------------------------------------------------------
+# Copyright (C) 2011
+# Marcelo Martins
+# http://www.cs.brown.edu/~martins/
+#
+# Permission is hereby granted, free of charge, to any person obtaining
+# a copy of this software and associated documentation files (the
+# "Software"), to deal in the Software without restriction, including
+# without limitation the rights to use, copy, modify, merge, publish,
+# distribute, sublicense, and/or sell copies of the Software, and to
+# permit persons to whom the Software is furnished to do so, subject to
+# the following conditions:
+#
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT
+# IN NO EVENT SHALL THE AUTHORS BE LIABLE FOR ANY CLAIM, DAMAGES OR
+# OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE,
+# ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR
+# OTHER DEALINGS IN THE SOFTWARE.
+# -----------------------------------------------------------------------
+
+from __future__ import with_statement
+
+import unittest
+
+from tests.support import Cluster, needsDriver, runAll, makeDriver, loadWarehouses, newOrderParams, paymentParams, \
+		CUSTOMERS_PER_DISTRICT, constants, tokyocabinetdriver
+from tyrantasync import AsyncPool, EventLoop
+from tyrantcodec import CUSTOMER_KEY, STOCK_KEY, ORDERS_KEY, NEW_ORDER_KEY, ORDER_LINE_KEY, ORDER_COLUMN, \
+		nextOrderIdKey, customerNameKey, decodeOrder
+from tyrantpool import ServerConnection
+from tyrantstats import WireStats
+
+@needsDriver
+class StockLevelTest(unittest.TestCase):
+	"""STOCK_LEVEL reading its window with multi-gets"""
+
+	DENORMALIZE = False
+
+	def setUp(self):
+		self.cluster = Cluster(1)
+		self.driver = makeDriver(self.cluster, denormalize=self.DENORMALIZE, stats=True)
+		loadWarehouses(self.driver, [ 1 ])
+		self.conn = ServerConnection("Server1", self.cluster.databases["Server1"], codecs=tokyocabinetdriver.CODECS)
+		## A few low quantities, some of them of items ordered in the window
+		for i_id, quantity in [ (2, 5), (3, 12), (4, 15), (8, 3), (40, 1) ]:
+			key = STOCK_KEY.encode(1, i_id)
+			stock = self.conn["STOCK"][key]
+			stock["S_QUANTITY"] = quantity
+			self.conn["STOCK"][key] = stock
+		## FOR
+
+	def tearDown(self):
+		self.conn.close()
+		self.driver.executeFinish()
+		self.cluster.close()
+
+	def stockLevel(self, threshold):
+		return self.driver.executeTransaction(constants.TransactionTypes.STOCK_LEVEL,
+				{"w_id": 1, "d_id": 1, "threshold": threshold})
+
+	def windowItems(self, o_ids):
+		"""The I_IDs ordered by orders o_ids of district 1"""
+		i_ids = set()
+		for o in o_ids:
+			for n in xrange(1, constants.MAX_OL_CNT+1):
+				key = ORDER_LINE_KEY.encode(1, 1, o, n)
+				if key in self.conn["ORDER_LINE"].handle:
+					i_ids.add(self.conn["ORDER_LINE"][key]["OL_I_ID"])
+		## FOR
+		return i_ids
+
+	def expected(self, threshold):
+		"""STOCK_LEVEL's count, the slow way"""
+		o_id = int(self.conn["DISTRICT"].handle[nextOrderIdKey(1, 1)]["_num"])
+		i_ids = self.windowItems(xrange(max(o_id - 20, 1), o_id))
+		return len([ i for i in i_ids if self.conn["STOCK"][STOCK_KEY.encode(1, i)]["S_QUANTITY"] < threshold ])
+
+	def testCount(self):
+		self.driver.executeTransaction(constants.TransactionTypes.NEW_ORDER, newOrderParams(1, [ 1, 1, 1, 1 ]))
+		counts = [ self.stockLevel(threshold) for threshold in (1, 4, 10, 13, 20, 100) ]
+		self.assertEqual(counts, [ self.expected(threshold) for threshold in (1, 4, 10, 13, 20, 100) ])
+		self.assertTrue(0 < counts[2] < counts[-1])
+
+	def testRoundTrips(self):
+		self.stockLevel(10)
+		## The order ID counter, one getlist for the window's order lines
+		## and one for their STOCK records
+		counter = self.driver.wire.counters[(constants.TransactionTypes.STOCK_LEVEL, "Server1")]
+		self.assertEqual(counter[WireStats.ROUND_TRIPS], 3)
+
+## CLASS
+
+class DenormalizedStockLevelTest(StockLevelTest):
+	"""STOCK_LEVEL reading the item IDs from the ORDERS stubs"""
+
+	DENORMALIZE = True
+
+	def windowItems(self, o_ids):
+		"""The I_IDs ordered by orders o_ids of district 1, from the
+		   orders embedded in the CUSTOMER table"""
+		o_ids = set(o_ids)
+		handle = self.conn["CUSTOMER"].handle
+		i_ids = set()
+		for key in handle.proto.fwmkeys(CUSTOMER_KEY.prefix(1, 1), 100000):
+			if key[CUSTOMER_KEY.width:CUSTOMER_KEY.width+1] != "o": continue
+			order = decodeOrder(handle[key][ORDER_COLUMN])
+			if order["O_ID"] in o_ids:
+				i_ids.update(ol["OL_I_ID"] for ol in order["ORDER_LINES"])
+		## FOR
+		return i_ids
+
+## CLASS
+
+class RemoteWarehouseTest(unittest.TestCase):
+	"""Warehouse 1 and a remote warehouse held by another server"""
+
+	W_IDS = [ 1, 2, 3, 4 ]
+
+	def setUp(self):
+		self.cluster = Cluster(2)
+		self.driver = makeDriver(self.cluster, virtual_nodes=1, stats=True)
+		loadWarehouses(self.driver, self.W_IDS)
+		self.remote = [ w_id for w_id in self.W_IDS if self.driver.getServer(w_id) != self.driver.getServer(1) ][0]
+		self.conns = dict((sID, ServerConnection(sID, tables, codecs=tokyocabinetdriver.CODECS))
+				for sID, tables in self.cluster.databases.iteritems())
+
+	def tearDown(self):
+		for conn in self.conns.itervalues():
+			conn.close()
+		self.driver.executeFinish()
+		self.cluster.close()
+
+	def stock(self, w_id, i_id):
+		return self.conns[self.driver.getServer(w_id)]["STOCK"][STOCK_KEY.encode(w_id, i_id)]
+
+	def customer(self, w_id, c_id, d_id=1):
+		return self.conns[self.driver.getServer(w_id)]["CUSTOMER"][CUSTOMER_KEY.encode(w_id, d_id, c_id)]
+
+## CLASS
+
+@needsDriver
+class NewOrderStockTest(RemoteWarehouseTest):
+	"""NEW_ORDER reading and writing its STOCK records in batches, one
+	   per supplying server"""
+
+	def testStockUpdated(self):
+		## Item 8 twice from the home warehouse, item 15 from the remote one
+		## with a quantity that wraps its stock around
+		params = {"w_id": 1, "d_id": 1, "c_id": 1, "o_entry_d": "2011-01-02 00:00:00",
+				"i_ids": [ 8, 8, 15 ], "i_w_ids": [ 1, 1, self.remote ], "i_qtys": [ 5, 5, 45 ]}
+		customerInfo, misc, item_data = self.driver.executeTransaction(constants.TransactionTypes.NEW_ORDER, params)
+		self.assertEqual([ d[1] for d in item_data ], [ 45, 40, 96 ])
+
+		home = self.stock(1, 8)
+		self.assertEqual((home["S_QUANTITY"], home["S_YTD"], home["S_ORDER_CNT"], home["S_REMOTE_CNT"]), (40, 10, 2, 0))
+		remote = self.stock(self.remote, 15)
+		self.assertEqual((remote["S_QUANTITY"], remote["S_YTD"], remote["S_ORDER_CNT"], remote["S_REMOTE_CNT"]), (96, 45, 1, 1))
+		## Untouched records stay as loaded
+		self.assertEqual(self.stock(self.remote, 8)["S_QUANTITY"], 50)
+		self.assertEqual(self.stock(1, 15)["S_QUANTITY"], 50)
+
+		## The remote server got one getlist and one putlist
+		counter = self.driver.wire.counters[(constants.TransactionTypes.NEW_ORDER, self.driver.getServer(self.remote))]
+		self.assertEqual(counter[self.driver.wire.kindIndex["get"]], 1)
+		self.assertEqual(counter[self.driver.wire.kindIndex["put"]], 1)
+
+## CLASS
+
+@needsDriver
+class RemotePaymentTest(RemoteWarehouseTest):
+	"""PAYMENT of a customer of another warehouse, held by another server"""
+
+	def checkPayment(self, pay):
+		home, remote = self.customer(1, 2), self.customer(self.remote, 2)
+		params = paymentParams(1, c_w_id=self.remote, c_id=2)
+		pay(params)
+		## The customer is read and written on the server of C_W_ID
+		customer = self.customer(self.remote, 2)
+		self.assertAlmostEqual(customer["C_BALANCE"], remote["C_BALANCE"] - params["h_amount"])
+		self.assertEqual(customer["C_PAYMENT_CNT"], remote["C_PAYMENT_CNT"] + 1)
+		self.assertEqual(self.customer(1, 2), home)
+
+	def testPayment(self):
+		self.checkPayment(lambda params: self.driver.executeTransaction(constants.TransactionTypes.PAYMENT, params))
+
+	def testPaymentAsync(self):
+		def pay(params):
+			loop = EventLoop()
+			self.driver.asyncPool = AsyncPool(loop, self.driver.databases, codecs=tokyocabinetdriver.CODECS)
+			try:
+				loop.runUntilComplete(self.driver.executeTransactionAsync(constants.TransactionTypes.PAYMENT, params))
+			finally:
+				self.driver.asyncPool.close()
+				self.driver.asyncPool = None
+		self.checkPayment(pay)
+
+## CLASS
+
+@needsDriver
+class OrderIdTest(unittest.TestCase):
+	"""Order IDs allocated with addint on the district's counter"""
+
+	def setUp(self):
+		self.cluster = Cluster(1)
+		self.driver = makeDriver(self.cluster)
+		loadWarehouses(self.driver, [ 1 ])
+		self.conn = ServerConnection("Server1", self.cluster.databases["Server1"], codecs=tokyocabinetdriver.CODECS)
+
+	def tearDown(self):
+		self.conn.close()
+		self.driver.executeFinish()
+		self.cluster.close()
+
+	def nextOrderId(self):
+		return int(self.conn["DISTRICT"].handle[nextOrderIdKey(1, 1)]["_num"])
+
+	def testConcurrentNewOrders(self):
+		## The counter starts after the loaded orders
+		self.assertEqual(self.nextOrderId(), CUSTOMERS_PER_DISTRICT + 1)
+		o_ids = [ ]
+		def newOrders():
+			for c_id in xrange(1, CUSTOMERS_PER_DISTRICT+1):
+				customerInfo, misc, item_data = self.driver.executeTransaction(constants.TransactionTypes.NEW_ORDER,
+						newOrderParams(1, [ 1 ], c_id=c_id))
+				o_ids.append(misc[0][2])
+		missing, errors = runAll([ newOrders ] * 4)
+		self.assertEqual(missing, [ ])
+		self.assertEqual(errors, [ ])
+		## Every order got an ID of its own, with no gaps
+		count = 4 * CUSTOMERS_PER_DISTRICT
+		self.assertEqual(sorted(o_ids), range(CUSTOMERS_PER_DISTRICT + 1, CUSTOMERS_PER_DISTRICT + count + 1))
+		self.assertEqual(self.nextOrderId(), CUSTOMERS_PER_DISTRICT + count + 1)
+		for o_id in o_ids:
+			self.assertEqual(self.conn["ORDERS"][ORDERS_KEY.encode(1, 1, o_id)]["O_ID"], o_id)
+			self.assertEqual(self.conn["NEW_ORDER"][NEW_ORDER_KEY.encode(1, 1, o_id)]["NO_O_ID"], o_id)
+		## FOR
+		## The other districts' counters did not move
+		self.assertEqual(int(self.conn["DISTRICT"].handle[nextOrderIdKey(1, 2)]["_num"]), CUSTOMERS_PER_DISTRICT + 1)
+
+## CLASS
+
+@needsDriver
+class NameIndexTest(unittest.TestCase):
+	"""Customer lookups by last name through the name index"""
+
+	DENORMALIZE = False
+	## Customers named ZED, their first names in reverse C_ID order
+	ZEDS = range(CUSTOMERS_PER_DISTRICT + 1, CUSTOMERS_PER_DISTRICT + 5)
+
+	def setUp(self):
+		self.cluster = Cluster(1)
+		self.driver = makeDriver(self.cluster, denormalize=self.DENORMALIZE, stats=True)
+		loadWarehouses(self.driver, [ 1 ])
+		self.driver.loadTuples(constants.TABLENAME_CUSTOMER, [ (c_id, 1, 1, "first%c" % (ord("z") - c_id), "OE", "ZED",
+				"s1", "s2", "city", "st", "123451111", "555", "2011-01-01 00:00:00", "GC", 50000.0, 0.1,
+				-10.0, 10.0, 1, 0, "data") for c_id in self.ZEDS ])
+		self.driver.loadFinish()
+		self.conn = ServerConnection("Server1", self.cluster.databases["Server1"], codecs=tokyocabinetdriver.CODECS)
+		## The midpoint of the four, by C_FIRST
+		self.midpoint = self.ZEDS[2]
+
+	def tearDown(self):
+		self.conn.close()
+		self.driver.executeFinish()
+		self.cluster.close()
+
+	def customer(self, c_id):
+		return self.conn["CUSTOMER"][CUSTOMER_KEY.encode(1, 1, c_id)]
+
+	def testIndexRecord(self):
+		index = self.conn["CUSTOMER"].handle[customerNameKey(1, 1, "ZED")]
+		self.assertEqual(index["C_IDS"].split(), [ str(c_id) for c_id in reversed(self.ZEDS) ])
+		## Customers of the other districts are not mixed in
+		self.assertEqual(len(self.conn["CUSTOMER"].handle[customerNameKey(1, 2, "NAME1")]["C_IDS"].split()),
+				len([ c_id for c_id in xrange(1, CUSTOMERS_PER_DISTRICT+1) if c_id % 3 == 1 ]))
+		self.assertFalse(customerNameKey(1, 2, "ZED") in self.conn["CUSTOMER"].handle)
+
+	def testPaymentByName(self):
+		before = dict((c_id, self.customer(c_id)["C_PAYMENT_CNT"]) for c_id in self.ZEDS)
+		self.driver.executeTransaction(constants.TransactionTypes.PAYMENT, paymentParams(1, c_last="ZED"))
+		after = dict((c_id, self.customer(c_id)["C_PAYMENT_CNT"]) for c_id in self.ZEDS)
+		self.assertEqual(after, dict((c_id, n + (c_id == self.midpoint)) for c_id, n in before.iteritems()))
+
+	def testOrderStatusByName(self):
+		self.driver.executeTransaction(constants.TransactionTypes.NEW_ORDER, newOrderParams(1, [ 1 ], c_id=self.midpoint))
+		customer, order, lines = self.driver.executeTransaction(constants.TransactionTypes.ORDER_STATUS,
+				{"w_id": 1, "d_id": 1, "c_id": None, "c_last": "ZED"})
+		## The midpoint customer's one new order
+		self.assertEqual(customer["C_FIRST"], self.customer(self.midpoint)["C_FIRST"])
+		self.assertEqual(int(order["O_ID"]), CUSTOMERS_PER_DISTRICT + 1)
+
+	def testNoScan(self):
+		## A lookup by name is one get of the index record
+		self.driver.executeTransaction(constants.TransactionTypes.PAYMENT, paymentParams(1, c_last="ZED"))
+		counter = self.driver.wire.counters[(constants.TransactionTypes.PAYMENT, "Server1")]
+		self.assertEqual(counter[self.driver.wire.kindIndex["query"]], 0)
+
+## CLASS
+
+class DenormalizedNameIndexTest(NameIndexTest):
+	"""Lookups by last name with the orders kept next to the customers"""
+
+	DENORMALIZE = True
+
+## CLASS
+
+if __name__ == "__main__":
+	unittest.main()
@@ -0,0 +1,210 @@
+# -*- coding: utf-8 -*-
+# -----------------------------------------------------------------------
+# Copyright (C) 2011
+# Marcelo Martins
+# http://www.cs.brown.edu/~martins/
+#
+# Permission is hereby granted, free of charge, to any person obtaining
+# a copy of this software and associated documentation files (the
+# "Software"), to deal in the Software without restriction, including
+# without limitation the rights to use, copy, modify, merge, publish,
+# distribute, sublicense, and/or sell copies of the Software, and to
+# permit persons to whom the Software is furnished to do so, subject to
+# the following conditions:
+#
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT
+# IN NO EVENT SHALL THE AUTHORS BE LIABLE FOR ANY CLAIM, DAMAGES OR
+# OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE,
+# ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR
+# OTHER DEALINGS IN THE SOFTWARE.
+# -----------------------------------------------------------------------
+
+from __future__ import with_statement
+
+import socket
+import time
+import unittest
+
+from tests.support import Cluster, needsDriver, makeDriver, loadWarehouses, paymentParams, deliveryParams, \
+		TIMEOUT, constants, tokyocabinetdriver
+from tyrantbatch import RowBuffer, WriteBehind
+from tyrantcodec import ORDERS_KEY
+from tyrantpool import ConnectionPool, ServerConnection
+from tyrantstats import WireStats
+
+def record(i):
+	return {"H_C_ID": str(i), "H_AMOUNT": "10.0"}
+
+class WriteBehindTest(unittest.TestCase):
+	"""HISTORY records queued and written from the background thread"""
+
+	def setUp(self):
+		self.cluster = Cluster(1)
+		self.pool = ConnectionPool(self.cluster.databases)
+		self.conn = ServerConnection("Server1", self.cluster.databases["Server1"])
+		self.buffer = None
+
+	def tearDown(self):
+		if self.buffer is not None:
+			self.buffer.close()
+		self.conn.close()
+		self.pool.close()
+		self.cluster.close()
+
+	def written(self):
+		return self.conn["HISTORY"].proto.rnum()
+
+	def waitFor(self, count):
+		deadline = time.time() + TIMEOUT
+		while self.written() < count and time.time() < deadline:
+			time.sleep(0.01)
+		return self.written()
+
+	def testFullBatch(self):
+		self.buffer = WriteBehind(self.pool, batchSize=5, interval=TIMEOUT)
+		keys = [ self.buffer.put("Server1", "HISTORY", record(i)) for i in xrange(4) ]
+		time.sleep(0.1)
+		self.assertEqual(self.written(), 0)
+		keys.append(self.buffer.put("Server1", "HISTORY", record(4)))
+		self.assertEqual(self.waitFor(5), 5)
+		self.assertEqual(len(set(keys)), 5)
+		self.assertEqual(self.conn["HISTORY"][keys[2]]["H_C_ID"], "2")
+
+	def testInterval(self):
+		self.buffer = WriteBehind(self.pool, batchSize=1000, interval=0.05)
+		start = time.time()
+		for i in xrange(3):
+			self.buffer.put("Server1", "HISTORY", record(i))
+		self.assertEqual(self.waitFor(3), 3)
+		self.assertTrue(time.time() - start >= 0.05)
+
+	def testFlushAndClose(self):
+		self.buffer = WriteBehind(self.pool, batchSize=1000, interval=TIMEOUT)
+		for i in xrange(10):
+			self.buffer.put("Server1", "HISTORY", record(i))
+		self.assertTrue(self.buffer.flush())
+		self.assertEqual(self.written(), 10)
+		for i in xrange(10, 15):
+			self.buffer.put("Server1", "HISTORY", record(i))
+		self.buffer.close()
+		self.assertEqual(self.written(), 15)
+		self.assertEqual(self.buffer.written, 15)
+		self.assertRaises(AssertionError, self.buffer.put, "Server1", "HISTORY", record(15))
+
+	def testFailedBatchStaysQueued(self):
+		## A port nobody listens on
+		sock = socket.socket()
+		sock.bind(("127.0.0.1", 0))
+		port = sock.getsockname()[1]
+		sock.close()
+		pool = ConnectionPool({"Server1": {"HISTORY": {"host": "127.0.0.1", "port": port}}})
+		buffer = WriteBehind(pool, batchSize=1000, interval=TIMEOUT)
+		try:
+			buffer.put("Server1", "HISTORY", record(1))
+			self.assertFalse(buffer.flush())
+			self.assertEqual(len(buffer.buffers[("Server1", "HISTORY")]), 1)
+			self.assertEqual(buffer.written, 0)
+		finally:
+			buffer.close()
+			pool.close()
+
+## CLASS
+
+@needsDriver
+class DriverWriteBehindTest(unittest.TestCase):
+	"""PAYMENT's HISTORY records under write_behind"""
+
+	def setUp(self):
+		self.cluster = Cluster(1)
+		self.driver = makeDriver(self.cluster, write_behind=True, flush_interval=TIMEOUT)
+		loadWarehouses(self.driver, [ 1 ])
+		self.conn = ServerConnection("Server1", self.cluster.databases["Server1"])
+
+	def tearDown(self):
+		self.conn.close()
+		self.cluster.close()
+
+	def testDrainedAtFinish(self):
+		loaded = self.conn["HISTORY"].proto.rnum()
+		for c_id in xrange(1, 4):
+			self.driver.executeTransaction(constants.TransactionTypes.PAYMENT, paymentParams(1, c_id=c_id))
+		## Queued, not written yet
+		self.assertEqual(self.conn["HISTORY"].proto.rnum(), loaded)
+		self.driver.executeFinish()
+		self.assertEqual(self.conn["HISTORY"].proto.rnum(), loaded + 3)
+
+## CLASS
+
+@needsDriver
+class RowBufferTest(unittest.TestCase):
+	"""Rows written back at the end of a transaction"""
+
+	def setUp(self):
+		self.cluster = Cluster(1)
+		self.wire = WireStats()
+		self.conn = ServerConnection("Server1", self.cluster.databases["Server1"], wire=self.wire,
+				codecs=tokyocabinetdriver.CODECS)
+		self.rows = RowBuffer(self.conn)
+
+	def tearDown(self):
+		self.conn.close()
+		self.cluster.close()
+
+	def puts(self):
+		counter = self.wire.counters.get((WireStats.OTHER, "Server1"))
+		return counter[self.wire.kindIndex["put"]] if counter else 0
+
+	def testFlush(self):
+		self.rows.putMany("HISTORY", [ ("h%d" % i, record(i)) for i in xrange(5) ])
+		self.rows.put("HISTORY", "h2", record(20))
+		self.rows.put("WAREHOUSE", "w", {"W_ID": 1})
+		## Nothing is written before the flush
+		self.assertEqual(self.puts(), 0)
+		self.assertEqual(self.conn["HISTORY"].proto.rnum(), 0)
+
+		self.assertEqual(sorted(self.rows.flush()), [ "HISTORY", "WAREHOUSE" ])
+		## One putlist per table, the last put of a row wins
+		self.assertEqual(self.puts(), 2)
+		self.assertEqual(self.conn["HISTORY"].proto.rnum(), 5)
+		self.assertEqual(self.conn["HISTORY"]["h2"]["H_C_ID"], 20)
+		self.assertEqual(self.conn["WAREHOUSE"]["w"]["W_ID"], 1)
+
+		self.assertEqual(self.rows.flush(), [ ])
+		self.assertEqual(self.puts(), 2)
+
+## CLASS
+
+@needsDriver
+class DriverRowBufferTest(unittest.TestCase):
+	"""DELIVERY's updates written at commit"""
+
+	def setUp(self):
+		self.cluster = Cluster(1)
+		self.driver = makeDriver(self.cluster, stats=True)
+		loadWarehouses(self.driver, [ 1 ])
+
+	def tearDown(self):
+		self.driver.executeFinish()
+		self.cluster.close()
+
+	def testOnePutlistPerTable(self):
+		result = self.driver.executeTransaction(constants.TransactionTypes.DELIVERY, deliveryParams(1))
+		self.assertEqual(len(result), constants.DISTRICTS_PER_WAREHOUSE)
+		## A NEW_ORDER queue head per district, then the ORDERS, ORDER_LINE
+		## and CUSTOMER rows of every district in one putlist each
+		counter = self.driver.wire.counters[(constants.TransactionTypes.DELIVERY, "Server1")]
+		self.assertEqual(counter[self.driver.wire.kindIndex["put"]], constants.DISTRICTS_PER_WAREHOUSE + 3)
+		with self.driver.pool.connection("Server1") as conn:
+			for d_id, o_id in result:
+				self.assertEqual(conn["ORDERS"][ORDERS_KEY.encode(1, d_id, o_id)]["O_CARRIER_ID"], 3)
+		## WITH
+
+## CLASS
+
+if __name__ == "__main__":
+	unittest.main()
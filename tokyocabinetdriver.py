@@ -26,14 +26,32 @@
 
 from __future__ import with_statement
 from abstractdriver import *
-from pprint import pprint.pformat
+from pprint import pformat
+from pyrant.protocol import TyrantProtocol
+from tyrantasync import AsyncPool, EventLoop, Return
+from tyrantbatch import BatchWriter, RowBuffer, WriteBehind
+from tyrantcache import ItemCache
+from tyrantcommit import CommitPolicy
+from tyrantlayout import SharedLayout, LAYOUT_TABLE
+from tyrantcodec import ORDER_COLUMN, encodeOrder, decodeOrder, nextOrderIdKey, newOrderHeadKey, \
+		customerNameKey, customerOrderKey, RecordCodec
+from tyrantcodec import WAREHOUSE_KEY, DISTRICT_KEY, ITEM_KEY, CUSTOMER_KEY, HISTORY_KEY, \
+		STOCK_KEY, ORDERS_KEY, NEW_ORDER_KEY, ORDER_LINE_KEY
+from tyrantpartition import RangePartitioner, ConsistentHashPartitioner, TerminalScheduler
+from tyrantpool import ConnectionPool, ServerConnection, CONNECTION_ERRORS, multiGetAll, multiSetAll
+from tyrantreplica import ReplicaRouter
+from tyrantstats import LatencyStats, WireStats
 
 import commands
 import constants
 import logging
+import multiprocessing
 import os
-import pytyrant
+import Queue
+import random
 import sys
+import threading
+import time
 
 try:
 	import psyco
@@ -42,41 +60,305 @@ except ImportError:
 else:
 	psyco.profile()
 
+## Columns of every table in tuple order, with their SQL types
+TABLE_COLUMNS = {
+	constants.TABLENAME_ITEM: [
+		("I_ID", "INTEGER"),
+		("I_IM_ID", "INTEGER"),
+		("I_NAME", "VARCHAR"),
+		("I_PRICE", "FLOAT"),
+		("I_DATA", "VARCHAR"),
+	],
+	constants.TABLENAME_WAREHOUSE: [
+		("W_ID", "SMALLINT"),
+		("W_NAME", "VARCHAR"),
+		("W_STREET_1", "VARCHAR"),
+		("W_STREET_2", "VARCHAR"),
+		("W_CITY", "VARCHAR"),
+		("W_STATE", "VARCHAR"),
+		("W_ZIP", "VARCHAR"),
+		("W_TAX", "FLOAT"),
+		("W_YTD", "FLOAT"),
+	],
+	constants.TABLENAME_DISTRICT: [
+		("D_ID", "TINYINT"),
+		("D_W_ID", "SMALLINT"),
+		("D_NAME", "VARCHAR"),
+		("D_STREET_1", "VARCHAR"),
+		("D_STREET_2", "VARCHAR"),
+		("D_CITY", "VARCHAR"),
+		("D_STATE", "VARCHAR"),
+		("D_ZIP", "VARCHAR"),
+		("D_TAX", "FLOAT"),
+		("D_YTD", "FLOAT"),
+		("D_NEXT_O_ID", "INT"),
+	],
+	constants.TABLENAME_CUSTOMER: [
+		("C_ID", "INTEGER"),
+		("C_D_ID", "TINYINT"),
+		("C_W_ID", "SMALLINT"),
+		("C_FIRST", "VARCHAR"),
+		("C_MIDDLE", "VARCHAR"),
+		("C_LAST", "VARCHAR"),
+		("C_STREET_1", "VARCHAR"),
+		("C_STREET_2", "VARCHAR"),
+		("C_CITY", "VARCHAR"),
+		("C_STATE", "VARCHAR"),
+		("C_ZIP", "VARCHAR"),
+		("C_PHONE", "VARCHAR"),
+		("C_SINCE", "TIMESTAMP"),
+		("C_CREDIT", "VARCHAR"),
+		("C_CREDIT_LIM", "FLOAT"),
+		("C_DISCOUNT", "FLOAT"),
+		("C_BALANCE", "FLOAT"),
+		("C_YTD_PAYMENT", "FLOAT"),
+		("C_PAYMENT_CNT", "INTEGER"),
+		("C_DELIVERY_CNT", "INTEGER"),
+		("C_DATA", "VARCHAR"),
+	],
+	constants.TABLENAME_STOCK: [
+		("S_I_ID", "INTEGER"),
+		("S_W_ID", "SMALLINT"),
+		("S_QUANTITY", "INTEGER"),
+		("S_DIST_01", "VARCHAR"),
+		("S_DIST_02", "VARCHAR"),
+		("S_DIST_03", "VARCHAR"),
+		("S_DIST_04", "VARCHAR"),
+		("S_DIST_05", "VARCHAR"),
+		("S_DIST_06", "VARCHAR"),
+		("S_DIST_07", "VARCHAR"),
+		("S_DIST_08", "VARCHAR"),
+		("S_DIST_09", "VARCHAR"),
+		("S_DIST_10", "VARCHAR"),
+		("S_YTD", "INTEGER"),
+		("S_ORDER_CNT", "INTEGER"),
+		("S_REMOTE_CNT", "INTEGER"),
+		("S_DATA", "VARCHAR"),
+	],
+	constants.TABLENAME_ORDERS: [
+		("O_ID", "INTEGER"),
+		("O_C_ID", "INTEGER"),
+		("O_D_ID", "TINYINT"),
+		("O_W_ID", "SMALLINT"),
+		("O_ENTRY_D", "TIMESTAMP"),
+		("O_CARRIER_ID", "INTEGER"),
+		("O_OL_CNT", "INTEGER"),
+		("O_ALL_LOCAL", "INTEGER"),
+	],
+	constants.TABLENAME_NEW_ORDER: [
+		("NO_O_ID", "INTEGER"),
+		("NO_D_ID", "TINYINT"),
+		("NO_W_ID", "SMALLINT"),
+	],
+	constants.TABLENAME_ORDER_LINE: [
+		("OL_O_ID", "INTEGER"),
+		("OL_D_ID", "TINYINT"),
+		("OL_W_ID", "SMALLINT"),
+		("OL_NUMBER", "INTEGER"),
+		("OL_I_ID", "INTEGER"),
+		("OL_SUPPLY_W_ID", "SMALLINT"),
+		("OL_DELIVERY_D", "TIMESTAMP"),
+		("OL_QUANTITY", "INTEGER"),
+		("OL_AMOUNT", "FLOAT"),
+		("OL_DIST_INFO", "VARCHAR"),
+	],
+	constants.TABLENAME_HISTORY: [
+		("H_C_ID", "INTEGER"),
+		("H_C_D_ID", "TINYINT"),
+		("H_C_W_ID", "SMALLINT"),
+		("H_D_ID", "TINYINT"),
+		("H_W_ID", "SMALLINT"),
+		("H_DATE", "TIMESTAMP"),
+		("H_AMOUNT", "FLOAT"),
+		("H_DATA", "VARCHAR"),
+	],
+}
+
+## Columns stored under their own name: the ones TABLE_INDEXES indexes,
+## the searches filter on and ORDER_STATUS's query returns and orders by.
+## The other columns of each table are packed together (see RecordCodec).
+NAMED_COLUMNS = {
+	constants.TABLENAME_ORDERS: [ "O_ID", "O_C_ID", "O_D_ID", "O_W_ID", "O_ENTRY_D", "O_CARRIER_ID" ],
+	constants.TABLENAME_HISTORY: [ "H_W_ID" ],
+}
+
+## Records of every table are read and written through a codec built from
+## its column types, so transactions see typed values
+CODECS = dict((tableName, RecordCodec(columns, NAMED_COLUMNS.get(tableName, [ ])))
+		for tableName, columns in TABLE_COLUMNS.iteritems())
+
+## Secondary indexes built by loadFinish, as (column, index type) pairs.
+## Records are otherwise found by key, so only the columns the remaining
+## searches filter on are indexed: ORDER_STATUS's lookup of a customer's
+## last order and the HISTORY records of a warehouse that rebalance moves.
+## Tokyo Cabinet uses one index per query, so the most selective column of
+## each lookup comes first. Integer columns get decimal indexes so that
+## numeric ranges and ordering can use them.
+TABLE_INDEXES = {
+	constants.TABLENAME_ORDERS: [
+		("O_C_ID", "decimal"),
+		("O_D_ID", "decimal"),
+		("O_W_ID", "decimal"),
+	],
+	constants.TABLENAME_HISTORY: [
+		("H_W_ID", "decimal"),
+	],
+}
+
+## Upper bound on the number of keys returned by a prefix scan
+MAX_SCAN_KEYS = 0x7fffffff
+
+## Seconds loadPartitioned waits for a loader's result before it checks
+## whether the loaders are still alive
+LOADER_POLL = 1.0
+
+## The column holding the warehouse ID of each partitioned table
+WAREHOUSE_COLUMNS = {
+	constants.TABLENAME_WAREHOUSE: "W_ID",
+	constants.TABLENAME_DISTRICT: "D_W_ID",
+	constants.TABLENAME_CUSTOMER: "C_W_ID",
+	constants.TABLENAME_HISTORY: "H_W_ID",
+	constants.TABLENAME_STOCK: "S_W_ID",
+	constants.TABLENAME_ORDERS: "O_W_ID",
+	constants.TABLENAME_NEW_ORDER: "NO_W_ID",
+	constants.TABLENAME_ORDER_LINE: "OL_W_ID",
+}
+
 class TokyocabinetDriver(AbstractDriver):
 
+	## Transactions that only read, and can be run again after a connection
+	## broke under them
+	READ_ONLY_TRANSACTIONS = [
+		constants.TransactionTypes.ORDER_STATUS,
+		constants.TransactionTypes.STOCK_LEVEL,
+	]
+
+	## Tables whose records are kept with their customers in denormalized
+	## mode (see customerOrderKey)
+	DENORMALIZED_TABLES = [
+		constants.TABLENAME_ORDERS,
+		constants.TABLENAME_ORDER_LINE,
+	]
+
 	DEFAULT_CONFIG = {
-		"Server1",
-		{
-			"ORDER",
+		"servers": ("Tyrant servers keyed by server ID. Each one maps a table name to the ttserver holding it",
 			{
-				"host": "localhost",
-				"port": 1978,
-				"persistent": True
-			}
-		}
+				"Server1":
+				{
+					"ORDER":
+					{
+						"host": "localhost",
+						"port": 1978,
+						"persistent": True
+					}
+				}
+			}),
+		"batch_size": ("Number of records sent in each putlist call while loading", 1000),
+		"load_workers": ("Number of loader processes started for each server by loadPartitioned", 1),
+		"pool_size": ("Maximum number of open connections to each server", 4),
+		"keepalive": ("Seconds a pooled connection may stay idle before it is pinged on checkout", 30),
+		"partitioner": ("How warehouses are assigned to servers: 'range' or 'hash' (consistent hashing)", "range"),
+		"virtual_nodes": ("Number of virtual nodes per server", 16),
+		"range_size": ("Number of consecutive W_IDs per virtual node of the range partitioner", 1),
+		"rebalance": ("Follow the cluster layout that rebalance (tcrebalance.py) changes, so that servers can be added while the benchmark runs. Needs a %s table on the first server" % LAYOUT_TABLE, False),
+		"layout_interval": ("Seconds between two reads of the cluster layout shared by the client processes, which rebalance changes", 1.0),
+		"denormalize": ("Store each order with its order lines in one record next to its customer's CUSTOMER record", False),
+		"async_terminals": ("Number of terminals executeAsync runs on one event loop in each client process", 10),
+		"write_behind": ("Queue HISTORY inserts under client-generated keys and write them from a background thread in putlist batches", False),
+		"flush_interval": ("Seconds a queued write-behind record may wait before its batch is written", 1.0),
+		"commit": ("When the tables written by a transaction are synced to disk: 'none', 'transaction' (before it returns) or 'group' (once per group of transactions, each of which waits for it before it returns)", "none"),
+		"group_size": ("Maximum number of transactions in one group commit", 100),
+		"group_interval": ("Maximum milliseconds a transaction waits for its group commit", 50),
+		"replicas": ("Read-only replicas of each server, keyed by server ID: a list of table maps like the ones in servers. ORDER_STATUS and STOCK_LEVEL read from them", { }),
+		"replica_policy": ("How a read-only transaction picks one of the replicas of a server: 'round-robin' or 'least-loaded'", "round-robin"),
+		"max_staleness": ("Seconds of replication delay after which a replica is passed over and its master is read instead", 1.0),
+		"home_warehouses": ("Run the transactions of each client process on a home set of warehouses lined up with the partitioner, so that it mostly talks to one server", False),
+		"num_clients": ("Number of client processes taking part in the run, for home_warehouses", 1),
+		"client_id": ("Index of this client process from 0 to num_clients-1, for home_warehouses. At -1 it is taken from the number of the multiprocessing worker running the client", -1),
+		"stats": ("Record latency histograms per transaction type and stage, and round trips and bytes per transaction type and server", True),
 	}
 
 	def __init__(self, ddl):
 		super(TokyocabinetDriver, self).__init__("tokyocabinet", ddl)
 		self.databases = dict()
-		self.conn = dict()
+		self.pool = None
+		## Non-blocking connections of executeAsync
+		self.asyncPool = None
+		self.stats = LatencyStats()
+		self.wire = WireStats()
+		self.partitioner = None
+		## Cluster layout shared with the other processes (see rebalance)
+		self.layout = None
+		## Whether transactions follow the layout while they run
+		self.following = False
+		self.config = None
+		self.denormalize = False
+		self.loader = None
+		## Write-behind buffer of HISTORY inserts, if enabled
+		self.history = None
+		## Syncs the tables written by transactions
+		self.committer = None
+		## Routes read-only transactions to replicas, if there are any
+		self.replicas = None
+		## Home warehouses of this client process, found on first use
+		self.affinity = False
+		self.homes = None
+		## Denormalized orders waiting for their district to finish loading
+		self.w_orders = dict()
+		## Head of each loaded district's new-order queue, by (W_ID, D_ID)
+		self.w_newOrderHeads = dict()
+		## (C_FIRST, C_ID) of the loaded customers, by (W_ID, D_ID, C_LAST)
+		self.w_customerNames = dict()
+		## Local copy of ITEM, read on first use
+		self.items = None
+		self.itemsLock = threading.Lock()
+		## (start time, search Future) of newOrderItemsAsync's ITEM read
+		self.itemsLoading = None
+
+	##-----------------------------------------------
+	## scanPrefix
+	##-----------------------------------------------
+	def scanPrefix(self, handle, prefix):
+		"""Return the (key, record) pairs of a table whose key starts with
+		   prefix, in key order. Primary keys are encoded with the fixed-width
+		   KeyFormats of tyrantcodec, so a prefix selects a contiguous key range
+		   (an ordered cursor on B+tree databases). Costs one forward-matching
+		   key scan and one getlist, without any index or query."""
+		keys = handle.proto.fwmkeys(prefix, MAX_SCAN_KEYS)
+		if not keys: return [ ]
+		return sorted(handle.multi_get(keys))
 
 	##-----------------------------------------------
-	## tupleToString
+	## getReadConnection
 	##-----------------------------------------------
-	def tupleToString(self, tuple, sep=":"):
-		"""Tokyo-Cabinet table-type databases only accept strings as keys.
-		   This function transforms a compound key (tuple) into a string.
-		   Tuples elements are separated by the sep char"""
-		   return sep.join(str(t) for t in tuple)
+	def getReadConnection(self, sID):
+		"""Connection for a read-only transaction on the data of server sID:
+		   to one of its replicas if there are any, and to sID otherwise"""
+		if self.replicas is not None:
+			return self.replicas.get(sID)
+		return self.pool.get(sID)
 
-    ##-----------------------------------------------
+	##-----------------------------------------------
+	## holdServers
+	##-----------------------------------------------
+	def holdServers(self, sIDs):
+		"""The calling thread's connections (self.pool.get) to every server
+		   in sIDs, by server ID. They are checked out in server ID order, so
+		   that a transaction spanning several servers takes them all up
+		   front in the same order as every other one: two transactions
+		   taking two servers in opposite orders could each hold one and wait
+		   forever for the other once the pool runs out of connections."""
+		conns = dict()
+		for sID in sorted(set(sIDs)):
+			conns[sID] = self.pool.get(sID)
+		return conns
+
+	##-----------------------------------------------
 	## getServer
 	##-----------------------------------------------
 	def getServer(self, warehouseID):
 		"""Return server that contains partitioned data, according to warehouseID"""
-		sID = self.partition.get(warehouseID, -1)
-		return sID
+		return self.partitioner.getServer(warehouseID)
 
 	## ----------------------------------------------
 	## makeDefaultConfig
@@ -88,26 +370,103 @@ class TokyocabinetDriver(AbstractDriver):
 	## loadDefaultConfig
 	## ----------------------------------------------
 	def loadDefaultConfig(self, config):
-		for key in map(lambda x:x[0], TokyocabinetDriver.DEFAULT_CONFIG):
+		for key in TokyocabinetDriver.DEFAULT_CONFIG.keys():
 			assert key in config, "Missing parameter '%s' in %s configuration" % (key, self.name)
+		self.config = config
+		self.denormalize = str(config["denormalize"]).lower() in ("true", "1")
+		self.affinity = str(config["home_warehouses"]).lower() in ("true", "1")
+		self.stats.enabled = str(config["stats"]).lower() in ("true", "1")
+		self.wire.enabled = self.stats.enabled
 
-		for serverId, tables in config.iteritems():
+		for serverId, tables in config["servers"].iteritems():
 			self.databases[serverId] = tables
+		self.partitioner = self.makePartitioner()
+
+		# Connections are opened on demand and shared through the pool
+		self.pool = ConnectionPool(self.databases, int(config["pool_size"]), float(config["keepalive"]),
+				wire=self.wire if self.wire.enabled else None, codecs=CODECS)
+		self.loader = BatchWriter(self.pool, int(config["batch_size"]))
+		if str(config["write_behind"]).lower() in ("true", "1"):
+			self.history = WriteBehind(self.pool, int(config["batch_size"]), float(config["flush_interval"]))
+		self.committer = CommitPolicy(self.pool, config["commit"], int(config["group_size"]),
+				float(config["group_interval"]) / 1000.0)
+		if config["replicas"]:
+			self.replicas = ReplicaRouter(self.pool, config["replicas"], config["replica_policy"],
+					float(config["max_staleness"]))
+
+		## The layout is kept in a table of its own on the first configured
+		## server and read through a connection of its own. Without
+		## rebalance it is read once, so that the warehouses moved by an
+		## earlier rebalance are still found, and never followed
+		layoutServer = min(config["servers"].keys())
+		self.following = str(config["rebalance"]).lower() in ("true", "1")
+		if LAYOUT_TABLE in self.databases[layoutServer]:
+			self.layout = SharedLayout(ServerConnection(layoutServer, self.databases[layoutServer], codecs=CODECS),
+					LAYOUT_TABLE, self.applyLayout, float(config["layout_interval"]), self.drainWrites)
+		assert self.layout is not None or not self.following, \
+				"rebalance needs a %s table on server %s" % (LAYOUT_TABLE, layoutServer)
 
-		# First connect to databases
-		for serverId, tables in self.databases.iteritems():
-			conn = self.conn.get(serverId, dict())
-			for tab, values in tables.iteritems():
-				conn[serverId][tab] = pyrant.Tyrant(values["host"], values["port"])
-			self.conn[serverId] = conn
+		if config["reset"]:
+			for serverId, tables in self.databases.iteritems():
+				with self.pool.connection(serverId) as conn:
+					for tab in tables.keys():
+						logging.debug("Deleting database '%s'" % tab)
+						conn[tab].vanish()
+				## WITH
+		elif self.layout is not None:
+			self.layout.refresh()
+
+	## ----------------------------------------------
+	## makePartitioner
+	## ----------------------------------------------
+	def makePartitioner(self, added=()):
+		"""Partitioner of the configured servers, to which the servers in
+		   added were added in turn"""
+		config = self.config
+		servers = config["servers"].keys()
+		if config["partitioner"] == "range":
+			partitioner = RangePartitioner(servers, int(config["virtual_nodes"]), int(config["range_size"]))
+		elif config["partitioner"] == "hash":
+			partitioner = ConsistentHashPartitioner(servers, int(config["virtual_nodes"]))
+		else:
+			assert False, "Unknown partitioner '%s'" % config["partitioner"]
+		for sID in added:
+			partitioner.addServer(sID)
+		return partitioner
 
+	## ----------------------------------------------
+	## applyLayout
+	## ----------------------------------------------
+	def applyLayout(self, state):
+		"""Start using a new version of the shared layout: pool the added
+		   servers and route warehouses with a partitioner built from it"""
+		for sID, tables in state["servers"]:
+			if sID not in self.databases:
+				logging.info("Adding server %s" % sID)
+				self.pool.addServer(sID, tables)
 		## FOR
+		partitioner = self.makePartitioner([ sID for sID, tables in state["servers"] ])
+		for w_id, sID in state["pinned"].iteritems():
+			partitioner.pin(w_id, sID)
+		self.partitioner = partitioner
 
-		if config["reset"]:
-			for serverId, tables in self.conn.iteritems():
-				for tab in tables.keys():
-					logging.debug("Deleting database '%s'" % tab)
-					self.conn[serverId][tab].vanish()
+	def drainWrites(self):
+		"""Write out the queued HISTORY records before the layout is
+		   acknowledged. Returns whether they got through"""
+		return self.history is None or self.history.flush()
+
+	## -------------------------------------------
+	## loadRecord
+	## -------------------------------------------
+	def loadRecord(self, w_id, tableName, key, cols):
+		"""Queue one record for the server holding warehouse w_id. Records
+		   are written in batches of batch_size with a single putlist call.
+		   Raises KeyError if that server is not configured or has no such
+		   table"""
+		sID = self.getServer(w_id)
+		if not tableName in self.databases.get(sID, ()):
+			raise KeyError("Server %s of warehouse %s does not exist or has no table %s" % (sID, w_id, tableName))
+		self.loader.put(sID, tableName, key, cols)
 
 	## -------------------------------------------
 	## loadTuples
@@ -117,150 +476,740 @@ class TokyocabinetDriver(AbstractDriver):
 		   Each table is a connection to a Tyrant server. Each record is a key-value pair,
 		   where key = primary key, values = concatenation of columns (dictionary). If
 		   key is compound we transform it into a string, since TC does not support
-		   compound keys. Data partitioning occurs based on Warehouse ID."""
+		   compound keys. Data partitioning occurs based on Warehouse ID. Records
+		   are buffered per (server, table) and sent in batches (see loadRecord).
+		   ITEM has no warehouse ID and is not partitioned: every server that
+		   lists it receives a full copy, so item lookups never leave the
+		   server of the home warehouse."""
 
 		## TODO:
-		## 1. Use denormalized tables?
-		## 2. Remove redundant columns
-		## 3. Finish ITEM table filling
-		## 4. Create indexes
+		## 1. Remove redundant columns
 		if len(tuples) == 0: return
 
 		logging.debug("Loading %d tuples of tableName %s" % (len(tuples), tableName))
 
-		assert tableName in TABLE_COLUMNS, "Unexpected table %s" % tableName
-		columns = TABLE_COLUMNS[tableName]
-		num_colums = xrange(len(columns))
+		assert tableName in CODECS, "Unexpected table %s" % tableName
+		codec = CODECS[tableName]
+		columns = codec.names
+		num_columns = xrange(len(columns))
 
-		## We want to combine all of a CUSTOMER's ORDERS, ORDER_LINE, and
-		## records into a single document
+		## We want to combine each ORDERS record and its ORDER_LINE records
+		## into a single document, stored with the customer
 		if self.denormalize and tableName in TokyocabinetDriver.DENORMALIZED_TABLES:
-			## TODO
-		else:
-			## If this is the CUSTOMER table, then we'll just store the record locally for now
-			if tableName == constants.TABLENAME_CUSTOMER:
+			## If this is an ORDERS record, then we'll just store it locally
+			## until its district is done (see loadDocuments)
+			if tableName == constants.TABLENAME_ORDERS:
 				for t in tuples:
-					c_key = tupleToString(t[:3]) # C_ID, D_ID, W_ID
-					self.w_customers[c_key] = dict(map(lambda i: (columns[i], t[i]), num_columns))
+					o_key = ORDERS_KEY.encode(t[3], t[2], t[0]) # O_W_ID, O_D_ID, O_ID
+					order = dict(map(lambda i: (columns[i], t[i]), num_columns))
+					order["ORDER_LINES"] = [ ]
+					self.w_orders[o_key] = order
 				## FOR
 
-			## If this is an ORDER_LINE record, then we need to stick it inside of the right 
+			## If this is an ORDER_LINE record, then we need to stick it inside of the right
 			## ORDERS record
 			elif tableName == constants.TABLENAME_ORDER_LINE:
 				for t in tuples:
-					o_key = tupleToString(t[:3]) # O_ID, O_D_ID, O_W_ID
-					(c_key, o_idx) = self.w_order[o_key]
-
+					o_key = ORDERS_KEY.encode(t[2], t[1], t[0]) # OL_W_ID, OL_D_ID, OL_O_ID
+					self.w_orders[o_key]["ORDER_LINES"].append(dict(map(lambda i: (columns[i], t[i]), num_columns)))
+				## FOR
+		else:
 			if tableName == constants.TABLENAME_WAREHOUSE:
 				for t in tuples:
-					w_key = t[:1] # W_ID
-					sID = getServer(w_key)
-					cols = dict(map(lambda i: (columns[i], t[i]), num_columns))
-					try:
-						self.conn[sID][tableName].put(str(w_key), cols)
-					except KeyError, err:
-						sys.stderr.out("%s(%s): server ID does not exist or is offline\n" %(KeyError, err))
-						sys.exit(1)
+					w_key = t[0] # W_ID
+					cols = codec.pack(t)
+					self.loadRecord(w_key, tableName, WAREHOUSE_KEY.encode(w_key), cols)
 				## FOR
 
-			elif table == constants.TABLENAME_DISTRICT:
+			elif tableName == constants.TABLENAME_DISTRICT:
 				for t in tuples:
-					w_key = str(t[1:2]) # W_ID
-					d_key = tupleToString(t[:2]) # D_ID, D_W_ID
-					cols = dict(map(lambda i: (columns[i], t[i]), num_columns))
-					self.conn[w_key][tableName].put(d_key, cols)
-					except KeyError, err:
-						sys.stderr.out("%s(%s): server ID does not exist or is offline\n" %(KeyError, err))
-						sys.exit(1)
+					w_key = t[1] # W_ID
+					d_key = DISTRICT_KEY.encode(t[1], t[0]) # D_W_ID, D_ID
+					cols = codec.pack(t)
+					self.loadRecord(w_key, tableName, d_key, cols)
+					## D_NEXT_O_ID is allocated from a counter record with addint;
+					## the column of the district record keeps its initial value
+					counter = {"D_W_ID": t[1], "D_ID": t[0], "_num": t[10]}
+					self.loadRecord(w_key, tableName, nextOrderIdKey(t[1], t[0]), counter)
+					## A district without new orders starts its queue at D_NEXT_O_ID
+					self.queueNewOrder(t[1], t[0], t[10])
 				## FOR
 
-			elif table == constants.TABLENAME_ITEM:
-					# TODO: Item table has no w_id. How to partition?
+			elif tableName == constants.TABLENAME_ITEM:
+				## Item table has no w_id: every server gets a full copy, from
+				## which clients fill their ItemCache
+				for t in tuples:
+					i_key = ITEM_KEY.encode(t[0]) # I_ID
+					cols = codec.pack(t)
+					for sID, tables in self.databases.iteritems():
+						if tableName in tables:
+							self.loader.put(sID, tableName, i_key, cols)
+				## FOR
 
 			elif tableName == constants.TABLENAME_CUSTOMER:
 				for t in tuples:
-					try:
-						w_key = str(t[2:3]) # W_ID
-						c_key = tupleToString(t[:3]) # C_ID, C_D_ID, C_W_ID
-						cols = ditc(map(lambda i: (columns[i], t[i]), num_columns))
-						self.conn[w_key][tableName].put(c_key, cols)
-					except KeyError, err:
-						sys.stderr.out("%s(%s): server ID does not exist or is offline\n" %(KeyError, err))
-						sys.exit(1)
+					w_key = t[2] # W_ID
+					c_key = CUSTOMER_KEY.encode(t[2], t[1], t[0]) # C_W_ID, C_D_ID, C_ID
+					cols = codec.pack(t)
+					self.loadRecord(w_key, tableName, c_key, cols)
+					self.indexCustomerName(t[2], t[1], t[5], t[3], t[0]) # C_W_ID, C_D_ID, C_LAST, C_FIRST, C_ID
 				## FOR
 
 			elif tableName == constants.TABLENAME_HISTORY:
 				for t in tuples:
-					w_key = t[4:5] # W_ID
-					sID = getServer(w_key)
-					cols = dict(map(lambda i: (columns[i], t[i], num_columns)))
-					try:
-						self.conn[sID][tableName].put(str(w_key), cols)
-					except KeyError, err:
-						sys.stderr.out("%s(%s): server ID does not exist or is offline\n" %(KeyError, err))
-						sys.exit(1)
+					w_key = t[4] # W_ID
+					# The initial population has exactly one HISTORY record per customer,
+					# so the customer's key is unique here and saves a genuid per record
+					h_key = HISTORY_KEY.encode(t[2], t[1], t[0]) # H_C_W_ID, H_C_D_ID, H_C_ID
+					cols = codec.pack(t)
+					self.loadRecord(w_key, tableName, h_key, cols)
 				## FOR
 
 			elif tableName == constants.TABLENAME_STOCK:
 				for t in tuples:
-					w_key = t[1:2] # W_ID
-					sID = getServer(w_key)
-					s_key = tupleToStriong(t[:2]) # S_ID, S_W_ID
-					cols = dict(map(lambda i: (columns[i], t[i]), num_columns))
-					try:
-						self.conn[sID][tableName].put(s_key, cols)
-					except KeyError, err:
-						sys.stderr.out("%s(%s): server ID does not exist or is offline\n" %(KeyError, err))
-						sys.exit(1)
+					w_key = t[1] # W_ID
+					s_key = STOCK_KEY.encode(t[1], t[0]) # S_W_ID, S_I_ID
+					cols = codec.pack(t)
+					self.loadRecord(w_key, tableName, s_key, cols)
 				## FOR
 
 			elif tableName == constants.TABLENAME_ORDERS:
 				for t in tuples:
-					w_key = t[3:4] # W_ID
-					sID = getServer(w_key)
-					o_key = tupleToString(t[1:4]) # O_ID, O_D_ID, O_W_ID
-					cols = dict(map(lambda i: (columns[i], t[i], num_columns)))
-					try:
-						self.conn[sID][tableName].put(o_key, cols)
-					except KeyError, err:
-						sys.stderr.out("%s(%s): server ID does not exist or is offline\n" %(KeyError, err))
-						sys.exit(1)
+					w_key = t[3] # W_ID
+					o_key = ORDERS_KEY.encode(t[3], t[2], t[0]) # O_W_ID, O_D_ID, O_ID
+					cols = codec.pack(t)
+					self.loadRecord(w_key, tableName, o_key, cols)
 				## FOR
 
 			elif tableName == constants.TABLENAME_NEW_ORDER:
 				for t in tuples:
-					w_key = t[2:3] # W_ID
-					sID = getServer(w_key)
-					no_key = tupleToString(t[:3]) # NO_O_ID, NO_D_ID, NO_W_ID
-					cols = dict(map(lambda i: (columns[i], t[i], num_columns)))
-					try:
-						self.conn[sID][tableName].put(no_key, cols)
-					except KeyError, err:
-						sys.stderr.out("%s(%s): server ID does not exist or is offline\n" %(KeyError, err))
-						sys.exit(1)
+					w_key = t[2] # W_ID
+					no_key = NEW_ORDER_KEY.encode(t[2], t[1], t[0]) # NO_W_ID, NO_D_ID, NO_O_ID
+					cols = codec.pack(t)
+					self.loadRecord(w_key, tableName, no_key, cols)
+					self.queueNewOrder(t[2], t[1], t[0])
 				## FOR
 
 			elif tableName == constants.TABLENAME_ORDER_LINE:
 				for t in tuples:
-					w_key = t[2:3] # W_ID
-					sID = getServer(w_key)
-					ol_key = tupleToString(t[:4]) # OL_O_ID, OL_D_ID, OL_W_ID, OL_NUMBER
-					cols = dict(map(lambda i: (columns[i], t[i], num_columns)))
-					try:
-						self.conn[sID][tableName].put(ol_key, cols)
-					except KeyError, err:
-						sys.stderr.out("%s(%s): server ID does not exist or is offline\n" %(KeyError, err))
-						sys.exit(1)
+					w_key = t[2] # W_ID
+					ol_key = ORDER_LINE_KEY.encode(t[2], t[1], t[0], t[3]) # OL_W_ID, OL_D_ID, OL_O_ID, OL_NUMBER
+					cols = codec.pack(t)
+					self.loadRecord(w_key, tableName, ol_key, cols)
 				## FOR
 
 		logging.debug("Loaded %s tuples for tableName %s" % (len(tuples), tableName))
 		return
 
+	## -------------------------------------------
+	## orderStub
+	## -------------------------------------------
+	def orderStub(self, order):
+		"""In denormalized mode the ORDERS table only keeps this stub, which
+		   points from an order's key to the customer that embeds it and lists
+		   the order's item IDs for STOCK_LEVEL"""
+		return {"O_ID": order["O_ID"], "O_C_ID": order["O_C_ID"], "O_D_ID": order["O_D_ID"],
+				"O_W_ID": order["O_W_ID"],
+				"O_I_IDS": " ".join(str(ol["OL_I_ID"]) for ol in order["ORDER_LINES"])}
+
+	## -------------------------------------------
+	## orderRecord
+	## -------------------------------------------
+	def orderRecord(self, order):
+		"""In denormalized mode each order is stored with its lines in this
+		   record of the CUSTOMER table, under the customerOrderKey of its
+		   customer. Orders are never embedded in the CUSTOMER record
+		   itself, which PAYMENT and DELIVERY rewrite: a NEW_ORDER for the
+		   same customer at the same time would otherwise be lost."""
+		return {"O_ID": order["O_ID"], ORDER_COLUMN: encodeOrder(order)}
+
+	## -------------------------------------------
+	## loadDocuments
+	## -------------------------------------------
+	def loadDocuments(self):
+		"""Queue the orders collected by loadTuples, with their lines, as
+		   records of their customers, together with the ORDERS stubs"""
+		for o_key, order in self.w_orders.iteritems():
+			w_id, d_id = order["O_W_ID"], order["O_D_ID"]
+			self.loadRecord(w_id, constants.TABLENAME_ORDERS, o_key, self.orderStub(order))
+			self.loadRecord(w_id, constants.TABLENAME_CUSTOMER,
+					customerOrderKey(w_id, d_id, order["O_C_ID"], order["O_ID"]), self.orderRecord(order))
+		## FOR
+		self.w_orders.clear()
+
+	## -------------------------------------------
+	## queueNewOrder
+	## -------------------------------------------
+	def queueNewOrder(self, w_id, d_id, o_id):
+		"""Note a loaded order that is still undelivered. The queue of a
+		   district starts at the lowest one (see loadQueueHeads)"""
+		key = (w_id, d_id)
+		if not key in self.w_newOrderHeads or o_id < self.w_newOrderHeads[key]:
+			self.w_newOrderHeads[key] = o_id
+
+	## -------------------------------------------
+	## loadQueueHeads
+	## -------------------------------------------
+	def loadQueueHeads(self):
+		"""Queue the head records of the new-order queues of the districts
+		   loaded so far (see popNewOrder)"""
+		for (w_id, d_id), o_id in self.w_newOrderHeads.iteritems():
+			cols = {"NO_W_ID": w_id, "NO_D_ID": d_id, "_num": o_id}
+			self.loadRecord(w_id, constants.TABLENAME_NEW_ORDER, newOrderHeadKey(w_id, d_id), cols)
+		self.w_newOrderHeads.clear()
+
+	## -------------------------------------------
+	## indexCustomerName
+	## -------------------------------------------
+	def indexCustomerName(self, w_id, d_id, c_last, c_first, c_id):
+		"""Note a loaded customer for the name index (see loadNameIndex)"""
+		self.w_customerNames.setdefault((w_id, d_id, c_last), [ ]).append((c_first, c_id))
+
+	## -------------------------------------------
+	## loadNameIndex
+	## -------------------------------------------
+	def loadNameIndex(self):
+		"""Queue the name index records of the customers loaded so far. Each
+		   one lists the C_IDs of a district's customers with the same C_LAST
+		   ordered by C_FIRST, so a lookup by name is a single get (see
+		   midpointCustomerId). Names never change after the load, so the
+		   index needs no maintenance during the benchmark; the records carry
+		   C_W_ID and C_D_ID so that warehouse moves take them along."""
+		for (w_id, d_id, c_last), names in self.w_customerNames.iteritems():
+			names.sort()
+			cols = {"C_W_ID": w_id, "C_D_ID": d_id, "C_IDS": " ".join(str(c_id) for c_first, c_id in names)}
+			self.loadRecord(w_id, constants.TABLENAME_CUSTOMER, customerNameKey(w_id, d_id, c_last), cols)
+		self.w_customerNames.clear()
+
+	## -------------------------------------------
+	## loadFinishDistrict
+	## -------------------------------------------
+	def loadFinishDistrict(self, w_id, d_id):
+		if self.denormalize:
+			self.loadDocuments()
+
+	## -------------------------------------------
+	## loadPartitioned
+	## -------------------------------------------
+	def loadPartitioned(self, scaleParameters):
+		"""Load all warehouses in parallel. The warehouses are grouped by the
+		   server getServer maps them to and each group is split into
+		   load_workers contiguous W_ID ranges. Every range is loaded by its own
+		   process with its own connections. loadFinish is called once, after
+		   all workers are done. py-tpcc's own loader does not call this;
+		   tcbenchmark.py does with --load-workers."""
+		partitions = dict()
+		for w_id in xrange(scaleParameters.starting_warehouse, scaleParameters.ending_warehouse+1):
+			partitions.setdefault(self.getServer(w_id), [ ]).append(w_id)
+		## FOR
+
+		numWorkers = int(self.config["load_workers"])
+		assert numWorkers > 0, "Invalid number of loader processes %d" % numWorkers
+
+		workerIds = [ ]
+		for sID in sorted(partitions.keys()):
+			w_ids = partitions[sID]
+			n = min(numWorkers, len(w_ids))
+			for i in xrange(n):
+				workerIds.append((sID, w_ids[i*len(w_ids)/n:(i+1)*len(w_ids)/n]))
+		## FOR
+
+		## Connections are not shared with the workers: each one opens its own
+		## and the reset (if any) has already been done by this process
+		config = dict(self.config)
+		config["reset"] = False
+
+		start = time.time()
+		results = multiprocessing.Queue()
+		workers = [ ]
+		for i in xrange(len(workerIds)):
+			sID, w_ids = workerIds[i]
+			p = multiprocessing.Process(target=loadWorker,
+					args=(self.ddl, config, scaleParameters, w_ids, i == 0, results))
+			p.start()
+			workers.append(p)
+			logging.debug("Started loader %d for server %s (W_IDs %d-%d)" % (p.pid, sID, w_ids[0], w_ids[-1]))
+		## FOR
+
+		## Collect the results before joining so that a full queue never blocks a
+		## worker. A worker that dies without reporting (killed, crashed in the
+		## interpreter) is noticed by polling, and the first failure stops the load
+		total = 0
+		pending = dict((p.pid, p) for p in workers)
+		dead = set()
+		while pending:
+			try:
+				pid, w_ids, rows, duration, error = results.get(timeout=LOADER_POLL)
+			except Queue.Empty:
+				## A worker puts its result before it exits, so one found dead
+				## at two polls in a row with nothing in between never reported
+				lost = [ p for p in pending.itervalues() if p.pid in dead ]
+				if lost:
+					p = lost[0]
+					self.stopLoaders(workers, "Loader %d exited with code %s without reporting" % (p.pid, p.exitcode))
+				dead = set(p.pid for p in pending.itervalues() if not p.is_alive())
+				continue
+			del pending[pid]
+			if error:
+				self.stopLoaders(workers, "Loader %d failed on W_IDs %d-%d: %s" % (pid, w_ids[0], w_ids[-1], error))
+			total += rows
+			logging.info("Loader %d loaded %d rows for W_IDs %d-%d in %.2f sec (%.0f rows/sec)" % \
+					(pid, rows, w_ids[0], w_ids[-1], duration, rows / max(duration, 1e-6)))
+		## WHILE
+		for p in workers:
+			p.join()
+
+		duration = time.time() - start
+		logging.info("Loaded %d rows with %d processes in %.2f sec (%.0f rows/sec)" % \
+				(total, len(workers), duration, total / max(duration, 1e-6)))
+
+		self.loadFinish()
+
+	def stopLoaders(self, workers, error):
+		"""Fail the load: stop the loaders still running and exit"""
+		sys.stderr.write("%s\n" % error)
+		for p in workers:
+			if p.is_alive():
+				p.terminate()
+			p.join()
+		sys.exit(1)
+
 	## -------------------------------------------
 	## loadFinish
 	## -------------------------------------------
-	def loadFinish(self)
-		logging.info("Finished loading tables")
+	def loadFinish(self):
+		## Send whatever is left in the load buffers
+		self.loadDocuments()
+		self.loadQueueHeads()
+		self.loadNameIndex()
+		self.loader.flushAll()
+		logging.info("Finished loading tables (%d records)" % self.loader.written)
+
+		self.createIndexes()
+
+	## -------------------------------------------
+	## createIndexes
+	## -------------------------------------------
+	def createIndexes(self):
+		"""Build the TABLE_INDEXES on every server. Servers are indexed in
+		   parallel, one thread each"""
+		start = time.time()
+		errors = [ ]
+
+		def indexServer(sID, tables):
+			try:
+				with self.pool.connection(sID) as conn:
+					for tableName, indexes in TABLE_INDEXES.iteritems():
+						if not tableName in tables: continue
+						for column, kind in indexes:
+							t = time.time()
+							if not conn[tableName].proto.add_index(column, kind):
+								logging.warn("Failed to create %s index on %s.%s on server %s" % (kind, tableName, column, sID))
+							else:
+								logging.debug("Created %s index on %s.%s on server %s in %.2f sec" % \
+										(kind, tableName, column, sID, time.time() - t))
+					## FOR
+				## WITH
+			except Exception, err:
+				errors.append("%s: %s(%s)" % (sID, type(err).__name__, err))
+		## DEF
+
+		threads = [ threading.Thread(target=indexServer, args=(sID, tables))
+				for sID, tables in self.databases.iteritems() ]
+		for t in threads: t.start()
+		for t in threads: t.join()
+
+		if errors:
+			sys.stderr.write("Index creation failed on server %s\n" % ", ".join(errors))
+			sys.exit(1)
+		logging.info("Created indexes on %d servers in %.2f sec" % (len(threads), time.time() - start))
+
+	## --------------------------------------------
+	## getWarehouseIds
+	## --------------------------------------------
+	def getWarehouseIds(self):
+		"""W_IDs of the warehouses stored on all the servers"""
+		w_ids = [ ]
+		for sID in self.databases.keys():
+			with self.pool.connection(sID) as conn:
+				w_ids.extend(WAREHOUSE_KEY.decode(key)[0] for key in conn[constants.TABLENAME_WAREHOUSE].keys())
+		## FOR
+		return w_ids
+
+	## --------------------------------------------
+	## rebalance
+	## --------------------------------------------
+	def rebalance(self, serverId, tables):
+		"""Add a server to the cluster and move to it, one at a time, every
+		   warehouse the partitioner now assigns to it, while the clients
+		   keep running. The change goes through the shared layout: the new
+		   server is published with the warehouses to move pinned to their
+		   old servers, and each of them is then fenced, copied, switched
+		   over and deleted from its old server (see moveWarehouse). ITEM is
+		   not partitioned, so the new server gets a full copy of it.
+
+		   Every process taking part in the run, this one included, must
+		   use the same configuration, with rebalance enabled in the
+		   clients, and only one rebalance may run at a
+		   time. A rebalance that failed can be run again with the same
+		   arguments to move the warehouses still pinned."""
+		assert self.layout is not None, "rebalance needs a %s table on server %s" % \
+				(LAYOUT_TABLE, min(self.databases.keys()))
+		self.layout.refresh()
+		state = self.layout.read()
+		added = [ sID for sID, t in state["servers"] ]
+		if serverId not in added:
+			assert serverId not in self.databases, "Server %s is already in the cluster" % serverId
+			state["servers"].append([ serverId, tables ])
+			added.append(serverId)
+		## IF
+
+		w_ids = self.getWarehouseIds()
+		owners = dict((w_id, self.getServer(w_id)) for w_id in w_ids)
+		target = self.makePartitioner(added)
+		moves = [ w_id for w_id in sorted(w_ids) if target.getServer(w_id) != owners[w_id] ]
+		logging.info("Moving %d of %d warehouses to server %s" % (len(moves), len(w_ids), serverId))
+
+		## Keep everything where it is until it has been copied
+		for w_id in moves:
+			state["pinned"][w_id] = owners[w_id]
+		self.layout.publish(state)
+
+		if constants.TABLENAME_ITEM in tables and owners:
+			src = ServerConnection(owners.values()[0], self.databases[owners.values()[0]], codecs=CODECS)
+			dst = ServerConnection(serverId, tables, codecs=CODECS)
+			try:
+				self.copyRecords(src[constants.TABLENAME_ITEM], dst[constants.TABLENAME_ITEM],
+						src[constants.TABLENAME_ITEM].proto.fwmkeys("", MAX_SCAN_KEYS))
+			finally:
+				src.close()
+				dst.close()
+		## IF
+
+		for w_id in moves:
+			self.moveWarehouse(w_id, owners[w_id], target.getServer(w_id))
+
+	## --------------------------------------------
+	## moveWarehouse
+	## --------------------------------------------
+	def moveWarehouse(self, w_id, src, dst):
+		"""Move every row of warehouse w_id from server src to server dst.
+		   The warehouse is fenced first: once every client acknowledged
+		   the fence, no transaction on it is running or can start, and the
+		   HISTORY records the clients buffered are written out. Its rows
+		   are then copied, the fence is lifted with the warehouse pointing
+		   at dst and the rows are deleted from src, which nobody reads any
+		   more. Rows are found by key prefix, which also takes the counter,
+		   queue head and name index records, except for HISTORY, whose
+		   keys do not start with the W_ID."""
+		start = time.time()
+		state = self.layout.read()
+		if w_id not in state["fenced"]:
+			state["fenced"].append(w_id)
+		self.layout.waitForClients(self.layout.publish(state))
+
+		## Connections of their own: the copy runs for long
+		srcConn = ServerConnection(src, self.databases[src], codecs=CODECS)
+		dstConn = ServerConnection(dst, self.databases[dst], codecs=CODECS)
+		try:
+			rows = 0
+			for tableName, column in WAREHOUSE_COLUMNS.iteritems():
+				rows += self.copyRecords(srcConn[tableName], dstConn[tableName], self.warehouseKeys(srcConn, tableName, w_id))
+
+			state = self.layout.read()
+			state["fenced"].remove(w_id)
+			del state["pinned"][w_id]
+			self.layout.publish(state)
+
+			for tableName in WAREHOUSE_COLUMNS.keys():
+				keys = self.warehouseKeys(srcConn, tableName, w_id)
+				for i in xrange(0, len(keys), self.loader.batchSize):
+					srcConn[tableName].sendList("outlist", keys[i:i+self.loader.batchSize])
+					srcConn[tableName].receiveList()
+			## FOR
+		finally:
+			srcConn.close()
+			dstConn.close()
+		logging.info("Moved warehouse %d (%d rows) from server %s to %s in %.2f sec" % \
+				(w_id, rows, src, dst, time.time() - start))
+
+	def warehouseKeys(self, conn, tableName, w_id):
+		"""Keys of the rows of warehouse w_id in tableName on conn"""
+		if tableName == constants.TABLENAME_HISTORY:
+			return conn[tableName].proto.search([ ("H_W_ID", TyrantProtocol.RDBQCNUMEQ, str(w_id)) ], limit=MAX_SCAN_KEYS)
+		return conn[tableName].proto.fwmkeys(WAREHOUSE_KEY.encode(w_id), MAX_SCAN_KEYS)
+
+	def copyRecords(self, src, dst, keys):
+		"""Copy the records of keys from the TypedTable src to dst as they
+		   are stored, batch_size of them per getlist and putlist. Returns
+		   the number of records copied"""
+		copied = 0
+		for i in xrange(0, len(keys), self.loader.batchSize):
+			src.sendList("getlist", keys[i:i+self.loader.batchSize])
+			records = src.receiveList()
+			dst.sendList("putlist", records)
+			dst.receiveList()
+			copied += len(records) / 2
+		## FOR
+		return copied
+
+	## --------------------------------------------
+	## getItemInfo
+	## --------------------------------------------
+	def getItemInfo(self, sID, i_id):
+		"""Return (I_PRICE, I_NAME, I_DATA) for i_id, or None if the item does
+		   not exist. ITEM is immutable, so it is read once from server sID
+		   into a local ItemCache and served from memory afterwards. The
+		   read goes through the calling thread's connection to sID, which
+		   its transaction holds anyway: a second checkout could wait
+		   forever on a pool whose connections are all held."""
+		if self.items is None:
+			with self.itemsLock:
+				if self.items is None:
+					start = time.time()
+					conn = self.pool.get(sID)
+					self.cacheItems(conn[constants.TABLENAME_ITEM].query.columns(*CODECS[constants.TABLENAME_ITEM].stored), start)
+			## WITH
+		return self.items.get(i_id)
+
+	def cacheItems(self, records, start):
+		"""Serve ITEM from an ItemCache of records, dicts of their stored
+		   columns read since start"""
+		cache = ItemCache()
+		decode = CODECS[constants.TABLENAME_ITEM].decode
+		cache.load(decode(cols) for cols in records)
+		logging.info("Cached %d items in %.2f sec" % (len(cache), time.time() - start))
+		self.items = cache
+
+	## --------------------------------------------
+	## executeTransaction
+	## --------------------------------------------
+	def executeTransaction(self, txn, params):
+		"""Connections picked up with self.pool.get() or
+		   getReadConnection() during the transaction go back to their pool
+		   when it ends. If the transaction failed on a broken socket they
+		   are dropped and reopened on next use, and a read-only transaction
+		   is run once more on fresh connections. A server ID that is not
+		   configured raises KeyError. With home_warehouses the
+		   transaction runs on a home warehouse (see steer). With rebalance,
+		   a transaction on a warehouse that is being moved waits until the
+		   move is over (see rebalance)."""
+		start = time.time()
+		if not self.following:
+			result = self.runTransaction(txn, self.steer(params))
+		else:
+			self.layout.start()
+			params = self.steer(params)
+			version = self.layout.begin(self.paramWarehouses(params))
+			try:
+				result = self.runTransaction(txn, params)
+			finally:
+				self.layout.end(version)
+		## IF
+		self.stats.record(txn, LatencyStats.TOTAL, time.time() - start)
+		return result
+
+	def runTransaction(self, txn, params):
+		self.wire.context = txn
+		retries = 1 if txn in TokyocabinetDriver.READ_ONLY_TRANSACTIONS else 0
+		try:
+			while True:
+				try:
+					result = super(TokyocabinetDriver, self).executeTransaction(txn, params)
+					break
+				except CONNECTION_ERRORS, err:
+					self.releaseConnections(broken=True)
+					if not retries: raise
+					retries -= 1
+					logging.warn("Retrying %s on a fresh connection: %s" % (txn, err))
+				except:
+					self.releaseConnections()
+					raise
+			## WHILE
+		finally:
+			self.wire.context = None
+		self.releaseConnections()
+		return result
+
+	def paramWarehouses(self, params):
+		"""The W_IDs a transaction with params touches"""
+		w_ids = [ params["w_id"] ]
+		if params.get("c_w_id") is not None:
+			w_ids.append(params["c_w_id"])
+		if params.get("i_w_ids"):
+			w_ids.extend(params["i_w_ids"])
+		return w_ids
+
+	## --------------------------------------------
+	## homeWarehouses
+	## --------------------------------------------
+	def homeWarehouses(self):
+		"""Home warehouses of this client process under home_warehouses,
+		   or None. They are computed on first use by a TerminalScheduler
+		   over the warehouses found on the servers"""
+		if self.homes is None and self.affinity:
+			clientId = int(self.config["client_id"])
+			if clientId < 0:
+				identity = multiprocessing.current_process()._identity
+				clientId = identity[-1] - 1 if identity else 0
+			scheduler = TerminalScheduler(self.partitioner, self.getWarehouseIds(), int(self.config["num_clients"]))
+			self.homes = scheduler.home(clientId)
+			logging.info("Client %d runs on %d home warehouses on server %s" % (clientId, len(self.homes),
+					", ".join(map(str, sorted(set(self.getServer(w_id) for w_id in self.homes))))))
+		return self.homes
+
+	## --------------------------------------------
+	## steer
+	## --------------------------------------------
+	def steer(self, params, home=None):
+		"""Move a transaction onto home or, if no home is given and its W_ID
+		   is not one already, onto a random home warehouse. Its generated
+		   W_ID and the home warehouse swap places wherever a warehouse ID
+		   appears, which keeps the share of remote order lines and payments
+		   and the uniform choice of the remote warehouses. Returns the
+		   parameters unchanged without home_warehouses."""
+		homes = self.homeWarehouses()
+		if not homes: return params
+		w_id = params["w_id"]
+		if home is None:
+			if w_id in homes: return params
+			home = random.choice(homes)
+		if w_id == home: return params
+
+		swap = lambda x: home if x == w_id else (w_id if x == home else x)
+		params = dict(params)
+		params["w_id"] = home
+		if "c_w_id" in params:
+			params["c_w_id"] = swap(params["c_w_id"])
+		if "i_w_ids" in params:
+			params["i_w_ids"] = [ swap(x) for x in params["i_w_ids"] ]
+		return params
+
+	def releaseConnections(self, broken=False):
+		self.pool.release(broken)
+		if self.replicas is not None:
+			self.replicas.release(broken)
+
+	## --------------------------------------------
+	## executeFinish
+	## --------------------------------------------
+	def executeFinish(self):
+		"""Drain the write-behind buffer, sync the last group commit and
+		   stop the replica checks, then log the latency percentiles of the
+		   run, in milliseconds, and the round trips and bytes of every
+		   transaction type"""
+		if self.history is not None:
+			self.history.close()
+			logging.info("Wrote %d queued HISTORY records" % self.history.written)
+		if self.replicas is not None:
+			self.replicas.close()
+		if self.layout is not None:
+			self.layout.close()
+		if self.committer is not None:
+			self.committer.close()
+			if self.committer.syncs:
+				logging.info("Synced %d tables in %d group commits" % (self.committer.syncs, self.committer.groups))
+		if self.stats.histograms:
+			logging.info("Latency per transaction and stage (ms):\n%s" % self.stats.summary())
+		if self.wire.counters:
+			txnCounts = dict((txn, h.count) for (txn, stage), h in self.stats.histograms.iteritems()
+					if stage == LatencyStats.TOTAL)
+			logging.info("Requests per transaction and server:\n%s" % self.wire.summary(txnCounts))
+
+	## --------------------------------------------
+	## executeAsync
+	## --------------------------------------------
+	def executeAsync(self, scaleParameters, duration, generator=None, r=None):
+		"""Run the benchmark for duration seconds with async_terminals
+		   terminals on one event loop, each one issuing a transaction as
+		   soon as its previous one completes. Returns the Results.
+		   generator and r stand in for py-tpcc's Executor and Results if
+		   given (see tcbenchmark.py): a terminal stops when
+		   generator.doOne() returns None, and without a duration (None)
+		   only then."""
+		numTerminals = int(self.config["async_terminals"])
+		assert numTerminals > 0, "Invalid number of terminals %d" % numTerminals
+
+		if self.following:
+			self.layout.start()
+		loop = EventLoop()
+		self.asyncPool = AsyncPool(loop, self.databases, int(self.config["pool_size"]),
+				wire=self.wire if self.wire.enabled else None, codecs=CODECS)
+		if generator is None:
+			from runtime import executor
+			generator = executor.Executor(self, scaleParameters)
+		if r is None:
+			from util import results
+			r = results.Results()
+		if duration is None:
+			logging.info("Executing benchmark with %d terminals" % numTerminals)
+		else:
+			logging.info("Executing benchmark for %d seconds with %d terminals" % (duration, numTerminals))
+		start = r.startBenchmark()
+
+		## Under home_warehouses every terminal has a fixed home warehouse,
+		## taken in turn from those of this client
+		homes = self.homeWarehouses()
+
+		def terminal(home):
+			while duration is None or (time.time() - start) <= duration:
+				nextTxn = generator.doOne()
+				if nextTxn is None: break
+				txn, params = nextTxn
+				if home is not None:
+					params = self.steer(params, home)
+				txn_id = r.startTransaction(txn)
+				try:
+					yield self.executeTransactionAsync(txn, params)
+				except Exception, ex:
+					logging.warn("Failed to execute Transaction '%s': %s" % (txn, ex))
+					r.abortTransaction(txn_id)
+					continue
+				r.stopTransaction(txn_id)
+			## WHILE
+		## DEF
+
+		try:
+			loop.runUntilComplete([ terminal(homes[i % len(homes)] if homes else None) for i in xrange(numTerminals) ])
+		finally:
+			self.asyncPool.close()
+			self.asyncPool = None
+			self.itemsLoading = None
+		r.stopBenchmark()
+		return r
+
+	## --------------------------------------------
+	## executeTransactionAsync
+	## --------------------------------------------
+	def executeTransactionAsync(self, txn, params):
+		"""Task running one transaction on self.asyncPool. NEW_ORDER and
+		   PAYMENT issue their independent requests concurrently; the other
+		   transactions (and denormalized mode) use the blocking connections,
+		   which holds up the whole event loop while they run. With
+		   rebalance, a task on a warehouse that is being moved sleeps until
+		   the move is over."""
+		start = time.time()
+		version = None
+		while self.following:
+			version = self.layout.tryBegin(self.paramWarehouses(params))
+			if version is not None: break
+			yield self.asyncPool.loop.sleep(self.layout.interval)
+		## WHILE
+		try:
+			if not self.denormalize and txn in (constants.TransactionTypes.NEW_ORDER, constants.TransactionTypes.PAYMENT):
+				## Requests of this task are charged to txn
+				self.asyncPool.loop.context = txn
+				if txn == constants.TransactionTypes.NEW_ORDER:
+					result = yield self.doNewOrderAsync(params)
+				else:
+					result = yield self.doPaymentAsync(params)
+			else:
+				result = self.runTransaction(txn, params)
+		finally:
+			if version is not None:
+				self.layout.end(version)
+		self.stats.record(txn, LatencyStats.TOTAL, time.time() - start)
+		raise Return(result)
 
 	## --------------------------------------------
 	## doDelivery
@@ -270,44 +1219,46 @@ class TokyocabinetDriver(AbstractDriver):
 		Parameters Dict:
 			w_id
 			o_carrier_id
-			ol_delivery_id
+			ol_delivery_d
 		"""
+		if self.denormalize:
+			return self.doDeliveryDenormalized(params)
 
+		lap = self.stats.lap(constants.TransactionTypes.DELIVERY)
 		w_id = params["w_id"]
 		o_carrier_id = params["o_carrier_id"]
-		ol_delivery_d = params["ol_delivery_id"]
+		ol_delivery_d = params["ol_delivery_d"]
 
-		sID = getServer(w_id)
-
-		try:
-			newOrderQuery = self.conn[sID]["NEW_ORDER"].query
-			ordersQuery   = self.conn[sID]["ORDERS"].query
-			orderLineQuery = self.conn[sID]["ORDER_LINE"].query
-			customerQuery = self.conn[sID]["CUSTOMER"].query
-		except KeyError, err:
-			sys.stderr.out("%s(%s): server ID does not exist or is offline\n" %(KeyError, err))
-			sys.exit(1)
+		sID = self.getServer(w_id)
 
+		conn = self.pool.get(sID)
+		newOrders = conn[constants.TABLENAME_NEW_ORDER]
+		orderLines = conn[constants.TABLENAME_ORDER_LINE]
+		## The ORDERS, ORDER_LINE and CUSTOMER updates of all districts are
+		## written together when the transaction commits
+		rows = RowBuffer(conn)
+		lap("getConnection")
 
-		results = [ ]
+		result = [ ]
 		for d_id in xrange(1, constants.DISTRICTS_PER_WAREHOUSE+1):
 
-			# getNewOrder
-			newOrders = newOrderQuery.filter("NO_D_ID" = d_id, "NO_W_ID" = w_id, "NO_O_ID" = 1)
-			if len(newOrders) == 0:
+			# getNewOrder, deleteNewOrder
+			no_o_id = self.popNewOrder(newOrders, w_id, d_id)
+			lap("popNewOrder")
+			if no_o_id is None:
 				## No orders for this district: skip it. Note: This must
 				## reported if > 1%
 				continue
-			assert len(newOrders) > 0
-			no_o_id = newOrders.columns("NO_O_ID")[0]["NO_O_ID"]
 
 			# getCId
-			cids = orderQuery.filter("O_ID" = no_o_id, "O_D_ID" = d_id, "O_W_ID" = w_id, "O_C_ID" = 1)
-			assert len(c_ids) > 0
-			c_id = cids.columns("O_C_ID")[0]["O_C_ID"]
+			o_key = ORDERS_KEY.encode(w_id, d_id, no_o_id)
+			order = conn["ORDERS"][o_key]
+			c_id = order["O_C_ID"]
+			lap("getCId")
 
 			# sumOLAmount
-			olines = orderLineQuery.filter("OL_O_ID" = no_o_id, "OL_D_ID" = d_id, "OL_W_ID" = w_id)
+			## The lines of an order are one prefix scan of ORDER_LINE
+			lines = self.scanPrefix(orderLines, ORDER_LINE_KEY.prefix(w_id, d_id, no_o_id))
 
 			# These must be logged in the "result file" according to TPC-C 
 			# 2.7.22 (page 39)
@@ -315,43 +1266,194 @@ class TokyocabinetDriver(AbstractDriver):
 			# o_carrier_id: the client can figure them out
 			# If there are no order lines, SUM returns null. There should
 			# always be order lines.
-			assert len(olines) > 0, "ol_total is NULL: there are no order lines. This should not happen"
+			assert len(lines) > 0, "ol_total is NULL: there are no order lines. This should not happen"
 
-			ol_total = sum(olines.columns("OL_AMOUNT").values())
+			ol_total = sum(ol["OL_AMOUNT"] for key, ol in lines)
 
 			assert ol_total > 0.0
-
-			# deleteNewOrder
-			orders = newOrderQuery.filter("NO_D_ID" = d_id, "NO_W_ID" = w_id, "NO_O_ID" = no_o_id)
-			orders.delete(quick=True)
+			lap("sumOLAmount")
 
 			# updateOrders
-			orders = orderQuery.filter("O_ID" = no_o_id, "O_D_ID" = d_id, "O_W_ID" = w_id)
-			## UPDATE ORDERS SET O_CARRIER_ID = ?...
-			for record in orders:
-				key, cols = record
-				cols["O_CARRIER_ID"] = o_carrier_id
-				self.conn[sID]["ORDERS"].put(key, orders)
+			order["O_CARRIER_ID"] = o_carrier_id
+			rows.put("ORDERS", o_key, order)
+			lap("updateOrders")
 
 			# updateOrderLine
-			orders = orderLineQuery.filter("OL_O_ID" = no_o_id, "OL_D_ID" = d_id, "OL_W_ID" = w_id)
-			for record in orders:
-				key, cols = record
-				cols["OL_DELIVERY_ID"] = ol_delivery_id
-				self.conn[sID]["ORDER_LINE"].put(key, ol_delivery_d)
+			for key, ol in lines:
+				ol["OL_DELIVERY_D"] = ol_delivery_d
+			rows.putMany("ORDER_LINE", lines)
+			lap("updateOrderLine")
 
 			# updateCustomer
-			customers = customerQuery.filter("C_ID" = c_id, "C_D_ID" = d_id, "C_W_ID" = w_id)
-			for record in customers:
-				key, cols = record
-				cols["C_BALANCE"] += ol_total
-				self.conn[sID]["CUSTOMER"].put(key, cols)
-		
+			c_key = CUSTOMER_KEY.encode(w_id, d_id, c_id)
+			customer = conn["CUSTOMER"][c_key]
+			customer["C_BALANCE"] += ol_total
+			customer["C_DELIVERY_CNT"] += 1
+			rows.put("CUSTOMER", c_key, customer)
+			lap("updateCustomer")
+
 			result.append((d_id, no_o_id))
 		## FOR
 
+		## Commit!
+		written = rows.flush()
+		lap("flush")
+		if result:
+			self.committer.commit((sID, tab) for tab in [ "NEW_ORDER" ] + written)
+		lap("commit")
+
 		return result
 
+	def doDeliveryDenormalized(self, params):
+		"""Execute DELIVERY Transaction on denormalized order records.
+		The order and its order lines are updated inside the order's record
+		(see orderRecord), which is read together with the customer, and
+		the writes of all districts go out together at commit. The
+		customer's older orders that were already delivered are deleted:
+		ORDER_STATUS only reads the last one.
+		"""
+
+		lap = self.stats.lap(constants.TransactionTypes.DELIVERY)
+		w_id = params["w_id"]
+		o_carrier_id = params["o_carrier_id"]
+		ol_delivery_d = params["ol_delivery_d"]
+
+		sID = self.getServer(w_id)
+
+		conn = self.pool.get(sID)
+		newOrders = conn[constants.TABLENAME_NEW_ORDER]
+		customers = conn[constants.TABLENAME_CUSTOMER]
+		rows = RowBuffer(conn)
+		lap("getConnection")
+
+		result = [ ]
+		delivered = [ ]
+		for d_id in xrange(1, constants.DISTRICTS_PER_WAREHOUSE+1):
+
+			# getNewOrder, deleteNewOrder
+			no_o_id = self.popNewOrder(newOrders, w_id, d_id)
+			lap("popNewOrder")
+			if no_o_id is None:
+				## No orders for this district: skip it. Note: This must
+				## reported if > 1%
+				continue
+
+			# getCId
+			c_id = conn["ORDERS"][ORDERS_KEY.encode(w_id, d_id, no_o_id)]["O_C_ID"]
+			lap("getCId")
+
+			# getCustomer: the customer and its order records, in one getlist
+			c_key = CUSTOMER_KEY.encode(w_id, d_id, c_id)
+			o_keys = customers.proto.fwmkeys(customerOrderKey(w_id, d_id, c_id), MAX_SCAN_KEYS)
+			records = dict(customers.multi_get([ c_key ] + o_keys))
+			customer = records[c_key]
+			lap("getCustomer")
+
+			# updateOrders, updateOrderLine and sumOLAmount, all inside the order record
+			o_key = customerOrderKey(w_id, d_id, c_id, no_o_id)
+			order = decodeOrder(records[o_key][ORDER_COLUMN])
+			order["O_CARRIER_ID"] = o_carrier_id
+			ol_total = 0.0
+			for ol in order["ORDER_LINES"]:
+				ol["OL_DELIVERY_D"] = ol_delivery_d
+				ol_total += ol["OL_AMOUNT"]
+			## FOR
+
+			# If there are no order lines, SUM returns null. There should
+			# always be order lines.
+			assert ol_total > 0.0, "ol_total is NULL: there are no order lines. This should not happen"
+			rows.put("CUSTOMER", o_key, self.orderRecord(order))
+			lap("sumOLAmount")
+
+			## An older order is only seen delivered once the delivery that
+			## delivered it wrote its record for the last time, so nobody
+			## uses the records deleted here any more
+			for key in o_keys:
+				if key >= o_key: break
+				if key in records and decodeOrder(records[key][ORDER_COLUMN])["O_CARRIER_ID"] is not None:
+					delivered.append(key)
+			## FOR
+
+			# updateCustomer
+			customer["C_BALANCE"] += ol_total
+			customer["C_DELIVERY_CNT"] += 1
+			rows.put("CUSTOMER", c_key, customer)
+			lap("updateCustomer")
+
+			result.append((d_id, no_o_id))
+		## FOR
+
+		## Commit!
+		written = rows.flush()
+		if delivered:
+			customers.sendList("outlist", delivered)
+			customers.receiveList()
+		lap("flush")
+		if result:
+			self.committer.commit((sID, tab) for tab in [ "NEW_ORDER" ] + written)
+		lap("commit")
+
+		return result
+
+	## --------------------------------------------
+	## popNewOrder
+	## --------------------------------------------
+	def popNewOrder(self, newOrders, w_id, d_id):
+		"""Take the oldest undelivered order of a district off its new-order
+		   queue and return its O_ID, or None if the queue is empty. NEW_ORDER
+		   keys are consecutive O_IDs behind a head record, so this costs a
+		   read of the head, the delete of the NEW_ORDER record it points to
+		   and a write moving it on, however long the queue is. When the
+		   record at the head is missing the queue is rescanned (see
+		   popNewOrderAfterGap).
+
+		   The delete is what claims an order: only one delivery gets it.
+		   The head is only a hint and is always written whole, never
+		   incremented: a delivery that claimed the order it read at the
+		   head sets it to the next O_ID, which no queued order precedes. If
+		   a concurrent delivery moved the head on in the meantime, this
+		   moves it back over orders that are already gone, and the next
+		   delivery finds no record there and rescans. An increment would
+		   instead move it past the order the other delivery left at the
+		   head, which would then wait for the next rescan."""
+		head = newOrderHeadKey(w_id, d_id)
+		try:
+			no_o_id = int(newOrders[head]["_num"])
+		except KeyError:
+			return None
+		try:
+			del newOrders[NEW_ORDER_KEY.encode(w_id, d_id, no_o_id)]
+		except KeyError:
+			return self.popNewOrderAfterGap(newOrders, w_id, d_id, no_o_id)
+		self.setNewOrderHead(newOrders, w_id, d_id, no_o_id + 1)
+		return no_o_id
+
+	def popNewOrderAfterGap(self, newOrders, w_id, d_id, head_o_id):
+		"""popNewOrder for a district whose head points at a missing record:
+		   the queue is empty, a concurrent delivery took the record, or the
+		   O_ID was allocated by a NEW_ORDER that failed before writing it or
+		   has not written it yet. One forward-matching key scan finds the
+		   oldest record still queued, wherever it is; the head is moved past
+		   it if it was ahead of the head. No record older than it was left
+		   at the time of the scan, so like popNewOrder this never moves the
+		   head past a queued order."""
+		keys = newOrders.proto.fwmkeys(NEW_ORDER_KEY.prefix(w_id, d_id), MAX_SCAN_KEYS)
+		o_ids = sorted(NEW_ORDER_KEY.decode(key)[2] for key in keys if len(key) == NEW_ORDER_KEY.width)
+		for no_o_id in o_ids:
+			try:
+				del newOrders[NEW_ORDER_KEY.encode(w_id, d_id, no_o_id)]
+			except KeyError:
+				## Taken by a concurrent delivery
+				continue
+			if no_o_id >= head_o_id:
+				self.setNewOrderHead(newOrders, w_id, d_id, no_o_id + 1)
+			return no_o_id
+		## FOR
+		return None
+
+	def setNewOrderHead(self, newOrders, w_id, d_id, no_o_id):
+		newOrders[newOrderHeadKey(w_id, d_id)] = {"NO_W_ID": w_id, "NO_D_ID": d_id, "_num": no_o_id}
+
 	def doNewOrder(self, params):
 		"""Execute NEW_ORDER Transaction
 		Parameters Dict:
@@ -364,6 +1466,7 @@ class TokyocabinetDriver(AbstractDriver):
 			i_qtys
 		"""
 
+		lap = self.stats.lap(constants.TransactionTypes.NEW_ORDER)
 		w_id = params["w_id"]
 		d_id = params["d_id"]
 		c_id = params["c_id"]
@@ -376,56 +1479,41 @@ class TokyocabinetDriver(AbstractDriver):
 		assert len(i_ids) == len(i_w_ids)
 		assert len(i_ids) == len(i_qtys)
 
-		sID = getServer(w_id)
+		sID = self.getServer(w_id)
+		## The STOCK records of the lines live on the servers of their
+		## supplying warehouses
+		s_keys = self.stockKeysByServer(i_ids, i_w_ids)
 
-		try:
-			warehouseQuery = self.conn[sID]["WAREHOUSE"].query
-			districtQuery  = self.conn[sID]["DISTRICT"].query
-			customerQuery  = self.conn[sID]["CUSTOMER"].query
-			orderQuery = self.conn[sID]["ORDERS"].query
-			newOrderQuery = self.conn[sID]["NEW_ORDER"].query
-			itemQuery = self.conn[sID]["ITEM"].query
-			stockQuery = self.conn[sID]["STOCK"].query
-		except KeyError, err:
-			sys.stderr.out("%s(%s): server ID does not exist or is offline\n" %(KeyError, err))
-			sys.exit(1)
+		conn = self.holdServers([ sID ] + s_keys.keys())[sID]
+		lap("getConnection")
 
-		all_local = True
-		items = [ ]
-		for i in xrange(len(i_ids)):
-			## Determine if this is an all local order or not
-			all_local = all_local and i_w_ids[i] == w_id
-			# getItemInfo
-			itemInfo = itemQuery.filter("I_PRICE" = i_ids[i])
-			items.append(itemInfo[0])
-		assert len(items) == len(i_ids)
+		## Determine if this is an all local order or not
+		all_local = all(i_w_id == w_id for i_w_id in i_w_ids)
 
-		## TPCC define 1% of neworder gives a wrong itemid, causing rollback.
-		## Note that this will happen with 1% of transactions on purpose.
-		for item in items:
-			if len(item) == 0:
-				## TODO Abort here!
-				return
-		## FOR
+		# getItemInfo
+		items = self.newOrderItems(sID, i_ids)
+		if items is None:
+			return
+		lap("getItemInfo")
 
 		## -----------------
 		## Collect Information from WAREHOUSE, DISTRICT, and CUSTOMER
 		## -----------------
-		
+
 		# getWarehouseTaxRate
-		taxes = warehouseQuery.filter("W_ID" = w_id)
-		w_tax = taxes.columns("W_TAX")[0]("W_TAX")
+		w_tax = conn["WAREHOUSE"][WAREHOUSE_KEY.encode(w_id)]["W_TAX"]
+		lap("getWarehouseTaxRate")
 
 		# getDistrict
-		districts = districtQuery.filter("D_ID" = d_id, "D_W_ID" = w_id)
-		districtInfo = districts.columns("D_TAX", "D_NEXT_O_ID")[0]
-		d_tax = districtInfo["D_TAX"]
-		d_next_o_id = districtInfo["D_NEXT_O_ID"]
+		d_tax = conn["DISTRICT"][DISTRICT_KEY.encode(w_id, d_id)]["D_TAX"]
+		lap("getDistrict")
 
 		# getCustomer
-		customers = customerQuery.filter("C_W_ID" = w_id, "C_D_ID" = d_id, "C_ID" = c_id)
-		customerInfo = customers.columns("C_DISCOUNT", "C_LAST", "C_CREDIT")[0]
-		c_discount = customerInfo["C_DISCOUNT"]
+		c_key = CUSTOMER_KEY.encode(w_id, d_id, c_id)
+		customer = conn["CUSTOMER"][c_key]
+		customerInfo = dict((c, customer[c]) for c in ("C_DISCOUNT", "C_LAST", "C_CREDIT"))
+		c_discount = customer["C_DISCOUNT"]
+		lap("getCustomer")
 
 		## -----------------
 		## Insert Order Information
@@ -434,51 +1522,248 @@ class TokyocabinetDriver(AbstractDriver):
 		o_carrier_id = constants.NULL_CARRIER_ID
 
 		# incrementNextOrderId
-		districts = districtQuery.filter("D_ID" = d_id, "D_W_ID" = w_id)
-		for record in districts:
-			key, cols = record
-			cols["D_NEXT_O_ID"] = d_next_o_id + 1
-			self.conn[sID]["DISTRICT"].put(key, cols)
+		## One atomic addint on the district's counter allocates the order ID,
+		## so concurrent terminals never get the same one
+		d_next_o_id = conn["DISTRICT"].proto.addint(nextOrderIdKey(w_id, d_id), 1) - 1
+		lap("incrementNextOrderId")
 
 		# createOrder
-		key = tupleToString((d_next_o_id, d_id, w_id))
-		cols = {"O_ID": d_next_o_id, "O_D_ID": d_id, "O_W_ID": w_id, "O_C_ID":
+		o_key = ORDERS_KEY.encode(w_id, d_id, d_next_o_id)
+		order = {"O_ID": d_next_o_id, "O_D_ID": d_id, "O_W_ID": w_id, "O_C_ID":
 						c_id, "O_ENTRY_D": o_entry_d, "O_CARRIER_ID":
-						o_carrier_id, "O_OL_CNT": o_ol_cnt, "O_ALL_LOCAL":
-						all_local}
-		self.conn[sID]["ORDERS"].put(key, cols)
+						o_carrier_id, "O_OL_CNT": ol_cnt, "O_ALL_LOCAL":
+						int(all_local), "ORDER_LINES": [ ]}
+		if not self.denormalize:
+			conn["ORDERS"][o_key] = dict((k, v) for k, v in order.iteritems() if k != "ORDER_LINES")
+		lap("createOrder")
 
 		# createNewOrder
-		key = tupleToString((d_next_o_id, d_id, w_id))
 		cols = {"NO_O_ID": d_next_o_id, "NO_D_ID": d_id, "NO_W_ID": w_id}
-		self.conn[sID]["NEW_ORDER"].put(key, cols)
+		conn["NEW_ORDER"][NEW_ORDER_KEY.encode(w_id, d_id, d_next_o_id)] = cols
+		lap("createNewOrder")
 
 		## -------------------------------
 		## Insert Order Item Information
 		## -------------------------------
 
+		# getStockInfo
+		## The STOCK records of the lines are read from the servers of their
+		## supplying warehouses, with one getlist per server, all sent before
+		## any response is awaited. newOrderLines updates them and they are
+		## written back the same way.
+		stockTables = dict((s, self.pool.get(s)["STOCK"]) for s in s_keys)
+		stocks = dict()
+		for records in multiGetAll([ (stockTables[s], keys) for s, keys in s_keys.iteritems() ]):
+			stocks.update(records)
+		lap("getStockInfo")
+		orderLines, item_data, total = self.newOrderLines(w_id, d_id, d_next_o_id, o_entry_d,
+				i_ids, i_w_ids, i_qtys, items, stocks)
+		lap("newOrderLines")
+
+		# updateStock
+		multiSetAll([ (stockTables[s], [ (k, stocks[k]) for k in keys if k in stocks ])
+				for s, keys in s_keys.iteritems() ])
+		lap("updateStock")
+
+		# createOrderLine
+		if self.denormalize:
+			order["ORDER_LINES"] = [ cols for key, cols in orderLines ]
+		elif orderLines:
+			conn["ORDER_LINE"].multi_set(orderLines)
+		lap("createOrderLine")
+
+		if self.denormalize:
+			# createOrder: the order goes into a new record of the customer's
+			conn["CUSTOMER"][customerOrderKey(w_id, d_id, c_id, d_next_o_id)] = self.orderRecord(order)
+			conn["ORDERS"][o_key] = self.orderStub(order)
+			lap("createOrderDocument")
+		## IF
+
+		## Commit!
+		if self.denormalize:
+			written = ("DISTRICT", "ORDERS", "NEW_ORDER", "CUSTOMER")
+		else:
+			written = ("DISTRICT", "ORDERS", "NEW_ORDER", "ORDER_LINE")
+		self.committer.commit([ (sID, tab) for tab in written ] + [ (s, "STOCK") for s in s_keys ])
+		lap("commit")
+
+		## Adjust the total for the discount
+		#print "c_discount:", c_discount, type(c_discount)
+		#print "w_tax:", w_tax, type(w_tax)
+		#print "d_tax:", d_tax, type(d_tax)
+		total *= (1 - c_discount) * (1 + w_tax + d_tax)
+
+		## Pack up values the client is missing (see TPC-C 2.4.3.5)
+		misc = [(w_tax, d_tax, d_next_o_id, total)]
+
+		return [ customerInfo, misc, item_data ]
+
+	def doNewOrderAsync(self, params):
+		"""Task executing a NEW_ORDER Transaction on self.asyncPool. The
+		WAREHOUSE, DISTRICT, CUSTOMER and STOCK reads go out together with
+		the order ID allocation, and all the writes go out together."""
+
+		lap = self.stats.lap(constants.TransactionTypes.NEW_ORDER)
+		w_id = params["w_id"]
+		d_id = params["d_id"]
+		c_id = params["c_id"]
+		o_entry_d = params["o_entry_d"]
+		i_ids = params["i_ids"]
+		i_w_ids = params["i_w_ids"]
+		i_qtys = params["i_qtys"]
+
+		assert len(i_ids) > 0
+		assert len(i_ids) == len(i_w_ids)
+		assert len(i_ids) == len(i_qtys)
+
+		sID = self.getServer(w_id)
+		conn = self.asyncPool.get(sID)
+
+		all_local = all(i_w_id == w_id for i_w_id in i_w_ids)
+
+		# getItemInfo
+		items = yield self.newOrderItemsAsync(sID, i_ids)
+		if items is None:
+			return
+		lap("getItemInfo")
+
+		# getWarehouseTaxRate, getDistrict, incrementNextOrderId, getCustomer, getStockInfo
+		## STOCK is read from the servers of the supplying warehouses
+		s_keys = self.stockKeysByServer(i_ids, i_w_ids)
+		stockTables = dict((s, self.asyncPool.get(s)["STOCK"]) for s in s_keys)
+		warehouse, district, next_o_id, customer, stockReads = yield [
+			conn["WAREHOUSE"].get(WAREHOUSE_KEY.encode(w_id)),
+			conn["DISTRICT"].get(DISTRICT_KEY.encode(w_id, d_id)),
+			conn["DISTRICT"].addint(nextOrderIdKey(w_id, d_id), 1),
+			conn["CUSTOMER"].get(CUSTOMER_KEY.encode(w_id, d_id, c_id)),
+			[ stockTables[s].multiGet(keys) for s, keys in s_keys.iteritems() ],
+		]
+		w_tax = warehouse["W_TAX"]
+		d_tax = district["D_TAX"]
+		d_next_o_id = next_o_id - 1
+		customerInfo = dict((c, customer[c]) for c in ("C_DISCOUNT", "C_LAST", "C_CREDIT"))
+		c_discount = customer["C_DISCOUNT"]
+		lap("reads")
+
+		stocks = dict()
+		for records in stockReads:
+			stocks.update(records)
+		orderLines, item_data, total = self.newOrderLines(w_id, d_id, d_next_o_id, o_entry_d,
+				i_ids, i_w_ids, i_qtys, items, stocks)
+		lap("newOrderLines")
+
+		# createOrder, createNewOrder, updateStock, createOrderLine
+		order = {"O_ID": d_next_o_id, "O_D_ID": d_id, "O_W_ID": w_id, "O_C_ID":
+						c_id, "O_ENTRY_D": o_entry_d, "O_CARRIER_ID":
+						constants.NULL_CARRIER_ID, "O_OL_CNT": len(i_ids), "O_ALL_LOCAL":
+						int(all_local)}
+		no_cols = {"NO_O_ID": d_next_o_id, "NO_D_ID": d_id, "NO_W_ID": w_id}
+		writes = [
+			conn["ORDERS"].put(ORDERS_KEY.encode(w_id, d_id, d_next_o_id), order),
+			conn["NEW_ORDER"].put(NEW_ORDER_KEY.encode(w_id, d_id, d_next_o_id), no_cols),
+		]
+		for s, keys in s_keys.iteritems():
+			writes.append(stockTables[s].multiSet([ (k, stocks[k]) for k in keys if k in stocks ]))
+		if orderLines:
+			writes.append(conn["ORDER_LINE"].multiSet(orderLines))
+		yield writes
+		lap("writes")
+
+		## Commit!
+		yield self.committer.commitAsync(self.asyncPool,
+				[ (sID, tab) for tab in ("DISTRICT", "ORDERS", "NEW_ORDER", "ORDER_LINE") ] +
+				[ (s, "STOCK") for s in s_keys ])
+		lap("commit")
+
+		total *= (1 - c_discount) * (1 + w_tax + d_tax)
+		misc = [(w_tax, d_tax, d_next_o_id, total)]
+		raise Return([ customerInfo, misc, item_data ])
+
+	## --------------------------------------------
+	## newOrderItems
+	## --------------------------------------------
+	def newOrderItems(self, sID, i_ids):
+		"""The (I_PRICE, I_NAME, I_DATA) of every item of a NEW_ORDER, or
+		   None if one of them does not exist"""
+		items = [ self.getItemInfo(sID, i_id) for i_id in i_ids ]
+		return self.checkItems(items)
+
+	def newOrderItemsAsync(self, sID, i_ids):
+		"""Task version of newOrderItems. The ItemCache is filled with a
+		   search on self.asyncPool, shared by every task that needs it
+		   before it is ready, rather than on a blocking connection, which
+		   would hold up the event loop."""
+		if self.items is None:
+			if self.itemsLoading is None:
+				self.itemsLoading = (time.time(), self.asyncPool.get(sID)[constants.TABLENAME_ITEM].search([ ]))
+			start, loading = self.itemsLoading
+			try:
+				records = yield loading
+			except:
+				## The next task tries again
+				self.itemsLoading = None
+				raise
+			with self.itemsLock:
+				if self.items is None:
+					self.cacheItems([ cols for key, cols in records ], start)
+			## WITH
+		## IF
+		raise Return(self.checkItems([ self.items.get(i_id) for i_id in i_ids ]))
+
+	def checkItems(self, items):
+		"""items, or None if one of them is None"""
+		## TPCC define 1% of neworder gives a wrong itemid, causing rollback.
+		## Note that this will happen with 1% of transactions on purpose.
+		## Nothing has been written yet, so returning here is the rollback.
+		for item in items:
+			if item is None:
+				return None
+		## FOR
+		return items
+
+	## --------------------------------------------
+	## stockKeysByServer
+	## --------------------------------------------
+	def stockKeysByServer(self, i_ids, i_w_ids):
+		"""The STOCK keys of the lines of a NEW_ORDER, grouped by the server
+		   holding their supplying warehouse: {sID: [key]}. An item ordered
+		   twice from the same warehouse appears once."""
+		s_keys = dict()
+		for i in xrange(len(i_ids)):
+			key = STOCK_KEY.encode(i_w_ids[i], i_ids[i])
+			keys = s_keys.setdefault(self.getServer(i_w_ids[i]), [ ])
+			if not key in keys:
+				keys.append(key)
+		## FOR
+		return s_keys
+
+	## --------------------------------------------
+	## newOrderLines
+	## --------------------------------------------
+	def newOrderLines(self, w_id, d_id, o_id, o_entry_d, i_ids, i_w_ids, i_qtys, items, stocks):
+		"""Apply the lines of a NEW_ORDER to the STOCK records in stocks
+		   (keyed by STOCK_KEY, updated in place) and build its ORDER_LINE
+		   records. Returns ([(key, orderLine)], item_data, total)"""
 		item_data = [ ]
+		orderLines = [ ]
 		total = 0
-		for i in xrange(len(i_id)):
+		for i in xrange(len(i_ids)):
 			ol_number = i+1
 			ol_supply_w_id = i_w_ids[i]
 			ol_i_id = i_ids[i]
 			ol_quantity = i_qtys[i]
 
 			# getItemInfo
-			key, itemInfo = items[i]
-			i_price = itemInfo["I_PRICE"]
-			i_name  = itemInfo["I_NAME"]
-			i_data  = itemInfo["I_DATA"]
+			i_price, i_name, i_data = items[i]
 
 			# getStockInfo
-			stocks = stockQuery.filter("S_I_ID" = ol_i_id, "S_W_ID" = ol_supply_w_id)
-			if len(stocks) == 0:
+			## An item ordered twice finds the record already updated by the
+			## earlier line, as it would with one read per line
+			stockInfo = stocks.get(STOCK_KEY.encode(ol_supply_w_id, ol_i_id))
+			if stockInfo is None:
 				logging.warn("No STOCK record for (ol_i_id=%d, ol_supply_w_id=%d)"
 								% (ol_i_id, ol_supply_w_id))
 				continue
-			stockInfo = stock.columns("S_QUANTITY", "S_DATA", "S_YTD", "S_ORDER_CNT",
-						"S_REMOTE_CNT", "S_DIST_%02d"%d_id)[0]
 
 			s_quantity = stockInfo["S_QUANTITY"]
 			s_data = stockInfo["S_DATA"]
@@ -498,17 +1783,13 @@ class TokyocabinetDriver(AbstractDriver):
 
 			if ol_supply_w_id != w_id: s_remote_cnt += 1
 
-			stocks = stockQuery.filter("S_I_ID" = ol_i_id, "S_W_ID" = ol_supply_w_id)
-			for record in stocks:
-				key, cols = record
-				cols["S_QUANTITY"] = s_quantity
-				cols["S_YTD"] = s_ytd
-				cols["S_ORDER_CNT"] =  s_order_cnt
-				cols["S_REMOTE_CNT"] = s_remote_cnt
-				self.conn[sID]["STOCK"].put(key, cols)
+			stockInfo["S_QUANTITY"] = s_quantity
+			stockInfo["S_YTD"] = s_ytd
+			stockInfo["S_ORDER_CNT"] = s_order_cnt
+			stockInfo["S_REMOTE_CNT"] = s_remote_cnt
 
 			if i_data.find(constants.ORIGINAL_STRING) != -1 and s_data.find(constants.ORIGINAL_STRING) != -1:
-				bran_generic = 'B'
+				brand_generic = 'B'
 			else:
 				brand_generic = 'G'
 
@@ -517,33 +1798,17 @@ class TokyocabinetDriver(AbstractDriver):
 			total += ol_amount
 
 			# createOrderLine
-			key = tupletoString((d_next_o_id, d_id, w_id, ol_number))
-			cols = ("OL_O_ID": d_next_o_id, "OL_D_ID": d_id, "OL_W_ID": w_id,
+			cols = {"OL_O_ID": o_id, "OL_D_ID": d_id, "OL_W_ID": w_id,
 							"OL_NUMBER": ol_number, "OL_I_ID": ol_i_id,
 							"OL_SUPPLY_W_ID": ol_supply_w_id, "OL_DELIVERY_D":
-							ol_entry_d, "OL_QUANTITY": ol_quantity, "OL_AMOUNT":
-							ol_amount, "OL_DIST_INFO": s_dist_xx)
-			self.conn[sID]["ORDER_LINE"].put(key, cols)
+							o_entry_d, "OL_QUANTITY": ol_quantity, "OL_AMOUNT":
+							ol_amount, "OL_DIST_INFO": s_dist_xx}
+			orderLines.append((ORDER_LINE_KEY.encode(w_id, d_id, o_id, ol_number), cols))
 
 			## Add the info to be returned
 			item_data.append((i_name, s_quantity, brand_generic, i_price, ol_amount))
 		## FOR
-		
-		## Commit!
-		# TODO Commit
-		#for tab in self.conn[sID].keys():
-		#	self.conn[sID][tab].sync()
-
-		## Adjust the total for the discount
-		#print "c_discount:", c_discount, type(c_discount)
-		#print "w_tax:", w_tax, type(w_tax)
-		#print "d_tax:", d_tax, type(d_tax)
-		total *= (1 - c_discount) * (1 + w_tax + d_tax)
-
-		## Pack up values the client is missing (see TPC-C 2.4.3.5)
-		misc = [(w_tax, d_tax, d_next_o_id, total)]
-
-		return [ customerInfo, misc, item_data ]
+		return orderLines, item_data, total
 
 	def doOrderStatus(self, params):
 		"""Execute ORDER_STATUS Transaction
@@ -553,6 +1818,10 @@ class TokyocabinetDriver(AbstractDriver):
 			c_id
 			c_last
 		"""
+		if self.denormalize:
+			return self.doOrderStatusDenormalized(params)
+
+		lap = self.stats.lap(constants.TransactionTypes.ORDER_STATUS)
 		w_id = params["w_id"]
 		d_id = params["d_id"]
 		c_id = params["c_id"]
@@ -561,49 +1830,86 @@ class TokyocabinetDriver(AbstractDriver):
 		assert w_id, pformat(params)
 		assert d_id, pformat(params)
 
-		sID = getServer(w_id)
+		sID = self.getServer(w_id)
 
-		try:
-			customerQuery = self.conn["CUSTOMER"]
-			orderQuery    = self.conn["ORDERS"]
-			orderLineQuery= self.conn["ORDER_LINE"]
-		except KeyError, err:
-			sys.stderr.out("%s(%s): server ID does not exist or is offline\n" %(KeyError, err))
-			sys.exit(1)
+		conn = self.getReadConnection(sID)
+		orderQuery    = conn["ORDERS"].query
+		lap("getConnection")
 
-		if c_id != None:
-			# getCustomerByCustomerId
-			customers = customerQuery.filter("C_W_ID" = w_id, "C_D_ID" = d_id, "C_ID" = c_id)
-			customerInfo = customer.columns("C_ID", "C_FIRST", "C_MIDDLE", "C_LAST", "C_BALANCE")[0]
-		else:
+		if c_id == None:
 			# Get the midpoint customer's id
 			# getCustomersByLastName
-			customers = customerQuery.filter("C_W_ID" = w_id, "C_D_ID" = d_id, "C_LAST" = c_last).order_by("C_FIRST")
-			all_customers = customers.columns("C_ID", "C_FIRST", "C_MIDDLE", "C_LAST", "C_BALANCE")
-			namecnt = len(all_customers)
-			assert namecnt > 0
-			index = (namecnt-1)/2
-			customer = all_customers[index]
-			c_id = customer["C_ID"]
-		assert len(customer) > 0
+			c_id = self.midpointCustomerId(conn["CUSTOMER"][customerNameKey(w_id, d_id, c_last)])
+		# getCustomerByCustomerId
+		customer = conn["CUSTOMER"][CUSTOMER_KEY.encode(w_id, d_id, c_id)]
 		assert c_id != None
+		customerInfo = dict((c, customer[c]) for c in ("C_ID", "C_FIRST", "C_MIDDLE", "C_LAST", "C_BALANCE"))
+		lap("getCustomer")
 
 		# getLastOrder
-		orders = orderQuery.filter("O_W_ID" = w_id, "O_D_ID" = d_id, "O_C_ID" =	c_id).order_by("-O_ID", numeric=True)
-		orderInfo = orders.columns("O_ID", "O_CARRIER_ID", "O_ENTRY_D")[0]
-		o_id = orderInfo["O_ID"]
+		orders = orderQuery.filter(O_W_ID=w_id, O_D_ID=d_id, O_C_ID=c_id).order_by("-O_ID", numeric=True)
+		orders = orders.columns("O_ID", "O_CARRIER_ID", "O_ENTRY_D")
+		orderInfo = orders[0] if orders else None
+		lap("getLastOrder")
 
 		# getOrderLines
-		if order:
-			orders = orderLineQuery.filter("OL_W_ID" = w_id, "OL_D_ID" = d_id, "OL_O_ID" = o_id)
-			orderLines = orderLines.columns("OL_SUPPLY_W_ID", "OL_I_ID", "OL_QUANTITY", "OL_AMOUNT", "OL_DELIVERY_D")
+		## ORDER_LINE keys start with the order's key, so the lines of one
+		## order are a single prefix scan
+		if orderInfo:
+			o_id = int(orderInfo["O_ID"])
+			lines = self.scanPrefix(conn["ORDER_LINE"], ORDER_LINE_KEY.prefix(w_id, d_id, o_id))
+			orderLines = [ dict((c, ol[c]) for c in ("OL_SUPPLY_W_ID", "OL_I_ID", "OL_QUANTITY",
+					"OL_AMOUNT", "OL_DELIVERY_D")) for key, ol in lines ]
 		else:
 			orderLines = [ ]
+		lap("getOrderLines")
 
-		## Commit!
-		# TODO Commit
-		#for tab in self.conn[sID].keys():
-		#	self.conn[sID][tab].sync()
+		## Read-only: nothing to commit
+
+		return [customerInfo, orderInfo, orderLines]
+
+	def doOrderStatusDenormalized(self, params):
+		"""Execute ORDER_STATUS Transaction on denormalized order records.
+		The customer's last order and its order lines are one record, read
+		with the customer in a single getlist once its key is known.
+		"""
+		lap = self.stats.lap(constants.TransactionTypes.ORDER_STATUS)
+		w_id = params["w_id"]
+		d_id = params["d_id"]
+		c_id = params["c_id"]
+		c_last = params["c_last"]
+
+		assert w_id, pformat(params)
+		assert d_id, pformat(params)
+
+		sID = self.getServer(w_id)
+
+		customers = self.getReadConnection(sID)[constants.TABLENAME_CUSTOMER]
+		lap("getConnection")
+
+		if c_id == None:
+			# Get the midpoint customer's id
+			# getCustomersByLastName
+			c_id = self.midpointCustomerId(customers[customerNameKey(w_id, d_id, c_last)])
+		# getCustomerByCustomerId, getLastOrder, getOrderLines: the keys of
+		# the customer's orders sort by O_ID, and the last one is read
+		# together with the customer
+		c_key = CUSTOMER_KEY.encode(w_id, d_id, c_id)
+		o_keys = customers.proto.fwmkeys(customerOrderKey(w_id, d_id, c_id), MAX_SCAN_KEYS)
+		records = dict(customers.multi_get([ c_key ] + o_keys[-1:]))
+		customer = records[c_key]
+		customerInfo = dict((c, customer[c]) for c in ("C_ID", "C_FIRST", "C_MIDDLE", "C_LAST", "C_BALANCE"))
+		lap("getCustomer")
+
+		if o_keys and o_keys[-1] in records:
+			order = decodeOrder(records[o_keys[-1]][ORDER_COLUMN])
+			orderInfo = dict((c, order[c]) for c in ("O_ID", "O_CARRIER_ID", "O_ENTRY_D"))
+			orderLines = [ dict((c, ol[c]) for c in ("OL_SUPPLY_W_ID", "OL_I_ID", "OL_QUANTITY",
+					"OL_AMOUNT", "OL_DELIVERY_D")) for ol in order["ORDER_LINES"] ]
+		else:
+			orderInfo = None
+			orderLines = [ ]
+		lap("getLastOrder")
 
 		return [customerInfo, orderInfo, orderLines]
 
@@ -620,6 +1926,7 @@ class TokyocabinetDriver(AbstractDriver):
 			h_date
 		"""
 
+		lap = self.stats.lap(constants.TransactionTypes.PAYMENT)
 		w_id = params["w_id"]
 		d_id = params["d_id"]
 		h_amount = params["h_amount"]
@@ -629,106 +1936,187 @@ class TokyocabinetDriver(AbstractDriver):
 		c_last = params["c_last"]
 		h_date = params["h_date"]
 
-		sID = getServer(w_id)
+		## The customer may belong to a remote warehouse on another server
+		sID = self.getServer(w_id)
+		c_sID = self.getServer(c_w_id)
 
-		try:
-			customerQuery  = self.conn["CUSTOMER"]
-			wareHouseQuery = self.conn["WAREHOUSE"]
-			districtQuery  = self.conn["DISTRICT"]
-		except KeyError, err:
-			sys.stderr.out("%s(%s): server ID does not exist or is offline\n" %(KeyError, err))
-			sys.exit(1)
+		conns = self.holdServers([ sID, c_sID ])
+		conn, c_conn = conns[sID], conns[c_sID]
+		lap("getConnection")
 
-		if c_id != None:
-			# getCustomerByCustomerId
-			customers = customerQuery.filter("C_W_ID" = w_id, "C_D_ID" = d_id, "C_ID" = c_id)
-			customerInfo = customer.columns("C_ID", "C_FIRST", "C_MIDDLE",
-							"C_LAST", "C_BALANCE", "C_YTD_PAYMENT",
-							"C_PAYMENT_CNT", "C_DATA" "C_CREDIT")[0]
-		else:
+		if c_id == None:
 			# Get the midpoint customer's id
 			# getCustomersByLastName
-			customers = customerQuery.filter("C_W_ID" = w_id, "C_D_ID" = d_id, "C_LAST" = c_last).order_by("C_FIRST")
-			all_customers = customers.columns("C_ID", "C_FIRST", "C_MIDDLE",
-							"C_LAST", "C_BALANCE", "C_YTD_PAYMENT",
-							"C_PAYMENT_CNT", "C_DATA", "C_CREDIT")
-			namecnt = len(all_customers)
-			assert namecnt > 0
-			index = (namecnt-1)/2
-			customer = all_customers[index]
-			c_id = customer["C_ID"]
-		assert len(customer) > 0
-
-		c_balance = customerInfo["C_BALANCE"] - h_amount
-		c_ytd_payment = customerInfo["C_YTD_PAYMENT"] + h_amount
-		c_payment_cnt = customerInfo["C_PAYMENT_CNT"] + 1
-		c_data = customerInfo["C_DATA"]
+			c_id = self.midpointCustomerId(c_conn["CUSTOMER"][customerNameKey(c_w_id, c_d_id, c_last)])
+		# getCustomerByCustomerId
+		c_key = CUSTOMER_KEY.encode(c_w_id, c_d_id, c_id)
+		customer = c_conn["CUSTOMER"][c_key]
+		lap("getCustomer")
 
 		# getWarehouse
-		warehouses = warehouseQuery.filter("W_ID" = w_id)
-		warehouseInfo = warehouse.columns("W_NAME","W_STREET_1", "W_STREET_2", "W_CITY", "W_STATE", "W_ZIP")[0]
+		w_key = WAREHOUSE_KEY.encode(w_id)
+		warehouse = conn["WAREHOUSE"][w_key]
+		lap("getWarehouse")
 
 		# getDistrict
-		districts = districtQuery.filter("D_W_ID" = w_id, "D_ID" = d_id)
-		districtInfo = districts.columns("D_NAME", "D_STREET_1", "D_STREET_2", "D_CITY", "D_STATE", "D_ZIP")[0]
+		d_key = DISTRICT_KEY.encode(w_id, d_id)
+		district = conn["DISTRICT"][d_key]
+		lap("getDistrict")
 
 		# updateWarehouseBalance
-		warehouses = warehouseQuery.filter("W_ID" = w_id)
-		for record in warehouses:
-			key, cols = record
-			cols["W_YTD"] += h_amount
-			self.conn[sID]["WAREHOUSE"].put(key, cols)
+		warehouse["W_YTD"] += h_amount
+		conn["WAREHOUSE"][w_key] = warehouse
+		lap("updateWarehouseBalance")
 
 		# updateDistrictBalance
-		districts = districtQuery.filter("W_ID" = w_id, "D_ID" = d_id)
-		for record in districts:
-			key, cols = record
-			cols["D_YTD"] += h_amount
-			self.conn[sID]["DISTRICT"].put(key, cols)
+		district["D_YTD"] += h_amount
+		conn["DISTRICT"][d_key] = district
+		lap("updateDistrictBalance")
 
-		# Customer Credit Information
-		customers = customerQuery.filter("C_W_ID" = c_w_id, "C_D_ID" = c_d_id, "C_ID" = c_id)
-		
-		if customer["C_CREDIT"] == constants.BAD_CREDIT:
-			newData = " ".join(map(str, [c_id, c_d_id, c_w_id, d_id, w_id, h_amount]))
-			c_data = (newData + "|" + c_data)
-			if len(c_data) > constants.MAX_C_DATA: c_data =	c_data[:constants.MAX_C_DATA]
-
-			# updateBCCustomer
-			for record in customers:
-				key, cols = record
-				cols["C_BALANCE"] = c_balance
-				cols["C_YTD_PAYMENT"] = c_ytd_payment
-				cols["C_PAYMENT_CNT"] = c_payment_cnt
-				cols["C_DATA"] = c_data
-				self.conn[sID]["CUSTOMER"].put(key, cols)
+		# updateBCCustomer, updateGCCustomer
+		self.paymentCustomer(customer, c_id, c_d_id, c_w_id, d_id, w_id, h_amount)
+		c_conn["CUSTOMER"][c_key] = customer
+		lap("updateCustomer")
+
+		# Create the history record
+		# insertHistory
+		history = self.paymentHistory(warehouse, district, c_id, c_d_id, c_w_id, d_id, w_id, h_date, h_amount)
+		if self.history is not None:
+			self.history.put(sID, constants.TABLENAME_HISTORY, history)
 		else:
-			c_data = ""
+			conn["HISTORY"][conn["HISTORY"].generate_key()] = history
+		lap("insertHistory")
 
-			# updateGCCustomer
-			for record in customers:
-				key, cols = record
-				cols["C_BALANCE"] = c_balance
-				cols["C_YTD_PAYMENT"] = c_ytd_payment
-				cols["C_PAYMENT_CNT"] = c_payment_cnt
-				self.conn[sID]["CUSTOMER"].put(key, cols)
+		## Commit!
+		self.committer.commit(self.paymentWritten(sID, c_sID))
+		lap("commit")
 
-		# Concatenate w_name, four space, d_name
-		h_data = "%s    %s" % (warehouseInfo["W_NAME"], districtInfo["D_NAME"])
+		return self.paymentResult(warehouse, district, customer)
 
-		# Create the history record
-		# insertHistory
-		key = self.conn[sid]["HISTORY"].genuid()
-		cols = ("H_C_ID": c_id, "H_C_D_ID": c_d_id, "H_C_W_ID": c_w_id, "H_D_ID":
-						d_id, "H_W_ID": w_id, "H_DATE": h_date, "H_AMOUNT":
-						h_amount, "H_DATA": h_data)
-		self.conn[sID]["HISTORY"].put(key, cols)
+	def doPaymentAsync(self, params):
+		"""Task executing a PAYMENT Transaction on self.asyncPool. The
+		WAREHOUSE, DISTRICT and CUSTOMER reads go out together, and so do
+		all the writes. A lookup by last name reads the name index instead
+		and fetches the customer it points to after that."""
+
+		lap = self.stats.lap(constants.TransactionTypes.PAYMENT)
+		w_id = params["w_id"]
+		d_id = params["d_id"]
+		h_amount = params["h_amount"]
+		c_w_id = params["c_w_id"]
+		c_d_id = params["c_d_id"]
+		c_id = params["c_id"]
+		c_last = params["c_last"]
+		h_date = params["h_date"]
+
+		sID = self.getServer(w_id)
+		c_sID = self.getServer(c_w_id)
+		conn = self.asyncPool.get(sID)
+		c_conn = self.asyncPool.get(c_sID)
+
+		if c_id != None:
+			# getCustomerByCustomerId
+			c_key = CUSTOMER_KEY.encode(c_w_id, c_d_id, c_id)
+			customerRead = c_conn["CUSTOMER"].get(c_key)
+		else:
+			# getCustomersByLastName
+			customerRead = c_conn["CUSTOMER"].get(customerNameKey(c_w_id, c_d_id, c_last))
+
+		# getWarehouse, getDistrict, getCustomer
+		w_key = WAREHOUSE_KEY.encode(w_id)
+		d_key = DISTRICT_KEY.encode(w_id, d_id)
+		reads = [
+			conn["WAREHOUSE"].get(w_key),
+			conn["DISTRICT"].get(d_key),
+			customerRead,
+		]
+		if self.history is None:
+			reads.append(conn["HISTORY"].genuid())
+		results = yield reads
+		warehouse, district, customer = results[:3]
+		if c_id == None:
+			# Get the midpoint customer's id
+			c_id = self.midpointCustomerId(customer)
+			c_key = CUSTOMER_KEY.encode(c_w_id, c_d_id, c_id)
+			customer = yield c_conn["CUSTOMER"].get(c_key)
+		lap("reads")
+
+		# updateWarehouseBalance, updateDistrictBalance, updateBCCustomer,
+		# updateGCCustomer, insertHistory
+		warehouse["W_YTD"] += h_amount
+		district["D_YTD"] += h_amount
+		self.paymentCustomer(customer, c_id, c_d_id, c_w_id, d_id, w_id, h_amount)
+		history = self.paymentHistory(warehouse, district, c_id, c_d_id, c_w_id, d_id, w_id, h_date, h_amount)
+		writes = [
+			conn["WAREHOUSE"].put(w_key, warehouse),
+			conn["DISTRICT"].put(d_key, district),
+			c_conn["CUSTOMER"].put(c_key, customer),
+		]
+		if self.history is not None:
+			self.history.put(sID, constants.TABLENAME_HISTORY, history)
+		else:
+			writes.append(conn["HISTORY"].put(results[3], history))
+		yield writes
+		lap("writes")
 
 		## Commit!
-		# TODO Commit
-		#for tab in self.conn[sID].keys():
-		#	self.conn[sID][tab].sync()
+		yield self.committer.commitAsync(self.asyncPool, self.paymentWritten(sID, c_sID))
+		lap("commit")
+
+		raise Return(self.paymentResult(warehouse, district, customer))
+
+	## --------------------------------------------
+	## paymentWritten
+	## --------------------------------------------
+	def paymentWritten(self, sID, c_sID):
+		"""(server ID, table) pairs written by a PAYMENT. Write-behind
+		   HISTORY records are not on the server yet, so they are left out"""
+		written = [ (sID, "WAREHOUSE"), (sID, "DISTRICT"), (c_sID, "CUSTOMER") ]
+		if self.history is None:
+			written.append((sID, "HISTORY"))
+		return written
+
+	## --------------------------------------------
+	## midpointCustomerId
+	## --------------------------------------------
+	def midpointCustomerId(self, nameIndex):
+		"""C_ID of the customer at the midpoint (TPC-C 2.5.2.2) of a name
+		   index record (see loadNameIndex)"""
+		c_ids = nameIndex["C_IDS"].split()
+		assert len(c_ids) > 0
+		return int(c_ids[(len(c_ids)-1)/2])
 
+	## --------------------------------------------
+	## paymentCustomer
+	## --------------------------------------------
+	def paymentCustomer(self, customer, c_id, c_d_id, c_w_id, d_id, w_id, h_amount):
+		"""Apply a PAYMENT to a CUSTOMER record in place"""
+		customer["C_BALANCE"] -= h_amount
+		customer["C_YTD_PAYMENT"] += h_amount
+		customer["C_PAYMENT_CNT"] += 1
+
+		# Customer Credit Information
+		if customer["C_CREDIT"] == constants.BAD_CREDIT:
+			newData = " ".join(map(str, [c_id, c_d_id, c_w_id, d_id, w_id, h_amount]))
+			c_data = (newData + "|" + customer["C_DATA"])
+			if len(c_data) > constants.MAX_C_DATA: c_data = c_data[:constants.MAX_C_DATA]
+			customer["C_DATA"] = c_data
+
+	## --------------------------------------------
+	## paymentHistory
+	## --------------------------------------------
+	def paymentHistory(self, warehouse, district, c_id, c_d_id, c_w_id, d_id, w_id, h_date, h_amount):
+		"""The HISTORY record of a PAYMENT"""
+		# Concatenate w_name, four space, d_name
+		h_data = "%s    %s" % (warehouse["W_NAME"], district["D_NAME"])
+		return {"H_C_ID": c_id, "H_C_D_ID": c_d_id, "H_C_W_ID": c_w_id, "H_D_ID":
+				d_id, "H_W_ID": w_id, "H_DATE": h_date, "H_AMOUNT":
+				h_amount, "H_DATA": h_data}
+
+	## --------------------------------------------
+	## paymentResult
+	## --------------------------------------------
+	def paymentResult(self, warehouse, district, customer):
 		# TPC-C 2.5.3.3: Must display the following fields:
 		# W_ID, D_ID, C_ID, C_D_ID, C_W_ID, W_STREET_1, W_STREET_2, W_CITY,
 		# W_STATE, W_ZIP, D_STREET_1, D_STREET_2, D_CITY, D_STATE, D_ZIP,
@@ -736,6 +2124,14 @@ class TokyocabinetDriver(AbstractDriver):
 		# C_ZIP, C_PHONE, C_SINCE, C_CREDIT, C_CREDIT_LIM, C_DISCOUNT,
 		# C_BALANCE, the first 200 characters of C_DATA (only if C_CREDIT =
 		# "BC"), H_AMMOUNT, and H_DATE.
+		warehouseInfo = dict((c, warehouse[c]) for c in ("W_NAME", "W_STREET_1", "W_STREET_2",
+				"W_CITY", "W_STATE", "W_ZIP"))
+		districtInfo = dict((c, district[c]) for c in ("D_NAME", "D_STREET_1", "D_STREET_2",
+				"D_CITY", "D_STATE", "D_ZIP"))
+		customerInfo = dict((c, customer[c]) for c in ("C_ID", "C_FIRST", "C_MIDDLE", "C_LAST",
+				"C_BALANCE", "C_YTD_PAYMENT", "C_PAYMENT_CNT", "C_CREDIT"))
+		if customer["C_CREDIT"] == constants.BAD_CREDIT:
+			customerInfo["C_DATA"] = customer["C_DATA"][:200]
 
 		# Hand back all the warehouse, district, and customer data
 		return [ warehouseInfo, districtInfo, customerInfo ]
@@ -747,42 +2143,74 @@ class TokyocabinetDriver(AbstractDriver):
 			d_id
 			threshold
 		"""
+		lap = self.stats.lap(constants.TransactionTypes.STOCK_LEVEL)
 		w_id = params["w_id"]
 		d_id = params["d_id"]
 		threshold = params["threshold"]
 
-		try:
-			districtQuery  = self.conn["DISTRICT"].query
-			orderLineQuery = self.conn["ORDER_LINE"].query
-			stockQuery     = self.conn["STOCK"].query
-		except KeyError, err:
-			sys.stderr.out("%s(%s): server ID does not exist or is offline\n" %(KeyError, err))
-			sys.exit(1)
+		sID = self.getServer(w_id)
+
+		conn = self.getReadConnection(sID)
+		lap("getConnection")
 
 		# getOId
-		districts = districtQuery.filter("D_W_ID" = w_id, "D_ID" = d_id)
-		try:
-			o_id = districts.columns("D_NEXT_O_ID")[0]["D_NEXT_O_ID"]
-		except (KeyError, IndexError), err:
-			sys.stderr.write("%s" % err)
-			sys.exit(1)
+		o_id = int(conn["DISTRICT"][nextOrderIdKey(w_id, d_id)]["_num"])
+		lap("getOId")
 
 		# getStockCount
-		orders = orderLineQuery.filter("OL_W_ID" = w_id, "OL_D_ID" = d_id,
-						"OL_O_ID" < o_id, "OL_O_ID" >= (o_id-20))
-		ol_i_ids = orders.columns("OL_I_ID")
-
+		if self.denormalize:
+			## The ORDERS stubs carry the item IDs of their order lines
+			o_keys = [ ORDERS_KEY.encode(w_id, d_id, o) for o in xrange(o_id-20, o_id) ]
+			ol_i_ids = [ ]
+			for key, stub in conn["ORDERS"].multi_get(o_keys):
+				ol_i_ids.extend(int(i) for i in stub["O_I_IDS"].split())
+		else:
+			## ORDER_LINE keys are ordered by O_ID and then OL_NUMBER, so the
+			## window is fully described by its key range. getlist skips the
+			## OL_NUMBERs an order does not have.
+			ol_keys = [ ORDER_LINE_KEY.encode(w_id, d_id, o, n) for o in xrange(o_id-20, o_id)
+					for n in xrange(1, constants.MAX_OL_CNT+1) ]
+			ol_i_ids = [ ol["OL_I_ID"] for key, ol in conn["ORDER_LINE"].multi_get(ol_keys) ]
+		lap("getOrderLines")
+
+		## All the window's STOCK records come back in one getlist and the
+		## threshold is checked here
+		s_keys = [ STOCK_KEY.encode(w_id, i_id) for i_id in set(ol_i_ids) ]
 		cnt = 0
-		for i_id in set(ol_i_ids):
-			stocks = stockQuery.filter("S_W_ID" = w_id, "S_I_ID" = i_id, "S_QUANTITY" <	threshold)
-			if len(stocks) > 0:
+		for key, stock in conn["STOCK"].multi_get(s_keys):
+			if stock["S_QUANTITY"] < threshold:
 				cnt += 1
+		## FOR
+		lap("getStockCount")
 
-		## Commit!
-		# TODO Commit
-		#for tab in self.conn[sID].keys():
-		#	self.conn[sID][tab].sync()
+		## Read-only: nothing to commit
 
 		return cnt
 
 ## CLASS
+
+## ==============================================
+## loadWorker
+## ==============================================
+def loadWorker(ddl, config, scaleParameters, w_ids, needLoadItems, results):
+	"""Process body for TokyocabinetDriver.loadPartitioned. Loads the given
+	   warehouses with a private driver and reports (pid, w_ids, rows, seconds, error)"""
+	from runtime import loader
+
+	start = time.time()
+	driver = None
+	error = None
+	try:
+		driver = TokyocabinetDriver(ddl)
+		driver.loadDefaultConfig(config)
+		loader.Loader(driver, scaleParameters, w_ids, needLoadItems).execute()
+		driver.loadDocuments()
+		driver.loadQueueHeads()
+		driver.loadNameIndex()
+		driver.loader.flushAll()
+	except BaseException, err:
+		## Always report back, whatever the error
+		error = "%s(%s)" % (type(err).__name__, err)
+	rows = driver.loader.written if driver is not None and driver.loader is not None else 0
+	results.put((os.getpid(), w_ids, rows, time.time() - start, error))
+## DEF
@@ -0,0 +1,665 @@
+# -*- coding: utf-8 -*-
+# -----------------------------------------------------------------------
+# Copyright (C) 2011
+# Marcelo Martins
+# http://www.cs.brown.edu/~martins/
+#
+# Permission is hereby granted, free of charge, to any person obtaining
+# a copy of this software and associated documentation files (the
+# "Software"), to deal in the Software without restriction, including
+# without limitation the rights to use, copy, modify, merge, publish,
+# distribute, sublicense, and/or sell copies of the Software, and to
+# permit persons to whom the Software is furnished to do so, subject to
+# the following conditions:
+#
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT
+# IN NO EVENT SHALL THE AUTHORS BE LIABLE FOR ANY CLAIM, DAMAGES OR
+# OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE,
+# ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR
+# OTHER DEALINGS IN THE SOFTWARE.
+# -----------------------------------------------------------------------
+
+
+import collections
+import errno
+import heapq
+import itertools
+import logging
+import select
+import socket
+import struct
+import sys
+import time
+import types
+
+from pyrant import exceptions
+from pyrant.protocol import TyrantProtocol, TABLE_COLUMN_SEP
+from tyrantstats import requestKind
+
+## Tyrant binary protocol
+MAGIC_NUMBER = 0xc8
+ENCODING = "UTF-8"
+
+## Errors after which an AsyncTyrant connection is closed
+CONNECTION_ERRORS = (socket.error, exceptions.ReceiveError)
+
+class Return(Exception):
+	"""Raised by a task to return a value: generators cannot use return
+	   with a value in Python 2"""
+
+	def __init__(self, value=None):
+		Exception.__init__(self)
+		self.value = value
+
+## CLASS
+
+class Future(object):
+	"""Result of an operation that completes later on the event loop"""
+
+	def __init__(self):
+		self.done = False
+		self.value = None
+		self.error = None
+		self.callbacks = [ ]
+
+	def setResult(self, value):
+		assert not self.done
+		self.done = True
+		self.value = value
+		self.fire()
+
+	def setError(self, error):
+		"""error is an exc_info() triple"""
+		assert not self.done
+		self.done = True
+		self.error = error
+		self.fire()
+
+	def addCallback(self, callback):
+		if self.done:
+			callback(self)
+		else:
+			self.callbacks.append(callback)
+
+	def fire(self):
+		callbacks, self.callbacks = self.callbacks, [ ]
+		for callback in callbacks:
+			callback(self)
+
+	def get(self):
+		"""Return the result or raise the error of a completed future"""
+		assert self.done
+		if self.error is not None:
+			raise self.error[0], self.error[1], self.error[2]
+		return self.value
+
+## CLASS
+
+class EventLoop(object):
+	"""Single-threaded scheduler for generator tasks and non-blocking
+	   sockets. A task yields a Future, another task (a generator) or a list
+	   of them and is resumed with the result (a list for a list) once they
+	   all completed; an error is thrown into the task instead. Tasks return
+	   their result with raise Return(value) and pause by yielding
+	   sleep(seconds).
+
+	   context is a value private to the running task: a task sees the
+	   context it had when it last yielded, and a new task starts with the
+	   context of the task that spawned it."""
+
+	def __init__(self):
+		self.ready = collections.deque()
+		self.readers = dict()
+		self.writers = dict()
+		## Heap of (deadline, sequence number, Future) of sleeping tasks
+		self.timers = [ ]
+		self.timerIds = itertools.count()
+		self.context = None
+
+	##-----------------------------------------------
+	## spawn
+	##-----------------------------------------------
+	def spawn(self, task):
+		"""Start a generator task. Returns a Future for its result"""
+		future = Future()
+		self.ready.append((task, future, None, None, self.context))
+		return future
+
+	##-----------------------------------------------
+	## gather
+	##-----------------------------------------------
+	def gather(self, items):
+		"""Future for the list of results of futures or tasks. Fails with
+		   the first error, once all of them completed"""
+		futures = [ self.wrap(item) for item in items ]
+		result = Future()
+		if not futures:
+			result.setResult([ ])
+			return result
+
+		remaining = [ len(futures) ]
+		def completed(future):
+			remaining[0] -= 1
+			if remaining[0]: return
+			for f in futures:
+				if f.error is not None:
+					result.setError(f.error)
+					return
+			result.setResult([ f.value for f in futures ])
+		## DEF
+		for f in futures:
+			f.addCallback(completed)
+		return result
+
+	##-----------------------------------------------
+	## sleep
+	##-----------------------------------------------
+	def sleep(self, seconds):
+		"""Future completed after seconds, for a task to wait on without
+		   holding up the loop"""
+		future = Future()
+		heapq.heappush(self.timers, (time.time() + seconds, self.timerIds.next(), future))
+		return future
+
+	def wrap(self, item):
+		if isinstance(item, Future):
+			return item
+		if isinstance(item, types.GeneratorType):
+			return self.spawn(item)
+		if isinstance(item, (list, tuple)):
+			return self.gather(item)
+		raise TypeError("Cannot wait for %r" % (item,))
+
+	##-----------------------------------------------
+	## step
+	##-----------------------------------------------
+	def step(self, task, future, value, error, context):
+		"""Run a task until its next yield"""
+		self.context = context
+		try:
+			if error is not None:
+				waitFor = task.throw(*error)
+			else:
+				waitFor = task.send(value)
+			waitFor = self.wrap(waitFor)
+		except StopIteration:
+			future.setResult(None)
+			return
+		except Return, ret:
+			future.setResult(ret.value)
+			return
+		except Exception:
+			future.setError(sys.exc_info())
+			return
+		finally:
+			context, self.context = self.context, None
+		waitFor.addCallback(lambda f: self.ready.append((task, future, f.value, f.error, context)))
+
+	##-----------------------------------------------
+	## addReader / addWriter
+	##-----------------------------------------------
+	def addReader(self, fd, callback):
+		self.readers[fd] = callback
+
+	def removeReader(self, fd):
+		self.readers.pop(fd, None)
+
+	def addWriter(self, fd, callback):
+		self.writers[fd] = callback
+
+	def removeWriter(self, fd):
+		self.writers.pop(fd, None)
+
+	##-----------------------------------------------
+	## runOnce
+	##-----------------------------------------------
+	def runOnce(self):
+		"""Run the tasks that are ready, then wait for socket events"""
+		while self.ready:
+			self.step(*self.ready.popleft())
+
+		timeout = None
+		if self.timers:
+			timeout = max(0.0, self.timers[0][0] - time.time())
+		if self.readers or self.writers:
+			try:
+				readable, writable, failed = select.select(self.readers.keys(), self.writers.keys(), [ ], timeout)
+			except select.error, err:
+				if err.args[0] == errno.EINTR: return
+				raise
+			for fd in writable:
+				callback = self.writers.get(fd)
+				if callback: callback()
+			for fd in readable:
+				callback = self.readers.get(fd)
+				if callback: callback()
+		elif timeout is not None:
+			time.sleep(timeout)
+
+		now = time.time()
+		while self.timers and self.timers[0][0] <= now:
+			heapq.heappop(self.timers)[2].setResult(None)
+
+	##-----------------------------------------------
+	## runUntilComplete
+	##-----------------------------------------------
+	def runUntilComplete(self, task):
+		"""Run the loop until task (anything a task may yield) completes and
+		   return its result"""
+		future = self.wrap(task)
+		while not future.done:
+			if not self.ready and not self.readers and not self.writers and not self.timers:
+				raise RuntimeError("Event loop is idle but the task is not done")
+			self.runOnce()
+		return future.get()
+
+## CLASS
+
+class _Incomplete(Exception):
+	"""The receive buffer does not hold a whole response yet"""
+	pass
+
+class _Reader(object):
+	"""Decodes one response from the receive buffer"""
+
+	def __init__(self, buf):
+		self.buf = buf
+		self.pos = 0
+
+	def bytes(self, n):
+		end = self.pos + n
+		if end > len(self.buf): raise _Incomplete()
+		data = self.buf[self.pos:end]
+		self.pos = end
+		return data
+
+	def code(self):
+		return ord(self.bytes(1))
+
+	def int(self):
+		return struct.unpack(">I", self.bytes(4))[0]
+
+	def long(self):
+		return struct.unpack(">Q", self.bytes(8))[0]
+
+	def str(self):
+		return self.bytes(self.int())
+
+	def unicode(self):
+		return self.str().decode(ENCODING)
+
+## CLASS
+
+def _bytes(value):
+	if isinstance(value, unicode):
+		return value.encode(ENCODING)
+	return str(value)
+
+def _pack(command, *args):
+	"""Encode a request. Integers are sent as 32-bit big-endian values and
+	   strings as they are; the caller sends the lengths first"""
+	fmt = ">BB"
+	ints = [ ]
+	data = [ ]
+	for arg in args:
+		if isinstance(arg, (int, long)):
+			fmt += "I"
+			ints.append(arg)
+		else:
+			data.append(arg)
+	return struct.pack(fmt, MAGIC_NUMBER, command, *ints) + "".join(data)
+
+def _packList(values):
+	return "".join(struct.pack(">I", len(v)) + v for v in values)
+
+def _record(data):
+	"""Table record (columns separated by NUL) to a dict"""
+	if not data: return { }
+	elems = data.split(TABLE_COLUMN_SEP)
+	return dict(itertools.izip(elems[::2], elems[1::2]))
+
+def _columns(cols):
+	"""Dict to a flat list of encoded column names and values"""
+	flat = [ ]
+	for k, v in cols.iteritems():
+		flat.append(_bytes(k))
+		flat.append(_bytes(v))
+	return flat
+
+class AsyncTyrant(object):
+	"""Non-blocking connection to one ttserver table database. Every call
+	   sends its request right away and returns a Future; requests are
+	   pipelined on the socket and the server answers them in order.
+	   Records are read and written through codec, a
+	   tyrantcodec.RecordCodec, if given; otherwise their values come back
+	   as unicode, as with pyrant.
+
+	   A host starting with "/" is the path of a Unix socket (the port is
+	   then ignored), as served by tyrantserver.py --socket.
+
+	   Requests and bytes are counted in wire, a tyrantstats.WireStats, if
+	   given, and charged to the loop's context."""
+
+	def __init__(self, loop, host, port, timeout=None, serverId=None, wire=None, codec=None):
+		self.loop = loop
+		self.host = host
+		self.port = port
+		self.serverId = serverId
+		self.wire = wire
+		self.codec = codec
+		if host.startswith("/"):
+			self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+			self.sock.settimeout(timeout)
+			self.sock.connect(host)
+		else:
+			self.sock = socket.create_connection((host, port), timeout)
+			self.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+		self.sock.setblocking(0)
+		self.fd = self.sock.fileno()
+		self.sendBuffer = ""
+		self.recvBuffer = ""
+		self.pending = collections.deque()
+		self.closed = False
+
+	def __repr__(self):
+		return "<AsyncTyrant %s:%s>" % (self.host, self.port)
+
+	##-----------------------------------------------
+	## request
+	##-----------------------------------------------
+	def request(self, packet, parse):
+		"""Queue a request. parse(reader) decodes its response"""
+		future = Future()
+		if self.closed:
+			try:
+				raise socket.error("connection to %s:%s is closed" % (self.host, self.port))
+			except socket.error:
+				future.setError(sys.exc_info())
+			return future
+
+		if not self.sendBuffer:
+			self.loop.addWriter(self.fd, self.onWritable)
+		self.sendBuffer += packet
+		if not self.pending:
+			self.loop.addReader(self.fd, self.onReadable)
+		context = self.loop.context
+		self.pending.append((parse, future, context))
+
+		if self.wire is not None:
+			command = ord(packet[1])
+			func = None
+			if command == TyrantProtocol.MISC:
+				func = packet[14:14 + struct.unpack(">I", packet[2:6])[0]]
+			self.wire.request(self.serverId, requestKind(command, func), context)
+			self.wire.sent(self.serverId, len(packet), context)
+		return future
+
+	def onWritable(self):
+		try:
+			sent = self.sock.send(self.sendBuffer)
+		except socket.error, err:
+			if err.args[0] in (errno.EAGAIN, errno.EWOULDBLOCK, errno.EINTR): return
+			self.abort()
+			return
+		self.sendBuffer = self.sendBuffer[sent:]
+		if not self.sendBuffer:
+			self.loop.removeWriter(self.fd)
+
+	def onReadable(self):
+		try:
+			data = self.sock.recv(65536)
+			if not data:
+				raise socket.error("server %s:%s disconnected unexpectedly" % (self.host, self.port))
+		except socket.error, err:
+			if err.args and err.args[0] in (errno.EAGAIN, errno.EWOULDBLOCK, errno.EINTR): return
+			self.abort()
+			return
+		self.recvBuffer += data
+
+		while self.pending:
+			parse, future, context = self.pending[0]
+			reader = _Reader(self.recvBuffer)
+			try:
+				value = parse(reader)
+				error = None
+			except _Incomplete:
+				break
+			except Exception:
+				error = sys.exc_info()
+			self.recvBuffer = self.recvBuffer[reader.pos:]
+			self.pending.popleft()
+			if self.wire is not None:
+				self.wire.received(self.serverId, reader.pos, context)
+			if error is not None:
+				future.setError(error)
+			else:
+				future.setResult(value)
+		## WHILE
+
+		if not self.pending:
+			self.loop.removeReader(self.fd)
+
+	##-----------------------------------------------
+	## abort
+	##-----------------------------------------------
+	def abort(self):
+		"""Close the connection after a socket error and fail every
+		   request still waiting for its response"""
+		error = sys.exc_info()
+		logging.warn("Closing connection to %s:%s: %s" % (self.host, self.port, error[1]))
+		self.close()
+		pending, self.pending = self.pending, collections.deque()
+		for parse, future, context in pending:
+			future.setError(error)
+
+	def close(self):
+		self.closed = True
+		self.loop.removeReader(self.fd)
+		self.loop.removeWriter(self.fd)
+		self.sock.close()
+
+	def decode(self, data):
+		"""Serialized record to a dict"""
+		if self.codec is not None:
+			return self.codec.unpack(data)
+		return _record(data.decode(ENCODING))
+
+	def encode(self, cols):
+		"""Dict to a serialized record. Strings are taken as records
+		   packed in advance"""
+		if type(cols) is str:
+			return cols
+		if self.codec is not None:
+			return self.codec.packRecord(cols)
+		return TABLE_COLUMN_SEP.join(_columns(cols))
+
+	##-----------------------------------------------
+	## Commands
+	##-----------------------------------------------
+	def get(self, key):
+		"""Record of key as a dict. Fails with KeyError if there is none"""
+		key = _bytes(key)
+		def parse(reader):
+			code = reader.code()
+			if code: raise KeyError(key)
+			return self.decode(reader.str())
+		return self.request(_pack(TyrantProtocol.GET, len(key), key), parse)
+
+	def put(self, key, cols):
+		"""Store the record key"""
+		key = _bytes(key)
+		value = self.encode(cols)
+		def parse(reader):
+			code = reader.code()
+			if code: raise exceptions.get_for_code(code)
+		return self.request(_pack(TyrantProtocol.PUT, len(key), len(value), key, value), parse)
+
+	def out(self, key):
+		"""Delete the record key. Fails with KeyError if there is none"""
+		key = _bytes(key)
+		def parse(reader):
+			code = reader.code()
+			if code: raise KeyError(key)
+		return self.request(_pack(TyrantProtocol.OUT, len(key), key), parse)
+
+	def multiGet(self, keys):
+		"""(key, record) pairs of the keys that exist"""
+		future = Future()
+		def parsed(f):
+			if f.error is not None:
+				future.setError(f.error)
+			else:
+				data = f.value
+				future.setResult([ (data[i], self.decode(data[i+1])) for i in xrange(0, len(data), 2) ])
+		self.misc("getlist", [ _bytes(k) for k in keys ], raw=True).addCallback(parsed)
+		return future
+
+	def multiSet(self, items):
+		"""Store the (key, record) pairs of items (or a dict)"""
+		if isinstance(items, dict):
+			items = items.iteritems()
+		args = [ ]
+		for key, cols in items:
+			args.append(_bytes(key))
+			args.append(self.encode(cols))
+		return self.misc("putlist", args)
+
+	def fwmkeys(self, prefix, maxkeys):
+		"""Up to maxkeys keys starting with prefix"""
+		prefix = _bytes(prefix)
+		def parse(reader):
+			code = reader.code()
+			if code: raise exceptions.get_for_code(code)
+			return [ reader.unicode() for i in xrange(reader.int()) ]
+		return self.request(_pack(TyrantProtocol.FWMKEYS, len(prefix), maxkeys, prefix), parse)
+
+	def addint(self, key, num):
+		"""Add num to the "_num" column of record key (created if missing)
+		   and return the sum, atomically on the server"""
+		key = _bytes(key)
+		def parse(reader):
+			code = reader.code()
+			if code: raise exceptions.get_for_code(code)
+			return struct.unpack(">i", reader.bytes(4))[0]
+		return self.request(_pack(TyrantProtocol.ADDINT, len(key), num & 0xffffffff, key), parse)
+
+	def sync(self):
+		"""Flush the database to disk"""
+		def parse(reader):
+			code = reader.code()
+			if code: raise exceptions.get_for_code(code)
+		return self.request(_pack(TyrantProtocol.SYNC), parse)
+
+	def genuid(self):
+		"""New unique primary key"""
+		future = Future()
+		def parsed(f):
+			if f.error is not None:
+				future.setError(f.error)
+			else:
+				future.setResult(f.value[0])
+		self.misc("genuid", [ ]).addCallback(parsed)
+		return future
+
+	def search(self, conditions, orderBy=None, orderType=TyrantProtocol.RDBQOSTRASC, limit=None):
+		"""(key, record) pairs of the records matching every (column,
+		   TyrantProtocol.RDBQC*, expression) condition"""
+		args = [ "addcond\x00%s\x00%d\x00%s" % (c, op, _bytes(expr)) for c, op, expr in conditions ]
+		if orderBy:
+			args.append("setorder\x00%s\x00%d" % (orderBy, orderType))
+		if limit:
+			args.append("setlimit\x00%d\x000" % limit)
+		args.append("get")
+
+		future = Future()
+		def parsed(f):
+			if f.error is not None:
+				future.setError(f.error)
+				return
+			## Each record comes back with its key as a column with no name
+			records = [ ]
+			for data in f.value:
+				cols = _record(data)
+				records.append((cols.pop(u""), cols))
+			future.setResult(records)
+		self.misc("search", args).addCallback(parsed)
+		return future
+
+	def misc(self, func, args, opts=0, raw=False):
+		"""Call a misc function; the result is its list of strings, as
+		   unicode unless raw is set"""
+		def parse(reader):
+			code = reader.code()
+			if code: raise exceptions.get_for_code(code)
+			read = reader.str if raw else reader.unicode
+			return [ read() for i in xrange(reader.int()) ]
+		packet = _pack(TyrantProtocol.MISC, len(func), opts, len(args), func, _packList(args))
+		return self.request(packet, parse)
+
+## CLASS
+
+class AsyncConnection(object):
+	"""An AsyncTyrant for each table of a server, opened the first time the
+	   table is used and reopened after it failed. Tables with a
+	   tyrantcodec.RecordCodec in codecs use it for their records."""
+
+	def __init__(self, loop, serverId, tables, timeout=None, wire=None, codecs=None):
+		self.loop = loop
+		self.serverId = serverId
+		self.tables = tables
+		self.timeout = timeout
+		self.wire = wire
+		self.codecs = codecs or { }
+		self.handles = dict()
+
+	def __getitem__(self, tableName):
+		handle = self.handles.get(tableName)
+		if handle is None or handle.closed:
+			values = self.tables[tableName]
+			handle = AsyncTyrant(self.loop, values["host"], values["port"], self.timeout,
+					self.serverId, self.wire, self.codecs.get(tableName))
+			self.handles[tableName] = handle
+		return handle
+
+	def close(self):
+		for handle in self.handles.itervalues():
+			handle.close()
+		self.handles.clear()
+
+## CLASS
+
+class AsyncPool(object):
+	"""size AsyncConnections per server, shared by all the tasks of one
+	   event loop. get() hands them out in turn, so concurrent requests are
+	   spread over the connections instead of queueing on one of them."""
+
+	def __init__(self, loop, databases, size=4, timeout=None, wire=None, codecs=None):
+		assert size > 0, "Invalid pool size %s" % size
+		self.loop = loop
+		self.databases = databases
+		self.size = size
+		self.timeout = timeout
+		self.wire = wire
+		self.codecs = codecs
+		self.connections = dict()
+
+	def get(self, serverId):
+		conns = self.connections.get(serverId)
+		if conns is None:
+			tables = self.databases[serverId]
+			conns = self.connections[serverId] = itertools.cycle(
+				[ AsyncConnection(self.loop, serverId, tables, self.timeout, self.wire, self.codecs) for i in xrange(self.size) ])
+		return conns.next()
+
+	def close(self):
+		for serverId, conns in self.connections.iteritems():
+			for i in xrange(self.size):
+				conns.next().close()
+		self.connections.clear()
+
+## CLASS
@@ -0,0 +1,276 @@
+# -*- coding: utf-8 -*-
+# -----------------------------------------------------------------------
+# Copyright (C) 2011
+# Marcelo Martins
+# http://www.cs.brown.edu/~martins/
+#
+# Permission is hereby granted, free of charge, to any person obtaining
+# a copy of this software and associated documentation files (the
+# "Software"), to deal in the Software without restriction, including
+# without limitation the rights to use, copy, modify, merge, publish,
+# distribute, sublicense, and/or sell copies of the Software, and to
+# permit persons to whom the Software is furnished to do so, subject to
+# the following conditions:
+#
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT
+# IN NO EVENT SHALL THE AUTHORS BE LIABLE FOR ANY CLAIM, DAMAGES OR
+# OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE,
+# ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR
+# OTHER DEALINGS IN THE SOFTWARE.
+# -----------------------------------------------------------------------
+
+from __future__ import with_statement
+
+import binascii
+import itertools
+import logging
+import os
+import threading
+import time
+
+class BatchWriter(object):
+	"""Buffers records per (server, table) and writes each buffer to its
+	   Tyrant server with a single putlist call once it holds batchSize
+	   records. Connections are taken from a tyrantpool.ConnectionPool."""
+
+	def __init__(self, pool, batchSize=1000):
+		assert batchSize > 0, "Invalid batch size %s" % batchSize
+		self.pool = pool
+		self.batchSize = batchSize
+		self.buffers = dict()
+		self.written = 0
+
+	##-----------------------------------------------
+	## put
+	##-----------------------------------------------
+	def put(self, sID, tableName, key, cols):
+		"""Queue one record. The buffer is flushed when it reaches batchSize"""
+		buf = self.buffers.get((sID, tableName))
+		if buf is None:
+			buf = self.buffers[(sID, tableName)] = [ ]
+		buf.append((key, cols))
+		if len(buf) >= self.batchSize:
+			self.flush(sID, tableName)
+
+	##-----------------------------------------------
+	## flush
+	##-----------------------------------------------
+	def flush(self, sID, tableName):
+		"""Write out the buffered records of one (server, table) pair"""
+		buf = self.buffers.pop((sID, tableName), None)
+		if not buf: return
+
+		with self.pool.connection(sID) as conn:
+			conn[tableName].multi_set(buf)
+		self.written += len(buf)
+		logging.debug("Flushed %d records to %s on server %s" % (len(buf), tableName, sID))
+
+	##-----------------------------------------------
+	## flushAll
+	##-----------------------------------------------
+	def flushAll(self):
+		"""Write out every pending buffer"""
+		for sID, tableName in self.buffers.keys():
+			self.flush(sID, tableName)
+
+## CLASS
+
+class RowBuffer(object):
+	"""Write-back buffer of the rows one transaction updates on one server.
+	   Rows put in it are written when the transaction calls flush(), with
+	   one putlist per table however many rows it wrote. Reads are not
+	   cached: every transaction reads each of its rows once, by key, so a
+	   buffer that lives as long as the transaction would never serve a
+	   read, and rows cached across transactions would go stale under the
+	   other clients' writes."""
+
+	def __init__(self, conn):
+		self.conn = conn
+		self.rows = dict()
+
+	##-----------------------------------------------
+	## put
+	##-----------------------------------------------
+	def put(self, tableName, key, row):
+		"""Replace the row key of tableName, on the server at the next flush"""
+		self.rows.setdefault(tableName, dict())[key] = row
+
+	def putMany(self, tableName, items):
+		"""put() each (key, row) pair of items"""
+		self.rows.setdefault(tableName, dict()).update(items)
+
+	##-----------------------------------------------
+	## flush
+	##-----------------------------------------------
+	def flush(self):
+		"""Write the rows put since the last flush. Returns the names of the
+		   tables written"""
+		written = self.rows.keys()
+		for tableName, rows in self.rows.iteritems():
+			self.conn[tableName].multi_set(sorted(rows.iteritems()))
+		self.rows.clear()
+		return written
+
+## CLASS
+
+class WriteBehind(object):
+	"""Write-behind buffer for append-only tables. put() queues a record
+	   under a key generated on the client, a random per-client prefix and a
+	   sequence number, and returns at once. A background thread writes the
+	   queued records of each (server, table) with one putlist as soon as
+	   batchSize of them are waiting or the oldest one has waited interval
+	   seconds. close() drains the buffers.
+
+	   Records are not visible on the server until they are flushed, and
+	   those still queued are lost if the process dies."""
+
+	def __init__(self, pool, batchSize=1000, interval=1.0):
+		assert batchSize > 0, "Invalid batch size %s" % batchSize
+		self.pool = pool
+		self.batchSize = batchSize
+		self.interval = interval
+		## Client-generated keys contain a "-", so they never collide with
+		## the hex keys of the loader or the numeric keys of genuid
+		self.prefix = binascii.hexlify(os.urandom(6)) + "-"
+		self.sequence = itertools.count(1)
+		self.cond = threading.Condition()
+		self.buffers = dict()
+		self.started = dict()
+		self.thread = None
+		self.closed = False
+		## Batches taken out of the buffers and not written yet
+		self.writing = 0
+		self.written = 0
+
+	##-----------------------------------------------
+	## put
+	##-----------------------------------------------
+	def put(self, sID, tableName, cols):
+		"""Queue one record for tableName on server sID. Returns its key"""
+		key = "%s%x" % (self.prefix, self.sequence.next())
+		with self.cond:
+			assert not self.closed, "Write-behind buffer is closed"
+			if self.thread is None:
+				self.thread = threading.Thread(target=self.run, name="WriteBehind")
+				self.thread.daemon = True
+				self.thread.start()
+			buf = self.buffers.get((sID, tableName))
+			if buf is None:
+				buf = self.buffers[(sID, tableName)] = [ ]
+				self.started[(sID, tableName)] = time.time()
+			buf.append((key, cols))
+			if len(buf) == self.batchSize:
+				self.cond.notify()
+		## WITH
+		return key
+
+	##-----------------------------------------------
+	## run
+	##-----------------------------------------------
+	def run(self):
+		"""Body of the flushing thread"""
+		while True:
+			with self.cond:
+				while True:
+					due = self.due()
+					if due or self.closed: break
+					self.cond.wait(self.wait())
+				## WHILE
+				if self.closed:
+					due = self.buffers.keys()
+				batches = self.take(due)
+				closed = self.closed
+			## WITH
+
+			failed = not self.writeAll(batches, requeue=not closed)
+			if closed: return
+			## Give a failing server some time before the retry
+			if failed: time.sleep(self.interval)
+		## WHILE
+
+	##-----------------------------------------------
+	## flush
+	##-----------------------------------------------
+	def flush(self):
+		"""Write out everything queued so far from the calling thread and
+		   wait for the batches the flushing thread is writing. Returns
+		   whether the batches taken here got through; those that failed
+		   stay queued"""
+		with self.cond:
+			batches = self.take(self.buffers.keys())
+		written = self.writeAll(batches, requeue=True)
+		with self.cond:
+			while self.writing:
+				self.cond.wait()
+		return written
+
+	def take(self, targets):
+		"""Take the buffers of targets out for writing (with self.cond held)"""
+		batches = [ (target, self.buffers.pop(target)) for target in targets ]
+		for target in targets:
+			del self.started[target]
+		self.writing += len(batches)
+		return batches
+
+	def writeAll(self, batches, requeue):
+		"""Write the batches taken out by take(). Returns whether all of
+		   them were written"""
+		written = True
+		try:
+			for (sID, tableName), buf in batches:
+				if not self.write(sID, tableName, buf, requeue):
+					written = False
+		finally:
+			with self.cond:
+				self.writing -= len(batches)
+				self.cond.notifyAll()
+		return written
+
+	def due(self):
+		"""The (server, table) buffers that are full or too old"""
+		now = time.time()
+		return [ target for target, buf in self.buffers.iteritems()
+				if len(buf) >= self.batchSize or now - self.started[target] >= self.interval ]
+
+	def wait(self):
+		"""Seconds until the oldest buffer is due"""
+		if not self.started: return self.interval
+		return max(0.0, self.interval - (time.time() - min(self.started.itervalues())))
+
+	def write(self, sID, tableName, buf, requeue):
+		"""Write one batch. A batch that fails is queued again if requeue
+		   is set and dropped otherwise. Returns whether it was written"""
+		try:
+			with self.pool.connection(sID) as conn:
+				conn[tableName].multi_set(buf)
+		except Exception, err:
+			if not requeue:
+				logging.error("Lost %d %s records for server %s: %s" % (len(buf), tableName, sID, err))
+				return False
+			## Try again with the next flush
+			logging.warn("Failed to write %d %s records to server %s: %s" % (len(buf), tableName, sID, err))
+			with self.cond:
+				self.buffers[(sID, tableName)] = buf + self.buffers.get((sID, tableName), [ ])
+				self.started[(sID, tableName)] = time.time()
+			return False
+		self.written += len(buf)
+		logging.debug("Flushed %d records to %s on server %s" % (len(buf), tableName, sID))
+		return True
+
+	##-----------------------------------------------
+	## close
+	##-----------------------------------------------
+	def close(self):
+		"""Write out everything queued and stop the flushing thread"""
+		with self.cond:
+			self.closed = True
+			self.cond.notify()
+		if self.thread is not None:
+			self.thread.join()
+
+## CLASS
@@ -0,0 +1,95 @@
+# -*- coding: utf-8 -*-
+# -----------------------------------------------------------------------
+# Copyright (C) 2011
+# Marcelo Martins
+# http://www.cs.brown.edu/~martins/
+#
+# Permission is hereby granted, free of charge, to any person obtaining
+# a copy of this software and associated documentation files (the
+# "Software"), to deal in the Software without restriction, including
+# without limitation the rights to use, copy, modify, merge, publish,
+# distribute, sublicense, and/or sell copies of the Software, and to
+# permit persons to whom the Software is furnished to do so, subject to
+# the following conditions:
+#
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT
+# IN NO EVENT SHALL THE AUTHORS BE LIABLE FOR ANY CLAIM, DAMAGES OR
+# OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE,
+# ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR
+# OTHER DEALINGS IN THE SOFTWARE.
+# -----------------------------------------------------------------------
+
+import array
+
+class ItemCache(object):
+	"""Read-only, in-process copy of the ITEM table. Columns are kept in
+	   parallel arrays indexed by I_ID; I_NAME and I_DATA are concatenated
+	   into one string each and sliced with an offsets array, so the whole
+	   table costs a few large objects instead of one dict per item.
+	   A price of -1 marks an I_ID that has no item."""
+
+	MISSING = -1.0
+
+	def __init__(self):
+		self.prices = array.array("d")
+		self.names = ""
+		self.nameOffsets = array.array("l", [ 0 ])
+		self.data = ""
+		self.dataOffsets = array.array("l", [ 0 ])
+
+	def __len__(self):
+		return sum(1 for p in self.prices if p != ItemCache.MISSING)
+
+	##-----------------------------------------------
+	## load
+	##-----------------------------------------------
+	def load(self, records):
+		"""Fill the cache from an iterable of ITEM records (dicts)"""
+		records = sorted((int(r["I_ID"]), float(r["I_PRICE"]), r["I_NAME"], r["I_DATA"]) for r in records)
+		size = records[-1][0] + 1 if records else 0
+
+		prices = array.array("d", [ ItemCache.MISSING ]) * size
+		names = [ ]
+		nameOffsets = array.array("l", [ 0 ]) * (size + 1)
+		data = [ ]
+		dataOffsets = array.array("l", [ 0 ]) * (size + 1)
+
+		nameEnd = dataEnd = 0
+		i = 0
+		for i_id in xrange(size):
+			if i < len(records) and records[i][0] == i_id:
+				prices[i_id] = records[i][1]
+				names.append(records[i][2])
+				nameEnd += len(records[i][2])
+				data.append(records[i][3])
+				dataEnd += len(records[i][3])
+				i += 1
+			nameOffsets[i_id+1] = nameEnd
+			dataOffsets[i_id+1] = dataEnd
+		## FOR
+
+		self.prices = prices
+		self.names = u"".join(names)
+		self.nameOffsets = nameOffsets
+		self.data = u"".join(data)
+		self.dataOffsets = dataOffsets
+
+	##-----------------------------------------------
+	## get
+	##-----------------------------------------------
+	def get(self, i_id):
+		"""Return (I_PRICE, I_NAME, I_DATA), or None if there is no such item
+		   (TPC-C's intentionally invalid item of a rolled back NEW_ORDER)"""
+		if i_id < 0 or i_id >= len(self.prices): return None
+		price = self.prices[i_id]
+		if price == ItemCache.MISSING: return None
+		return (price,
+				self.names[self.nameOffsets[i_id]:self.nameOffsets[i_id+1]],
+				self.data[self.dataOffsets[i_id]:self.dataOffsets[i_id+1]])
+
+## CLASS
@@ -0,0 +1,282 @@
+# -*- coding: utf-8 -*-
+# -----------------------------------------------------------------------
+# Copyright (C) 2011
+# Marcelo Martins
+# http://www.cs.brown.edu/~martins/
+#
+# Permission is hereby granted, free of charge, to any person obtaining
+# a copy of this software and associated documentation files (the
+# "Software"), to deal in the Software without restriction, including
+# without limitation the rights to use, copy, modify, merge, publish,
+# distribute, sublicense, and/or sell copies of the Software, and to
+# permit persons to whom the Software is furnished to do so, subject to
+# the following conditions:
+#
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT
+# IN NO EVENT SHALL THE AUTHORS BE LIABLE FOR ANY CLAIM, DAMAGES OR
+# OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE,
+# ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR
+# OTHER DEALINGS IN THE SOFTWARE.
+# -----------------------------------------------------------------------
+
+import itertools
+import json
+
+class KeyFormat(object):
+	"""Fixed-width, order-preserving encoding of a compound primary key.
+	   Every component is written as zero-padded lowercase hexadecimal of a
+	   fixed width, so encoded keys sort like the tuples they encode and the
+	   encoding of any leading part of a tuple is a prefix of the full key.
+	   Keys stay ASCII because pyrant decodes the keys it receives as UTF-8."""
+
+	def __init__(self, *fields):
+		self.names = [ f[0] for f in fields ]
+		self.widths = [ f[1] for f in fields ]
+		self.width = sum(self.widths)
+		## One format string per prefix length, the full key being the last one
+		self.formats = [ "".join("%%0%dx" % w for w in self.widths[:i]) for i in xrange(len(fields)+1) ]
+		self.format = self.formats[-1]
+		self.bounds = [ ]
+		start = 0
+		for w in self.widths:
+			self.bounds.append((start, start + w))
+			start += w
+		## FOR
+
+	def encode(self, *values):
+		return self.format % values
+
+	def prefix(self, *values):
+		"""Encode the first len(values) components only"""
+		return self.formats[len(values)] % values
+
+	def decode(self, key):
+		return tuple(int(key[a:b], 16) for a, b in self.bounds)
+
+## CLASS
+
+## Primary keys of every table, most significant component first. Widths
+## are in hex digits: W_ID < 2^16, D_ID and OL_NUMBER < 16, C_ID < 2^16,
+## I_ID < 2^20, O_ID < 2^24.
+WAREHOUSE_KEY = KeyFormat(("W_ID", 4))
+DISTRICT_KEY = KeyFormat(("D_W_ID", 4), ("D_ID", 1))
+ITEM_KEY = KeyFormat(("I_ID", 5))
+CUSTOMER_KEY = KeyFormat(("C_W_ID", 4), ("C_D_ID", 1), ("C_ID", 4))
+HISTORY_KEY = KeyFormat(("H_C_W_ID", 4), ("H_C_D_ID", 1), ("H_C_ID", 4))
+STOCK_KEY = KeyFormat(("S_W_ID", 4), ("S_I_ID", 5))
+ORDERS_KEY = KeyFormat(("O_W_ID", 4), ("O_D_ID", 1), ("O_ID", 6))
+NEW_ORDER_KEY = KeyFormat(("NO_W_ID", 4), ("NO_D_ID", 1), ("NO_O_ID", 6))
+ORDER_LINE_KEY = KeyFormat(("OL_W_ID", 4), ("OL_D_ID", 1), ("OL_O_ID", 6), ("OL_NUMBER", 1))
+
+##-----------------------------------------------
+## nextOrderIdKey
+##-----------------------------------------------
+def nextOrderIdKey(w_id, d_id):
+	"""Key of the DISTRICT table record counting a district's D_NEXT_O_ID
+	   in its "_num" column, which Tyrant's addint increments atomically.
+	   The suffix is not a hex digit, so it never collides with a
+	   DISTRICT_KEY."""
+	return DISTRICT_KEY.encode(w_id, d_id) + "n"
+
+##-----------------------------------------------
+## customerNameKey
+##-----------------------------------------------
+def customerNameKey(w_id, d_id, c_last):
+	"""Key of the CUSTOMER table record listing in its C_IDS column the
+	   C_IDs of a district's customers named c_last, ordered by C_FIRST.
+	   The "n" after the district prefix is not a hex digit, so it never
+	   collides with a CUSTOMER_KEY."""
+	return CUSTOMER_KEY.prefix(w_id, d_id) + "n" + c_last
+
+##-----------------------------------------------
+## newOrderHeadKey
+##-----------------------------------------------
+def newOrderHeadKey(w_id, d_id):
+	"""Key of the NEW_ORDER table record holding in its "_num" column the
+	   NO_O_ID of a district's oldest undelivered order, the head of the
+	   district's new-order queue. The suffix is not a hex digit, so it
+	   never collides with a NEW_ORDER_KEY."""
+	return NEW_ORDER_KEY.prefix(w_id, d_id) + "h"
+
+## Decoders of the SQL types used in the table definitions. VARCHAR and
+## TIMESTAMP values are kept as the strings they are stored as
+DECODERS = {
+	"TINYINT": int,
+	"SMALLINT": int,
+	"INT": int,
+	"INTEGER": int,
+	"FLOAT": float,
+	"VARCHAR": None,
+	"TIMESTAMP": None,
+}
+
+## Separates column names and values in a serialized table record
+COLUMN_SEP = "\0"
+
+## Column of a table record that holds the values of the columns its codec
+## packs, as a positional JSON array. The name is not a column of any table.
+PACKED_COLUMN = "_v"
+
+##-----------------------------------------------
+## encodeValue
+##-----------------------------------------------
+def encodeValue(value):
+	"""A column value as stored. Numbers stay decimal strings, so decimal
+	   indexes and numeric search conditions keep working; floats use their
+	   shortest exact repr"""
+	t = type(value)
+	if t is str: return value
+	if t is float: return repr(value)
+	if t is unicode: return value.encode("utf-8")
+	return str(value)
+
+class RecordCodec(object):
+	"""Packs the rows of one table into serialized Tyrant table records
+	   (column names and values separated by NULs) and unpacks records
+	   into dicts of typed values. Built once per table from its list of
+	   (column, SQL type) pairs. NULL columns are not stored and come back
+	   as None; columns the table does not declare are packed and unpacked
+	   as strings.
+
+	   Only the named columns, the ones that indexes, search conditions or
+	   query results need to see, are stored as name/value pairs. The
+	   other declared columns go into a single PACKED_COLUMN as a
+	   positional JSON array, like encodeOrder's orders, so their names
+	   are not repeated in every record. By default every column is
+	   named."""
+
+	def __init__(self, columns, named=None):
+		self.names = [ name for name, sqlType in columns ]
+		self.decoders = dict((name, DECODERS[sqlType]) for name, sqlType in columns if DECODERS[sqlType])
+		self.empty = dict.fromkeys(self.names)
+		named = set(self.names if named is None else named)
+		self.named = [ name in named for name in self.names ]
+		self.packed = [ name for name in self.names if name not in named ]
+		self.packedDecoders = [ self.decoders.get(name) for name in self.packed ]
+		self.unnamed = frozenset(self.packed)
+		## The columns a record is stored under
+		self.stored = [ name for name in self.names if name in named ] + ([ PACKED_COLUMN ] if self.packed else [ ])
+
+	def pack(self, row):
+		"""Record of a row given as a sequence in column order"""
+		flat = [ ]
+		packed = [ ]
+		for name, isNamed, value in itertools.izip(self.names, self.named, row):
+			if not isNamed:
+				packed.append(value)
+			elif value is not None:
+				flat.append(name)
+				flat.append(encodeValue(value))
+		## FOR
+		return self.join(flat, packed)
+
+	def packRecord(self, cols):
+		"""Record of a dict of column values"""
+		flat = [ ]
+		unnamed = self.unnamed
+		for name, value in cols.iteritems():
+			if value is None or name in unnamed: continue
+			flat.append(name)
+			flat.append(encodeValue(value))
+		## FOR
+		return self.join(flat, [ cols.get(name) for name in self.packed ])
+
+	def join(self, flat, packed):
+		"""Record of the name/value pairs in flat and the values of the
+		   packed columns"""
+		while packed and packed[-1] is None:
+			packed.pop()
+		if packed:
+			flat.append(PACKED_COLUMN)
+			flat.append(json.dumps(packed, separators=(",", ":"), default=str))
+		return COLUMN_SEP.join(flat)
+
+	def unpack(self, data):
+		"""Dict of the typed column values of a record"""
+		record = self.empty.copy()
+		if not data: return record
+		elems = data.split(COLUMN_SEP)
+		decoders = self.decoders
+		for i in xrange(0, len(elems) - 1, 2):
+			name = elems[i]
+			if name == PACKED_COLUMN:
+				self.unpackValues(record, elems[i+1])
+				continue
+			decode = decoders.get(name)
+			record[name] = decode(elems[i+1]) if decode is not None else elems[i+1]
+		## FOR
+		return record
+
+	def decode(self, cols):
+		"""Dict of the typed column values of a record given as a dict of
+		   its stored columns, as queries and searches return them"""
+		record = self.empty.copy()
+		decoders = self.decoders
+		for name, value in cols.iteritems():
+			if name == PACKED_COLUMN:
+				self.unpackValues(record, value)
+				continue
+			decode = decoders.get(name)
+			record[name] = decode(value) if decode is not None else value
+		## FOR
+		return record
+
+	def unpackValues(self, record, data):
+		"""Set the packed columns of record from their stored JSON array.
+		   Strings come back as unicode, as in decodeOrder"""
+		for name, decode, value in itertools.izip(self.packed, self.packedDecoders, json.loads(data)):
+			if value is not None and decode is not None:
+				value = decode(value)
+			record[name] = value
+		## FOR
+
+## CLASS
+
+## Field order of the orders and order lines kept in the CUSTOMER table in
+## denormalized mode. The key columns shared with the customer (D_ID,
+## W_ID) are left out.
+ORDER_FIELDS = [ "O_ID", "O_ENTRY_D", "O_CARRIER_ID", "O_OL_CNT", "O_ALL_LOCAL" ]
+ORDER_LINE_FIELDS = [ "OL_NUMBER", "OL_I_ID", "OL_SUPPLY_W_ID", "OL_DELIVERY_D",
+		"OL_QUANTITY", "OL_AMOUNT", "OL_DIST_INFO" ]
+
+## Column of a customerOrderKey record that holds the encoded order
+ORDER_COLUMN = "C_ORDER"
+
+##-----------------------------------------------
+## customerOrderKey
+##-----------------------------------------------
+def customerOrderKey(w_id, d_id, c_id, o_id=None):
+	"""Key of the CUSTOMER table record holding one of the customer's
+	   orders, with its lines, in denormalized mode. The keys of a
+	   customer's orders start with the customer's key and an "o", which
+	   is not a hex digit, and sort by O_ID. Without o_id, their common
+	   prefix."""
+	prefix = CUSTOMER_KEY.encode(w_id, d_id, c_id) + "o"
+	if o_id is None: return prefix
+	return prefix + "%06x" % o_id
+
+##-----------------------------------------------
+## encodeOrder
+##-----------------------------------------------
+def encodeOrder(order):
+	"""Serialize an order: a dict with the ORDER_FIELDS columns and an
+	   "ORDER_LINES" list of dicts with the ORDER_LINE_FIELDS columns. The
+	   order and its lines are stored as positional JSON arrays, so column
+	   names are not repeated in every record."""
+	lines = [ [ ol.get(f) for f in ORDER_LINE_FIELDS ] for ol in order["ORDER_LINES"] ]
+	return json.dumps([ order.get(f) for f in ORDER_FIELDS ] + [ lines ], separators=(",", ":"), default=str)
+
+##-----------------------------------------------
+## decodeOrder
+##-----------------------------------------------
+def decodeOrder(data):
+	"""Inverse of encodeOrder"""
+	packed = json.loads(data)
+	order = dict(zip(ORDER_FIELDS, packed))
+	order["ORDER_LINES"] = [ dict(zip(ORDER_LINE_FIELDS, l)) for l in packed[-1] ]
+	return order
@@ -0,0 +1,246 @@
+# -*- coding: utf-8 -*-
+# -----------------------------------------------------------------------
+# Copyright (C) 2011
+# Marcelo Martins
+# http://www.cs.brown.edu/~martins/
+#
+# Permission is hereby granted, free of charge, to any person obtaining
+# a copy of this software and associated documentation files (the
+# "Software"), to deal in the Software without restriction, including
+# without limitation the rights to use, copy, modify, merge, publish,
+# distribute, sublicense, and/or sell copies of the Software, and to
+# permit persons to whom the Software is furnished to do so, subject to
+# the following conditions:
+#
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT
+# IN NO EVENT SHALL THE AUTHORS BE LIABLE FOR ANY CLAIM, DAMAGES OR
+# OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE,
+# ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR
+# OTHER DEALINGS IN THE SOFTWARE.
+# -----------------------------------------------------------------------
+
+
+from __future__ import with_statement
+
+import logging
+import threading
+import time
+
+from tyrantpool import ServerConnection, CONNECTION_ERRORS
+
+class CommitPolicy(object):
+	"""Decides when the tables written by transactions are synced to disk.
+	   Transactions call commit() with the (server ID, table) pairs they
+	   wrote; the policy is one of:
+
+	   none        -- never sync; the servers write back on their own
+	   transaction -- sync every written table before commit() returns
+	   group       -- collect the written tables of many transactions and
+	                  sync each of them once, from a background thread, as
+	                  soon as groupSize transactions are waiting or the
+	                  oldest one has waited interval seconds
+
+	   Under both transaction and group commit, commit() returns only once
+	   a sync covering the transaction's writes has finished, so a
+	   committed transaction survives a crash. A group commit trades
+	   latency for fewer syncs: every transaction waits for the sync of
+	   its group, and one sync per table covers them all.
+
+	   Transactions sync on the connections they hold (pool.get), and the
+	   group commit thread on connections of its own, so that it never
+	   waits for a pooled connection held by a transaction waiting for
+	   it."""
+
+	POLICIES = ("none", "transaction", "group")
+
+	def __init__(self, pool, policy="none", groupSize=100, interval=0.05):
+		assert policy in CommitPolicy.POLICIES, "Unknown commit policy '%s'" % policy
+		assert groupSize > 0, "Invalid group size %s" % groupSize
+		self.pool = pool
+		self.policy = policy
+		self.groupSize = groupSize
+		self.interval = interval
+		self.cond = threading.Condition()
+		self.dirty = set()
+		self.pending = 0
+		self.started = None
+		## Number of the group being collected and of the last one synced
+		self.generation = 1
+		self.synced = 0
+		## Set when the last group could not be synced on close
+		self.error = None
+		## Connections of the group commit thread, by server ID
+		self.connections = dict()
+		self.thread = None
+		self.closed = False
+		self.syncs = 0
+		self.groups = 0
+
+	##-----------------------------------------------
+	## commit
+	##-----------------------------------------------
+	def commit(self, dirty):
+		"""Commit a transaction that wrote the (server ID, table) pairs in
+		   dirty"""
+		if self.policy == "none": return
+		if self.policy == "transaction":
+			self.sync(set(dirty), self.pool.get)
+			return
+		self.waitFor(self.enqueue(dirty))
+
+	def enqueue(self, dirty):
+		"""Add a transaction to the group being collected. Returns the
+		   group's number"""
+		with self.cond:
+			assert not self.closed, "Commit policy is closed"
+			if self.thread is None:
+				self.thread = threading.Thread(target=self.run, name="GroupCommit")
+				self.thread.daemon = True
+				self.thread.start()
+			if not self.pending:
+				self.started = time.time()
+			self.dirty.update(dirty)
+			self.pending += 1
+			## The thread sleeps until a group starts and then until it is due
+			if self.pending == 1 or self.pending == self.groupSize:
+				self.cond.notifyAll()
+			return self.generation
+		## WITH
+
+	def waitFor(self, generation):
+		"""Wait until group generation was synced"""
+		with self.cond:
+			while not self.isSynced(generation):
+				self.cond.wait()
+		## WITH
+
+	def isSynced(self, generation):
+		if self.synced >= generation: return True
+		if self.error is not None:
+			raise RuntimeError("Group commit failed: %s" % self.error)
+		return False
+
+	##-----------------------------------------------
+	## commitAsync
+	##-----------------------------------------------
+	def commitAsync(self, asyncPool, dirty):
+		"""commit() for a task of asyncPool's event loop. Returns what the
+		   task has to wait for: the syncs of a per-transaction commit, sent
+		   on asyncPool so that the loop is not blocked, a task polling for
+		   the sync of a group commit, or nothing"""
+		if self.policy == "none":
+			return [ ]
+		if self.policy == "transaction":
+			return [ asyncPool.get(sID)[tableName].sync() for sID, tableName in set(dirty) ]
+		return [ self.waitAsync(asyncPool.loop, self.enqueue(dirty)) ]
+
+	def waitAsync(self, loop, generation):
+		"""Task waiting for group generation to be synced without holding
+		   up loop"""
+		while True:
+			with self.cond:
+				if self.isSynced(generation): return
+			yield loop.sleep(self.interval / 4)
+		## WHILE
+
+	##-----------------------------------------------
+	## run
+	##-----------------------------------------------
+	def run(self):
+		"""Body of the group commit thread"""
+		while True:
+			with self.cond:
+				while not self.closed and not self.due():
+					self.cond.wait(self.wait())
+				dirty, self.dirty = self.dirty, set()
+				pending, self.pending = self.pending, 0
+				generation = self.generation
+				self.generation += 1
+				closed = self.closed
+			## WITH
+
+			if dirty:
+				try:
+					self.sync(dirty, self.connection)
+				except Exception, err:
+					logging.error("Failed to sync %d tables for %d transactions: %s" % (len(dirty), pending, err))
+					with self.cond:
+						if closed:
+							self.error = err
+							self.cond.notifyAll()
+							return
+						## The tables stay dirty and go with the next group,
+						## whose sync covers the waiting transactions too
+						if not self.pending:
+							self.started = time.time()
+						self.dirty.update(dirty)
+						self.pending += pending
+					## WITH
+					time.sleep(self.interval)
+					continue
+				self.groups += 1
+				logging.debug("Synced %d tables for %d transactions" % (len(dirty), pending))
+			## IF
+			with self.cond:
+				self.synced = generation
+				self.cond.notifyAll()
+			if closed: return
+		## WHILE
+
+	def due(self):
+		"""Whether the waiting group is full or too old"""
+		if not self.pending: return False
+		return self.pending >= self.groupSize or time.time() - self.started >= self.interval
+
+	def wait(self):
+		"""Seconds until the waiting group is due"""
+		if not self.pending: return None
+		return max(0.0, self.interval - (time.time() - self.started))
+
+	def connection(self, sID):
+		"""The group commit thread's connection to sID"""
+		conn = self.connections.get(sID)
+		if conn is None:
+			conn = self.connections[sID] = ServerConnection(sID, self.pool.databases[sID], self.pool.timeout)
+		return conn
+
+	def sync(self, dirty, connection):
+		"""Sync every (server ID, table) pair in dirty, one request each, on
+		   the connections returned by connection(sID)"""
+		tables = dict()
+		for sID, tableName in dirty:
+			tables.setdefault(sID, [ ]).append(tableName)
+		for sID, tableNames in tables.iteritems():
+			conn = connection(sID)
+			try:
+				for tableName in tableNames:
+					conn[tableName].sync()
+			except CONNECTION_ERRORS:
+				if conn is self.connections.get(sID):
+					## Reopened by the next group
+					del self.connections[sID]
+					conn.close()
+				raise
+			self.syncs += len(tableNames)
+		## FOR
+
+	##-----------------------------------------------
+	## close
+	##-----------------------------------------------
+	def close(self):
+		"""Sync the last group and stop the group commit thread"""
+		with self.cond:
+			self.closed = True
+			self.cond.notifyAll()
+		if self.thread is not None:
+			self.thread.join()
+		for conn in self.connections.itervalues():
+			conn.close()
+		self.connections.clear()
+
+## CLASS
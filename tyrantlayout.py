@@ -0,0 +1,270 @@
+# -*- coding: utf-8 -*-
+# -----------------------------------------------------------------------
+# Copyright (C) 2011
+# Marcelo Martins
+# http://www.cs.brown.edu/~martins/
+#
+# Permission is hereby granted, free of charge, to any person obtaining
+# a copy of this software and associated documentation files (the
+# "Software"), to deal in the Software without restriction, including
+# without limitation the rights to use, copy, modify, merge, publish,
+# distribute, sublicense, and/or sell copies of the Software, and to
+# permit persons to whom the Software is furnished to do so, subject to
+# the following conditions:
+#
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT
+# IN NO EVENT SHALL THE AUTHORS BE LIABLE FOR ANY CLAIM, DAMAGES OR
+# OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE,
+# ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR
+# OTHER DEALINGS IN THE SOFTWARE.
+# -----------------------------------------------------------------------
+
+from __future__ import with_statement
+
+import json
+import logging
+import os
+import socket
+import threading
+import time
+
+## Table holding the layout records, on the first configured server. It
+## is not one of the benchmark's tables
+LAYOUT_TABLE = "LAYOUT"
+## Key of the layout record
+LAYOUT_KEY = "layout"
+## Prefix of the keys of the acknowledgement records of the clients
+ACK_PREFIX = LAYOUT_KEY + "/"
+## Number of intervals after which a client whose acknowledgement did not
+## change is taken for dead
+EXPIRY = 10
+## Upper bound on the number of acknowledgement records read
+MAX_CLIENTS = 0x7fffffff
+
+class SharedLayout(object):
+	"""Versioned record of the cluster layout, kept on one server and
+	   shared by every client process: the servers added to the configured
+	   ones, the warehouses pinned to a server other than the partitioner's
+	   choice and the warehouses fenced off while they are being copied.
+	   Every process re-reads it each interval seconds and hands every new
+	   version to apply(state).
+
+	   Transactions run between begin(w_ids), which waits while one of
+	   their warehouses is fenced, and end(). Each process periodically
+	   writes an acknowledgement record with the version it runs and the
+	   oldest version any of its running transactions started under.
+	   While warehouses are fenced, drain() first writes out what the
+	   process still buffers; otherwise nothing is being moved and the
+	   buffers are left to their own schedule. waitForClients(version)
+	   returns once every live process acknowledged version with no older
+	   transactions left, so that a fenced warehouse is no longer touched
+	   by anyone.
+
+	   conn is a connection of its own to the server holding the record in
+	   its tableName table. Only one process may publish at a time."""
+
+	def __init__(self, conn, tableName, apply, interval=1.0, drain=None):
+		self.conn = conn
+		self.tableName = tableName
+		self.apply = apply
+		self.interval = interval
+		self.drain = drain
+		self.token = "%s:%d:%x" % (socket.gethostname(), os.getpid(), id(self))
+		self.version = 0
+		self.fenced = frozenset()
+		## Running transactions, by the version they started under
+		self.running = dict()
+		self.seq = 0
+		self.cond = threading.Condition()
+		## Guards conn
+		self.ioLock = threading.Lock()
+		self.startLock = threading.Lock()
+		self.stopped = threading.Event()
+		self.thread = None
+
+	##-----------------------------------------------
+	## read
+	##-----------------------------------------------
+	def read(self):
+		"""The layout stored on the server, version 0 if there is none"""
+		with self.ioLock:
+			record = self.conn[self.tableName].get(LAYOUT_KEY)
+		if not record or record.get("version") is None:
+			return { "version": 0, "servers": [ ], "pinned": { }, "fenced": [ ] }
+		return {
+			"version": int(record["version"]),
+			"servers": json.loads(record["servers"]),
+			"pinned": dict((int(w_id), sID) for w_id, sID in json.loads(record["pinned"]).iteritems()),
+			"fenced": json.loads(record["fenced"]),
+		}
+
+	##-----------------------------------------------
+	## publish
+	##-----------------------------------------------
+	def publish(self, state):
+		"""Store state as the next version of the layout and apply it
+		   here. Returns the new version"""
+		version = self.read()["version"] + 1
+		record = {
+			"version": version,
+			"servers": json.dumps(state["servers"]),
+			"pinned": json.dumps(state["pinned"]),
+			"fenced": json.dumps(sorted(state["fenced"])),
+		}
+		with self.ioLock:
+			self.conn[self.tableName][LAYOUT_KEY] = record
+		logging.debug("Published layout version %d" % version)
+		self.refresh()
+		return version
+
+	##-----------------------------------------------
+	## refresh
+	##-----------------------------------------------
+	def refresh(self):
+		"""Re-read the layout and apply it if it changed"""
+		state = self.read()
+		with self.cond:
+			if state["version"] == self.version: return
+			self.apply(state)
+			self.version = state["version"]
+			self.fenced = frozenset(state["fenced"])
+			self.cond.notifyAll()
+		## WITH
+		logging.debug("Running on layout version %d" % self.version)
+
+	##-----------------------------------------------
+	## start
+	##-----------------------------------------------
+	def start(self):
+		"""Acknowledge the current layout and start the thread following
+		   it, unless it runs already"""
+		if self.thread is not None: return
+		with self.startLock:
+			if self.thread is not None: return
+			## Show up before reading the layout, so that a version
+			## published in between is waited for
+			self.ack()
+			self.refresh()
+			self.ack()
+			thread = threading.Thread(target=self.run, name="SharedLayout")
+			thread.daemon = True
+			thread.start()
+			self.thread = thread
+		## WITH
+
+	def run(self):
+		"""Body of the thread following the layout"""
+		while not self.stopped.wait(self.interval):
+			try:
+				self.refresh()
+				self.ack()
+			except Exception, err:
+				logging.warn("Failed to follow the cluster layout: %s" % err)
+				with self.ioLock:
+					self.conn.close()
+		## WHILE
+
+	##-----------------------------------------------
+	## begin / end
+	##-----------------------------------------------
+	def begin(self, w_ids):
+		"""Wait until none of w_ids is fenced and register a transaction
+		   on them. Returns what to hand to end()"""
+		with self.cond:
+			while self.fenced.intersection(w_ids):
+				self.cond.wait(self.interval)
+			return self.enter()
+
+	def tryBegin(self, w_ids):
+		"""begin() that returns None instead of waiting"""
+		with self.cond:
+			if self.fenced.intersection(w_ids): return None
+			return self.enter()
+
+	def enter(self):
+		version = self.version
+		self.running[version] = self.running.get(version, 0) + 1
+		return version
+
+	def end(self, version):
+		"""Unregister a transaction started by begin()"""
+		with self.cond:
+			self.running[version] -= 1
+			if not self.running[version]:
+				del self.running[version]
+		## WITH
+
+	##-----------------------------------------------
+	## ack
+	##-----------------------------------------------
+	def ack(self):
+		"""Write this process' acknowledgement record. While warehouses
+		   are fenced nothing is acknowledged until drain() succeeds"""
+		with self.cond:
+			version = self.version
+			oldest = min(self.running) if self.running else version
+			fenced = self.fenced
+		if fenced and self.drain is not None and not self.drain():
+			logging.warn("Not acknowledging layout version %d before buffered writes are drained" % version)
+			return
+		self.seq += 1
+		with self.ioLock:
+			self.conn[self.tableName][ACK_PREFIX + self.token] = \
+					{ "version": version, "oldest": oldest, "seq": self.seq }
+		## WITH
+
+	##-----------------------------------------------
+	## waitForClients
+	##-----------------------------------------------
+	def waitForClients(self, version):
+		"""Wait until every client process acknowledged version and has no
+		   transaction left that started under an older one. Clients whose
+		   acknowledgement stayed the same for EXPIRY intervals are taken
+		   for dead and their records deleted"""
+		seen = dict()
+		while True:
+			with self.ioLock:
+				table = self.conn[self.tableName]
+				acks = table.multi_get(table.proto.fwmkeys(ACK_PREFIX, MAX_CLIENTS))
+			now = time.time()
+			waiting = [ ]
+			for key, record in acks:
+				if int(record["version"]) >= version and int(record["oldest"]) >= version:
+					continue
+				seq, since = seen.get(key, (None, now))
+				if seq != record["seq"]:
+					seen[key] = (record["seq"], now)
+				elif now - since >= EXPIRY * self.interval:
+					logging.warn("Client %s stopped acknowledging the layout" % key[len(ACK_PREFIX):])
+					with self.ioLock:
+						table.proto.out(key)
+					continue
+				waiting.append(key)
+			## FOR
+			if not waiting: return
+			time.sleep(self.interval)
+		## WHILE
+
+	##-----------------------------------------------
+	## close
+	##-----------------------------------------------
+	def close(self):
+		"""Stop following the layout and withdraw this process'
+		   acknowledgement"""
+		if self.thread is None: return
+		self.stopped.set()
+		self.thread.join()
+		self.thread = None
+		try:
+			with self.ioLock:
+				self.conn[self.tableName].proto.out(ACK_PREFIX + self.token)
+		except Exception, err:
+			logging.warn("Failed to remove the layout acknowledgement of %s: %s" % (self.token, err))
+		self.conn.close()
+
+## CLASS
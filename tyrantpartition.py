@@ -0,0 +1,174 @@
+# -*- coding: utf-8 -*-
+# -----------------------------------------------------------------------
+# Copyright (C) 2011
+# Marcelo Martins
+# http://www.cs.brown.edu/~martins/
+#
+# Permission is hereby granted, free of charge, to any person obtaining
+# a copy of this software and associated documentation files (the
+# "Software"), to deal in the Software without restriction, including
+# without limitation the rights to use, copy, modify, merge, publish,
+# distribute, sublicense, and/or sell copies of the Software, and to
+# permit persons to whom the Software is furnished to do so, subject to
+# the following conditions:
+#
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT
+# IN NO EVENT SHALL THE AUTHORS BE LIABLE FOR ANY CLAIM, DAMAGES OR
+# OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE,
+# ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR
+# OTHER DEALINGS IN THE SOFTWARE.
+# -----------------------------------------------------------------------
+
+import bisect
+import hashlib
+import struct
+
+class Partitioner(object):
+	"""Maps warehouse IDs to server IDs. Subclasses implement locate().
+	   Single warehouses can be pinned to a server, which takes precedence
+	   over locate(); rebalancing uses this to keep a warehouse on its old
+	   server until its data has been copied."""
+
+	def __init__(self, servers, virtualNodes):
+		assert len(servers) > 0, "No servers to partition on"
+		assert virtualNodes > 0, "Invalid number of virtual nodes %s" % virtualNodes
+		self.servers = [ ]
+		self.virtualNodes = virtualNodes
+		self.pinned = dict()
+		self.initialized = False
+		for sID in sorted(servers):
+			self.addServer(sID)
+		self.initialized = True
+
+	def getServer(self, w_id):
+		sID = self.pinned.get(w_id)
+		if sID is None:
+			sID = self.locate(w_id)
+		return sID
+
+	def locate(self, w_id):
+		raise NotImplementedError("%s does not implement locate" % self.__class__.__name__)
+
+	def addServer(self, sID):
+		assert not sID in self.servers, "Server %s is already partitioned on" % sID
+		self.servers.append(sID)
+
+	def pin(self, w_id, sID):
+		self.pinned[w_id] = sID
+
+	def unpin(self, w_id):
+		self.pinned.pop(w_id, None)
+
+## CLASS
+
+class RangePartitioner(Partitioner):
+	"""Cuts the W_ID space into virtual nodes of rangeSize consecutive
+	   warehouses (wrapping around after the last one). Every server starts
+	   with virtualNodes contiguous virtual nodes. A new server takes an equal
+	   share of virtual nodes from the end of the busiest servers' ranges,
+	   so only the warehouses of those virtual nodes move."""
+
+	def __init__(self, servers, virtualNodes=16, rangeSize=1):
+		assert rangeSize > 0, "Invalid range size %s" % rangeSize
+		self.rangeSize = rangeSize
+		self.slots = [ ]
+		Partitioner.__init__(self, servers, virtualNodes)
+
+	def locate(self, w_id):
+		return self.slots[((w_id - 1) / self.rangeSize) % len(self.slots)]
+
+	def addServer(self, sID):
+		Partitioner.addServer(self, sID)
+		if not self.initialized:
+			## Initial layout: one contiguous block per server
+			self.slots.extend([ sID ] * self.virtualNodes)
+			return
+
+		## Steal virtual nodes until the new server holds its fair share
+		share = len(self.slots) / len(self.servers)
+		for i in xrange(share):
+			counts = dict((s, self.slots.count(s)) for s in self.servers)
+			busiest = max(self.servers, key=lambda s: (counts[s], s))
+			last = len(self.slots) - 1 - self.slots[::-1].index(busiest)
+			self.slots[last] = sID
+		## FOR
+
+## CLASS
+
+class ConsistentHashPartitioner(Partitioner):
+	"""Consistent hashing ring with virtualNodes points per server. A
+	   warehouse belongs to the first point clockwise from its hash, so a
+	   new server only takes over warehouses from its neighbours on the ring."""
+
+	def __init__(self, servers, virtualNodes=64):
+		self.ring = [ ]
+		self.owners = [ ]
+		Partitioner.__init__(self, servers, virtualNodes)
+
+	def hash(self, value):
+		return struct.unpack(">Q", hashlib.md5(str(value)).digest()[:8])[0]
+
+	def locate(self, w_id):
+		i = bisect.bisect(self.ring, self.hash(w_id)) % len(self.ring)
+		return self.owners[i]
+
+	def addServer(self, sID):
+		Partitioner.addServer(self, sID)
+		points = zip(self.ring, self.owners)
+		for i in xrange(self.virtualNodes):
+			points.append((self.hash("%s#%d" % (sID, i)), sID))
+		points.sort()
+		self.ring = [ p[0] for p in points ]
+		self.owners = [ p[1] for p in points ]
+
+## CLASS
+
+class TerminalScheduler(object):
+	"""Gives each of numClients client processes a home set of warehouses
+	   lined up with the servers of a Partitioner, so that a client mostly
+	   talks to one server. Every server gets at least one client while
+	   there are enough of them, and the other clients go to the servers
+	   with the most warehouses per client; a server splits its warehouses
+	   into contiguous slices among its clients. With fewer clients than
+	   servers a client takes all the warehouses of several servers.
+	   Every warehouse is home to some client, and every process computes
+	   the same assignment."""
+
+	def __init__(self, partitioner, w_ids, numClients):
+		assert numClients > 0, "Invalid number of clients %s" % numClients
+		assert len(w_ids) > 0, "No warehouses to schedule"
+		groups = dict()
+		for w_id in sorted(w_ids):
+			groups.setdefault(partitioner.getServer(w_id), [ ]).append(w_id)
+		servers = sorted(groups.keys(), key=lambda sID: (-len(groups[sID]), sID))
+
+		self.homes = [ [ ] for i in xrange(numClients) ]
+		if numClients <= len(servers):
+			for i in xrange(len(servers)):
+				self.homes[i % numClients].extend(groups[servers[i]])
+			return
+
+		shares = dict((sID, 1) for sID in servers)
+		for i in xrange(numClients - len(servers)):
+			sID = max(servers, key=lambda s: float(len(groups[s])) / shares[s])
+			shares[sID] += 1
+		## FOR
+		client = 0
+		for sID in servers:
+			w_ids, n = groups[sID], shares[sID]
+			for j in xrange(n):
+				## A server with more clients than warehouses shares them out
+				self.homes[client] = w_ids[j*len(w_ids)/n:(j+1)*len(w_ids)/n] or [ w_ids[j % len(w_ids)] ]
+				client += 1
+		## FOR
+
+	def home(self, clientId):
+		"""The home warehouses of client clientId"""
+		return self.homes[clientId % len(self.homes)]
+
+## CLASS
@@ -0,0 +1,393 @@
+# -*- coding: utf-8 -*-
+# -----------------------------------------------------------------------
+# Copyright (C) 2011
+# Marcelo Martins
+# http://www.cs.brown.edu/~martins/
+#
+# Permission is hereby granted, free of charge, to any person obtaining
+# a copy of this software and associated documentation files (the
+# "Software"), to deal in the Software without restriction, including
+# without limitation the rights to use, copy, modify, merge, publish,
+# distribute, sublicense, and/or sell copies of the Software, and to
+# permit persons to whom the Software is furnished to do so, subject to
+# the following conditions:
+#
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT
+# IN NO EVENT SHALL THE AUTHORS BE LIABLE FOR ANY CLAIM, DAMAGES OR
+# OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE,
+# ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR
+# OTHER DEALINGS IN THE SOFTWARE.
+# -----------------------------------------------------------------------
+
+from __future__ import with_statement
+
+import contextlib
+import logging
+import pyrant
+import Queue
+import socket
+import sys
+import threading
+import time
+
+from tyrantstats import requestKind
+
+## Errors after which a connection can no longer be trusted
+CONNECTION_ERRORS = (socket.error, pyrant.exceptions.HostNotFound,
+		pyrant.exceptions.ConnectionRefused, pyrant.exceptions.SendError,
+		pyrant.exceptions.ReceiveError)
+
+class CountingSocket(object):
+	"""Stands in for the socket of a pyrant handle and counts the bytes it
+	   sends and receives in a tyrantstats.WireStats"""
+
+	def __init__(self, sock, serverId, wire):
+		self.sock = sock
+		self.serverId = serverId
+		self.wire = wire
+
+	def sendall(self, data):
+		self.wire.sent(self.serverId, len(data))
+		return self.sock.sendall(data)
+
+	def recv(self, size):
+		data = self.sock.recv(size)
+		self.wire.received(self.serverId, len(data))
+		return data
+
+	def __getattr__(self, name):
+		return getattr(self.sock, name)
+
+## CLASS
+
+class CountingProtocolSocket(object):
+	"""Stands in for pyrant's protocol socket and counts every request sent
+	   through it in a tyrantstats.WireStats"""
+
+	def __init__(self, tyrantSocket, serverId, wire):
+		tyrantSocket._sock = CountingSocket(tyrantSocket._sock, serverId, wire)
+		self.tyrantSocket = tyrantSocket
+		self.serverId = serverId
+		self.wire = wire
+
+	def send(self, *args, **kwargs):
+		## misc requests are (MISC, len(func), opts, len(args), func, args).
+		## A request sent with sync=False still makes a round trip if its
+		## response is read later (reply=True)
+		command = args[0]
+		func = args[4] if len(args) > 4 else None
+		roundTrip = kwargs.get("sync", True) or kwargs.get("reply", False)
+		self.wire.request(self.serverId, requestKind(command, func), roundTrip=roundTrip)
+		return self.tyrantSocket.send(*args, **kwargs)
+
+	def __getattr__(self, name):
+		return getattr(self.tyrantSocket, name)
+
+## CLASS
+
+class TypedTable(object):
+	"""Wraps the pyrant.Tyrant handle of a table and reads and writes its
+	   records through a tyrantcodec.RecordCodec: gets return dicts of typed
+	   values and sets take dicts or records packed in advance. Unlike the
+	   handle it does not ask the server for its database type on every
+	   call. Everything else (queries, iteration, proto) goes to the handle
+	   and sees plain strings."""
+
+	def __init__(self, handle, codec):
+		self.handle = handle
+		self.codec = codec
+
+	def encode(self, value):
+		return value if type(value) is str else self.codec.packRecord(value)
+
+	def __getitem__(self, key):
+		try:
+			return self.codec.unpack(self.handle.proto.get(key, True))
+		except CONNECTION_ERRORS:
+			raise
+		except pyrant.exceptions.TyrantError:
+			raise KeyError(key)
+
+	def get(self, key, default=None):
+		try:
+			return self[key]
+		except KeyError:
+			return default
+
+	def __setitem__(self, key, value):
+		self.handle.proto.put(key, self.encode(value))
+
+	def __delitem__(self, key):
+		del self.handle[key]
+
+	def multi_get(self, keys):
+		"""(key, record) pairs of the keys that exist"""
+		self.sendGetlist(keys)
+		return self.receiveGetlist()
+
+	def multi_set(self, items):
+		self.sendPutlist(items)
+		self.receiveList()
+
+	##-----------------------------------------------
+	## Split requests (see multiGetAll)
+	##-----------------------------------------------
+	def sendList(self, func, args):
+		"""Send a misc request without waiting for its response, which
+		   receiveList reads"""
+		proto = self.handle.proto
+		proto._sock.send(proto.MISC, len(func), 0, len(args), func, args, sync=False, reply=True)
+
+	def receiveList(self):
+		"""The list of raw strings returned by the request of sendList"""
+		sock = self.handle.proto._sock
+		code = ord(sock.get_byte())
+		if code: raise pyrant.exceptions.get_for_code(code)
+		return [ sock.get_str() for i in xrange(sock.get_int()) ]
+
+	def sendGetlist(self, keys):
+		self.sendList("getlist", list(keys))
+
+	def receiveGetlist(self):
+		data = self.receiveList()
+		unpack = self.codec.unpack
+		return [ (data[i], unpack(data[i+1])) for i in xrange(0, len(data) - 1, 2) ]
+
+	def sendPutlist(self, items):
+		if hasattr(items, "iteritems"):
+			items = items.iteritems()
+		args = [ ]
+		for key, value in items:
+			args.append(key)
+			args.append(self.encode(value))
+		self.sendList("putlist", args)
+
+	def __getattr__(self, name):
+		return getattr(self.handle, name)
+
+## CLASS
+
+##-----------------------------------------------
+## multiGetAll / multiSetAll
+##-----------------------------------------------
+def multiGetAll(requests):
+	"""multi_get on several TypedTables at once, given a list of (table,
+	   keys) pairs. Returns the list of their (key, record) lists. Every
+	   getlist is sent before any response is read, so tables on different
+	   servers serve them in parallel"""
+	for table, keys in requests:
+		table.sendGetlist(keys)
+	return receiveAll(requests, lambda table: table.receiveGetlist())
+
+def multiSetAll(requests):
+	"""multi_set on several TypedTables at once, given a list of (table,
+	   items) pairs, sending every putlist before waiting for any of them"""
+	for table, items in requests:
+		table.sendPutlist(items)
+	receiveAll(requests, lambda table: table.receiveList())
+
+def receiveAll(requests, receive):
+	"""Read every response, even after one of them failed, so that no
+	   connection is left with an unread response"""
+	results = [ ]
+	error = None
+	for table, args in requests:
+		try:
+			results.append(receive(table))
+		except CONNECTION_ERRORS:
+			raise
+		except pyrant.exceptions.TyrantError:
+			if error is None: error = sys.exc_info()
+			results.append(None)
+	## FOR
+	if error is not None:
+		raise error[0], error[1], error[2]
+	return results
+
+class ServerConnection(object):
+	"""One connection to a server: a pyrant.Tyrant handle for each of the
+	   server's tables, opened the first time the table is used. Requests
+	   and bytes are counted in wire, a tyrantstats.WireStats, if given.
+	   Tables with a tyrantcodec.RecordCodec in codecs are handed out as
+	   TypedTables."""
+
+	def __init__(self, serverId, tables, timeout=None, wire=None, codecs=None):
+		self.serverId = serverId
+		self.tables = tables
+		self.timeout = timeout
+		self.wire = wire
+		self.codecs = codecs or { }
+		self.handles = dict()
+		self.lastUsed = time.time()
+
+	def __getitem__(self, tableName):
+		handle = self.handles.get(tableName)
+		if handle is None:
+			values = self.tables[tableName]
+			handle = pyrant.Tyrant(values["host"], values["port"])
+			if self.timeout is not None:
+				handle.proto._sock._sock.settimeout(self.timeout)
+			if self.wire is not None:
+				handle.proto._sock = CountingProtocolSocket(handle.proto._sock, self.serverId, self.wire)
+			if tableName in self.codecs:
+				handle = TypedTable(handle, self.codecs[tableName])
+			self.handles[tableName] = handle
+		return handle
+
+	def ping(self):
+		"""Return False if any of the open table connections is dead"""
+		try:
+			for handle in self.handles.itervalues():
+				handle.proto.rnum()
+		except CONNECTION_ERRORS:
+			return False
+		return True
+
+	def close(self):
+		## pyrant closes the socket when the handle is garbage collected
+		self.handles.clear()
+
+## CLASS
+
+class ConnectionPool(object):
+	"""Bounded pool of connections to each Tyrant server, keyed by server ID.
+	   At most size connections per server are handed out at a time; further
+	   checkouts block until one is checked back in. Connections that stayed
+	   idle for more than keepalive seconds are pinged before being reused
+	   and connections that failed are replaced with new ones.
+
+	   Besides explicit checkout/checkin, get(sID) hands out the connection
+	   held by the calling thread until it calls release()."""
+
+	def __init__(self, databases, size=4, keepalive=30.0, timeout=None, wire=None, codecs=None):
+		assert size > 0, "Invalid pool size %s" % size
+		self.databases = databases
+		self.size = size
+		self.keepalive = keepalive
+		self.timeout = timeout
+		self.wire = wire
+		self.codecs = codecs
+		self.idle = dict()
+		self.slots = dict()
+		for serverId in databases.keys():
+			self.idle[serverId] = Queue.LifoQueue()
+			self.slots[serverId] = threading.BoundedSemaphore(size)
+		self.local = threading.local()
+
+	##-----------------------------------------------
+	## addServer
+	##-----------------------------------------------
+	def addServer(self, serverId, tables):
+		"""Start pooling connections to a new server"""
+		assert not serverId in self.idle, "Server %s is already pooled" % serverId
+		self.databases[serverId] = tables
+		self.idle[serverId] = Queue.LifoQueue()
+		self.slots[serverId] = threading.BoundedSemaphore(self.size)
+
+	##-----------------------------------------------
+	## checkout
+	##-----------------------------------------------
+	def checkout(self, serverId):
+		"""Take a connection to serverId out of the pool. Raises KeyError
+		   for a server that is not pooled"""
+		slots = self.slots.get(serverId)
+		if slots is None:
+			raise KeyError("Server %s does not exist" % serverId)
+		slots.acquire()
+		try:
+			while True:
+				try:
+					conn = self.idle[serverId].get_nowait()
+				except Queue.Empty:
+					conn = ServerConnection(serverId, self.databases[serverId], self.timeout, self.wire, self.codecs)
+					break
+				if time.time() - conn.lastUsed < self.keepalive or conn.ping():
+					break
+				logging.debug("Dropping stale connection to server %s" % serverId)
+				conn.close()
+			## WHILE
+		except:
+			slots.release()
+			raise
+		return conn
+
+	##-----------------------------------------------
+	## checkin
+	##-----------------------------------------------
+	def checkin(self, conn, broken=False):
+		"""Give a connection back. Broken connections are closed and the
+		   next checkout opens a fresh one. The idle connections to the same
+		   server are closed with it, as they most likely went down together
+		   (server restart, network failure)"""
+		if broken:
+			logging.warn("Discarding broken connection to server %s" % conn.serverId)
+			conn.close()
+			self.discardIdle(conn.serverId)
+		else:
+			conn.lastUsed = time.time()
+			self.idle[conn.serverId].put(conn)
+		self.slots[conn.serverId].release()
+
+	def discardIdle(self, serverId):
+		queue = self.idle[serverId]
+		while True:
+			try:
+				queue.get_nowait().close()
+			except Queue.Empty:
+				break
+
+	##-----------------------------------------------
+	## connection
+	##-----------------------------------------------
+	@contextlib.contextmanager
+	def connection(self, serverId):
+		"""with pool.connection(sID) as conn: checks the connection back in
+		   at the end of the block, discarding it if the block failed on it"""
+		conn = self.checkout(serverId)
+		try:
+			yield conn
+		except CONNECTION_ERRORS:
+			self.checkin(conn, broken=True)
+			raise
+		except:
+			self.checkin(conn)
+			raise
+		else:
+			self.checkin(conn)
+
+	##-----------------------------------------------
+	## get
+	##-----------------------------------------------
+	def get(self, serverId):
+		"""Return the calling thread's connection to serverId, checking one
+		   out on first use"""
+		held = self.local.__dict__.setdefault("held", dict())
+		conn = held.get(serverId)
+		if conn is None:
+			conn = held[serverId] = self.checkout(serverId)
+		return conn
+
+	##-----------------------------------------------
+	## release
+	##-----------------------------------------------
+	def release(self, broken=False):
+		"""Check in every connection held by the calling thread"""
+		held = self.local.__dict__.pop("held", None)
+		if not held: return
+		for conn in held.itervalues():
+			self.checkin(conn, broken)
+
+	##-----------------------------------------------
+	## close
+	##-----------------------------------------------
+	def close(self):
+		"""Close all idle connections"""
+		for serverId in self.idle.keys():
+			self.discardIdle(serverId)
+
+## CLASS
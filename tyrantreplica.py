@@ -0,0 +1,236 @@
+# -*- coding: utf-8 -*-
+# -----------------------------------------------------------------------
+# Copyright (C) 2011
+# Marcelo Martins
+# http://www.cs.brown.edu/~martins/
+#
+# Permission is hereby granted, free of charge, to any person obtaining
+# a copy of this software and associated documentation files (the
+# "Software"), to deal in the Software without restriction, including
+# without limitation the rights to use, copy, modify, merge, publish,
+# distribute, sublicense, and/or sell copies of the Software, and to
+# permit persons to whom the Software is furnished to do so, subject to
+# the following conditions:
+#
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT
+# IN NO EVENT SHALL THE AUTHORS BE LIABLE FOR ANY CLAIM, DAMAGES OR
+# OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE,
+# ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR
+# OTHER DEALINGS IN THE SOFTWARE.
+# -----------------------------------------------------------------------
+
+
+from __future__ import with_statement
+
+import itertools
+import logging
+import threading
+import time
+
+from tyrantpool import ConnectionPool, ServerConnection, CONNECTION_ERRORS
+
+##-----------------------------------------------
+## replicationDelay
+##-----------------------------------------------
+def replicationDelay(stat):
+	"""Replication delay in seconds from the output of a server's stat
+	   command. A server that reports none is not replicating and counts
+	   as up to date."""
+	for line in stat.splitlines():
+		name, sep, value = line.partition("\t")
+		if name == "delay":
+			return float(value)
+	return 0.0
+
+class ReplicaRouter(object):
+	"""Routes the read-only transactions on the data of a server to its
+	   replicas: Tyrant slaves fed by the master's update log, or any other
+	   servers with the same tables. replicas maps a server ID to a list of
+	   replicas, each a table map like the master's.
+
+	   A replica is picked in turn (round-robin) or as the one with the
+	   fewest transactions of this process in flight (least-loaded), among
+	   those whose replication delay was at most maxStaleness seconds at
+	   their last check. When no replica qualifies, or before the first
+	   check, the master is read instead. Replicas get their own
+	   ConnectionPool, set up like the masters' pool.
+
+	   The delays are read with stat every checkInterval seconds by a
+	   background thread, started by the first transaction, on a
+	   connection of its own to each replica, so that transactions never
+	   wait for a check and a check never waits for a pooled connection."""
+
+	POLICIES = ("round-robin", "least-loaded")
+
+	def __init__(self, pool, replicas, policy="round-robin", maxStaleness=1.0, checkInterval=1.0):
+		assert policy in ReplicaRouter.POLICIES, "Unknown replica policy '%s'" % policy
+		self.pool = pool
+		self.policy = policy
+		self.maxStaleness = maxStaleness
+		self.checkInterval = checkInterval
+		self.replicaIds = dict()
+		databases = dict()
+		for serverId, tableMaps in replicas.iteritems():
+			ids = self.replicaIds[serverId] = [ ]
+			for i in xrange(len(tableMaps)):
+				replicaId = "%s/%d" % (serverId, i)
+				databases[replicaId] = tableMaps[i]
+				ids.append(replicaId)
+		## FOR
+		self.replicaPool = ConnectionPool(databases, pool.size, pool.keepalive, pool.timeout, pool.wire, pool.codecs)
+		self.turns = dict((serverId, itertools.count()) for serverId in self.replicaIds)
+		self.inFlight = dict.fromkeys(databases.keys(), 0)
+		self.delays = dict()
+		## Connections of the delay checks, by replica ID
+		self.checkers = dict()
+		self.checkLock = threading.Lock()
+		self.lock = threading.Lock()
+		self.local = threading.local()
+		self.cond = threading.Condition()
+		self.thread = None
+		self.closed = False
+
+	##-----------------------------------------------
+	## get
+	##-----------------------------------------------
+	def get(self, serverId):
+		"""Connection for the calling thread's read-only transaction on
+		   the data of serverId: to one of its replicas, or to serverId
+		   itself through the masters' pool. The thread keeps it until it
+		   calls release()"""
+		held = self.local.__dict__.setdefault("held", dict())
+		if serverId in held:
+			return held[serverId][1]
+		replicaId = self.choose(serverId)
+		if replicaId is None:
+			conn = self.pool.get(serverId)
+		else:
+			conn = self.replicaPool.get(replicaId)
+			with self.lock:
+				self.inFlight[replicaId] += 1
+		held[serverId] = (replicaId, conn)
+		return conn
+
+	##-----------------------------------------------
+	## release
+	##-----------------------------------------------
+	def release(self, broken=False):
+		"""Check in the replica connections held by the calling thread.
+		   Replicas that broke are skipped until their next check. Master
+		   connections go back with the masters' pool.release()"""
+		held = self.local.__dict__.pop("held", None)
+		if not held: return
+		with self.lock:
+			for replicaId, conn in held.itervalues():
+				if replicaId is None: continue
+				self.inFlight[replicaId] -= 1
+				if broken:
+					self.delays[replicaId] = (time.time(), None)
+		## WITH
+		self.replicaPool.release(broken)
+
+	##-----------------------------------------------
+	## choose
+	##-----------------------------------------------
+	def choose(self, serverId):
+		"""ID of the replica to read serverId's data from, or None for the
+		   master"""
+		replicaIds = self.replicaIds.get(serverId)
+		if not replicaIds: return None
+		if self.thread is None:
+			self.start()
+		candidates = [ replicaId for replicaId in replicaIds if self.fresh(replicaId) ]
+		if not candidates: return None
+		## Start from the next replica in turn, so that least-loaded also
+		## spreads its ties
+		turn = self.turns[serverId].next() % len(candidates)
+		candidates = candidates[turn:] + candidates[:turn]
+		if self.policy == "least-loaded":
+			with self.lock:
+				return min(candidates, key=lambda replicaId: self.inFlight[replicaId])
+		return candidates[0]
+
+	def fresh(self, replicaId):
+		"""Whether the replica was reachable and within maxStaleness at its
+		   last check"""
+		checked = self.delays.get(replicaId)
+		if checked is None: return False
+		delay = checked[1]
+		return delay is not None and delay <= self.maxStaleness
+
+	##-----------------------------------------------
+	## start
+	##-----------------------------------------------
+	def start(self):
+		"""Start the replica check thread, unless it runs or was stopped"""
+		with self.cond:
+			if self.thread is None and not self.closed:
+				self.thread = threading.Thread(target=self.run, name="ReplicaCheck")
+				self.thread.daemon = True
+				self.thread.start()
+		## WITH
+
+	##-----------------------------------------------
+	## run
+	##-----------------------------------------------
+	def run(self):
+		"""Body of the replica check thread"""
+		while True:
+			for replicaIds in self.replicaIds.itervalues():
+				for replicaId in replicaIds:
+					delay = self.check(replicaId)
+					with self.lock:
+						self.delays[replicaId] = (time.time(), delay)
+			## FOR
+			with self.cond:
+				if not self.closed:
+					self.cond.wait(self.checkInterval)
+				if self.closed: return
+			## WITH
+		## WHILE
+
+	def check(self, replicaId):
+		"""Replication delay of a replica in seconds, the largest one of its
+		   tables' servers, or None if one of them cannot be reached"""
+		delay = 0.0
+		with self.checkLock:
+			conn = self.checkers.get(replicaId)
+			if conn is None:
+				tables = self.replicaPool.databases[replicaId]
+				conn = self.checkers[replicaId] = ServerConnection(replicaId, tables, self.replicaPool.timeout)
+			try:
+				for tableName in conn.tables.keys():
+					delay = max(delay, replicationDelay(conn[tableName].proto.stat()))
+			except CONNECTION_ERRORS, err:
+				logging.warn("Replica %s is unreachable: %s" % (replicaId, err))
+				## Reopened by the next check
+				del self.checkers[replicaId]
+				conn.close()
+				return None
+		## WITH
+		if delay > self.maxStaleness:
+			logging.debug("Replica %s is %.3f sec behind" % (replicaId, delay))
+		return delay
+
+	##-----------------------------------------------
+	## close
+	##-----------------------------------------------
+	def close(self):
+		"""Stop the replica check thread and close every connection"""
+		with self.cond:
+			self.closed = True
+			self.cond.notifyAll()
+		if self.thread is not None:
+			self.thread.join()
+		self.replicaPool.close()
+		with self.checkLock:
+			for conn in self.checkers.itervalues():
+				conn.close()
+			self.checkers.clear()
+
+## CLASS
@@ -0,0 +1,846 @@
+# -*- coding: utf-8 -*-
+# -----------------------------------------------------------------------
+# Copyright (C) 2011
+# Marcelo Martins
+# http://www.cs.brown.edu/~martins/
+#
+# Permission is hereby granted, free of charge, to any person obtaining
+# a copy of this software and associated documentation files (the
+# "Software"), to deal in the Software without restriction, including
+# without limitation the rights to use, copy, modify, merge, publish,
+# distribute, sublicense, and/or sell copies of the Software, and to
+# permit persons to whom the Software is furnished to do so, subject to
+# the following conditions:
+#
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT
+# IN NO EVENT SHALL THE AUTHORS BE LIABLE FOR ANY CLAIM, DAMAGES OR
+# OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE,
+# ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR
+# OTHER DEALINGS IN THE SOFTWARE.
+# -----------------------------------------------------------------------
+
+
+"""In-memory stand-in for a Tokyo Tyrant server holding a table database.
+
+Implements the part of the Tyrant binary protocol the driver uses: put,
+get, getlist/putlist, out, forward-matching key scans, iteration, search
+(conditions, ordering, limit, get/out/count), genuid, setindex, addint,
+vanish, sync and stat. Records are kept in memory and lost on exit.
+
+Each listening address serves one table database, as ttserver does.
+Run it with
+
+    python tyrantserver.py --port 1978 --count 9
+
+to serve nine databases on ports 1978-1986, or with --socket PATH to
+listen on Unix sockets PATH.0, PATH.1, ...
+
+With --replicas N every database is also served on N more addresses that
+stand in for replication slaves: they share the records of their master
+and report it, with a replication delay of 0, in their stat.
+"""
+
+from __future__ import with_statement
+
+import bisect
+import logging
+import multiprocessing
+import optparse
+import os
+import re
+import socket
+import SocketServer
+import struct
+import threading
+
+from pyrant.protocol import TyrantProtocol
+
+## Key chunks of SortedKeys are split when they grow past this size
+CHUNK_SIZE = 512
+
+## Leading number of a column value, as atof() would read it
+NUMBER = re.compile(r"\s*[-+]?(\d+\.?\d*|\.\d+)([eE][-+]?\d+)?")
+
+##-----------------------------------------------
+## toNumber
+##-----------------------------------------------
+def toNumber(value):
+	try:
+		return float(value)
+	except ValueError:
+		match = NUMBER.match(value)
+		return float(match.group(0)) if match else 0.0
+
+class SortedKeys(object):
+	"""Keys in byte order, kept as a list of sorted chunks so that
+	   insertion and deletion cost O(sqrt(n)) instead of O(n)"""
+
+	def __init__(self):
+		self.chunks = [ ]
+		self.maxes = [ ]
+
+	def add(self, key):
+		if not self.chunks:
+			self.chunks.append([ key ])
+			self.maxes.append(key)
+			return
+		i = bisect.bisect_left(self.maxes, key)
+		if i == len(self.chunks):
+			i -= 1
+			self.chunks[i].append(key)
+			self.maxes[i] = key
+		else:
+			bisect.insort(self.chunks[i], key)
+		chunk = self.chunks[i]
+		if len(chunk) > CHUNK_SIZE:
+			half = len(chunk) / 2
+			self.chunks[i:i+1] = [ chunk[:half], chunk[half:] ]
+			self.maxes[i:i+1] = [ chunk[half-1], chunk[-1] ]
+
+	def remove(self, key):
+		i = bisect.bisect_left(self.maxes, key)
+		chunk = self.chunks[i]
+		del chunk[bisect.bisect_left(chunk, key)]
+		if not chunk:
+			del self.chunks[i]
+			del self.maxes[i]
+		else:
+			self.maxes[i] = chunk[-1]
+
+	def prefixed(self, prefix, limit=None):
+		"""Keys starting with prefix, in order"""
+		keys = [ ]
+		i = bisect.bisect_left(self.maxes, prefix)
+		while i < len(self.chunks):
+			chunk = self.chunks[i]
+			j = bisect.bisect_left(chunk, prefix) if not keys else 0
+			while j < len(chunk):
+				key = chunk[j]
+				if not key.startswith(prefix) or len(keys) == limit:
+					return keys
+				keys.append(key)
+				j += 1
+			i += 1
+		## WHILE
+		return keys
+
+	def __iter__(self):
+		for chunk in self.chunks:
+			for key in chunk:
+				yield key
+
+## CLASS
+
+class TableDatabase(object):
+	"""In-memory table database: records are dicts of column name to value
+	   (both byte strings) indexed by primary key. Lexical and decimal
+	   indexes map a column value to the keys of the records holding it and
+	   serve equality conditions; every other condition is checked record
+	   by record."""
+
+	def __init__(self):
+		self.lock = threading.Lock()
+		self.vanish()
+
+	def vanish(self):
+		self.records = dict()
+		self.keys = SortedKeys()
+		self.indexes = dict()
+		self.uid = 0
+		self.iterator = None
+
+	##-----------------------------------------------
+	## Records
+	##-----------------------------------------------
+	def get(self, key):
+		return self.records.get(key)
+
+	def put(self, key, cols):
+		old = self.records.get(key)
+		if old is None:
+			self.keys.add(key)
+		elif self.indexes:
+			self.unindex(key, old)
+		self.records[key] = cols
+		if self.indexes:
+			self.index(key, cols)
+		if key.isdigit():
+			self.uid = max(self.uid, int(key))
+
+	def out(self, key):
+		old = self.records.pop(key, None)
+		if old is None:
+			return False
+		self.keys.remove(key)
+		if self.indexes:
+			self.unindex(key, old)
+		return True
+
+	def addint(self, key, num):
+		"""Add num to the record's "_num" column, as tctdbaddint does"""
+		cols = self.records.get(key)
+		cols = dict(cols) if cols is not None else dict()
+		value = int(toNumber(cols.get("_num", "0"))) + num
+		cols["_num"] = str(value)
+		self.put(key, cols)
+		return value
+
+	def genuid(self):
+		self.uid += 1
+		return self.uid
+
+	##-----------------------------------------------
+	## Indexes
+	##-----------------------------------------------
+	def setIndex(self, column, kind):
+		keep = kind & TyrantProtocol.TDBITKEEP
+		kind &= ~TyrantProtocol.TDBITKEEP
+		if kind == TyrantProtocol.TDBITVOID:
+			return self.indexes.pop(column, None) is not None
+		if kind == TyrantProtocol.TDBITOPT:
+			return column in self.indexes
+		if kind not in (TyrantProtocol.TDBITLEXICAL, TyrantProtocol.TDBITDECIMAL):
+			## Token and q-gram indexes are accepted; their conditions scan
+			return True
+		if keep and column in self.indexes:
+			return False
+
+		index = self.indexes[column] = (kind, dict())
+		for key, cols in self.records.iteritems():
+			value = cols.get(column)
+			if value is not None:
+				index[1].setdefault(self.indexValue(kind, value), set()).add(key)
+		return True
+
+	def indexValue(self, kind, value):
+		return toNumber(value) if kind == TyrantProtocol.TDBITDECIMAL else value
+
+	def index(self, key, cols):
+		for column, (kind, values) in self.indexes.iteritems():
+			value = cols.get(column)
+			if value is not None:
+				values.setdefault(self.indexValue(kind, value), set()).add(key)
+
+	def unindex(self, key, cols):
+		for column, (kind, values) in self.indexes.iteritems():
+			value = cols.get(column)
+			if value is None: continue
+			value = self.indexValue(kind, value)
+			keys = values.get(value)
+			if keys is not None:
+				keys.discard(key)
+				if not keys: del values[value]
+		## FOR
+
+	##-----------------------------------------------
+	## search
+	##-----------------------------------------------
+	def search(self, conditions, orderBy=None, orderType=TyrantProtocol.RDBQOSTRASC, limit=-1, skip=0):
+		"""Keys of the records matching all (column, op, expr) conditions"""
+		candidates = None
+		for column, op, expr in conditions:
+			keys = self.indexed(column, op, expr)
+			if keys is not None and (candidates is None or len(keys) < len(candidates)):
+				candidates = keys
+		## FOR
+		if candidates is None:
+			candidates = self.keys
+
+		matchers = [ (column, matcher(op, expr)) for column, op, expr in conditions ]
+		keys = [ ]
+		for key in candidates:
+			cols = self.records[key]
+			for column, match in matchers:
+				value = cols.get(column) if column else key
+				if not match(value):
+					break
+			else:
+				keys.append(key)
+		## FOR
+
+		if orderBy is not None:
+			numeric = orderType in (TyrantProtocol.RDBQONUMASC, TyrantProtocol.RDBQONUMDESC)
+			descending = orderType in (TyrantProtocol.RDBQOSTRDESC, TyrantProtocol.RDBQONUMDESC)
+			def sortKey(key):
+				value = self.records[key].get(orderBy, "") if orderBy else key
+				return toNumber(value) if numeric else value
+			keys.sort(key=sortKey, reverse=descending)
+		## IF
+
+		if skip > 0:
+			keys = keys[skip:]
+		if limit >= 0:
+			keys = keys[:limit]
+		return keys
+
+	def indexed(self, column, op, expr):
+		"""Keys an index gives for a condition, or None if no index applies"""
+		if op & (TyrantProtocol.RDBQCNEGATE | TyrantProtocol.RDBQCNOIDX):
+			return None
+		index = self.indexes.get(column)
+		if index is None:
+			return None
+		kind, values = index
+		if kind == TyrantProtocol.TDBITLEXICAL and op == TyrantProtocol.RDBQCSTREQ:
+			return values.get(expr, ())
+		if kind == TyrantProtocol.TDBITLEXICAL and op == TyrantProtocol.RDBQCSTROREQ:
+			tokens = splitTokens(expr)
+		elif kind == TyrantProtocol.TDBITDECIMAL and op == TyrantProtocol.RDBQCNUMEQ:
+			return values.get(toNumber(expr), ())
+		elif kind == TyrantProtocol.TDBITDECIMAL and op == TyrantProtocol.RDBQCNUMOREQ:
+			tokens = [ toNumber(t) for t in splitTokens(expr) ]
+		else:
+			return None
+		keys = set()
+		for token in tokens:
+			keys.update(values.get(token, ()))
+		return keys
+
+## CLASS
+
+##-----------------------------------------------
+## splitTokens
+##-----------------------------------------------
+def splitTokens(expr):
+	return [ t for t in re.split(r"[ ,]+", expr) if t ]
+
+##-----------------------------------------------
+## matcher
+##-----------------------------------------------
+def matcher(op, expr):
+	"""Predicate on a column value (None if the record lacks the column)
+	   for a search condition"""
+	negate = op & TyrantProtocol.RDBQCNEGATE
+	op &= ~(TyrantProtocol.RDBQCNEGATE | TyrantProtocol.RDBQCNOIDX)
+
+	if op == TyrantProtocol.RDBQCSTREQ:
+		test = lambda v: v == expr
+	elif op == TyrantProtocol.RDBQCSTRINC:
+		test = lambda v: expr in v
+	elif op == TyrantProtocol.RDBQCSTRBW:
+		test = lambda v: v.startswith(expr)
+	elif op == TyrantProtocol.RDBQCSTREW:
+		test = lambda v: v.endswith(expr)
+	elif op == TyrantProtocol.RDBQCSTRAND:
+		tokens = splitTokens(expr)
+		test = lambda v: all(t in v for t in tokens)
+	elif op == TyrantProtocol.RDBQCSTROR:
+		tokens = splitTokens(expr)
+		test = lambda v: any(t in v for t in tokens)
+	elif op == TyrantProtocol.RDBQCSTROREQ:
+		tokens = set(splitTokens(expr))
+		test = lambda v: v in tokens
+	elif op == TyrantProtocol.RDBQCSTRRX:
+		regex = re.compile(expr)
+		test = lambda v: regex.search(v) is not None
+	elif op == TyrantProtocol.RDBQCNUMEQ:
+		number = toNumber(expr)
+		test = lambda v: toNumber(v) == number
+	elif op == TyrantProtocol.RDBQCNUMGT:
+		number = toNumber(expr)
+		test = lambda v: toNumber(v) > number
+	elif op == TyrantProtocol.RDBQCNUMGE:
+		number = toNumber(expr)
+		test = lambda v: toNumber(v) >= number
+	elif op == TyrantProtocol.RDBQCNUMLT:
+		number = toNumber(expr)
+		test = lambda v: toNumber(v) < number
+	elif op == TyrantProtocol.RDBQCNUMLE:
+		number = toNumber(expr)
+		test = lambda v: toNumber(v) <= number
+	elif op == TyrantProtocol.RDBQCNUMBT:
+		bounds = sorted(toNumber(t) for t in splitTokens(expr)[:2])
+		test = lambda v: bounds[0] <= toNumber(v) <= bounds[-1]
+	elif op == TyrantProtocol.RDBQCNUMOREQ:
+		numbers = set(toNumber(t) for t in splitTokens(expr))
+		test = lambda v: toNumber(v) in numbers
+	else:
+		raise ValueError("Unsupported search operator %d" % op)
+
+	if negate:
+		return lambda v: v is None or not test(v)
+	return lambda v: v is not None and test(v)
+
+##-----------------------------------------------
+## Record encoding
+##-----------------------------------------------
+def decodeRecord(data):
+	"""Zero-separated column names and values to a dict"""
+	if not data: return { }
+	elems = data.split("\0")
+	return dict(zip(elems[::2], elems[1::2]))
+
+def encodeRecord(cols):
+	flat = [ ]
+	for item in cols.iteritems():
+		flat.extend(item)
+	return "\0".join(flat)
+
+class Failure(Exception):
+	"""The request failed: the server answers with error code 1"""
+	pass
+
+class TyrantHandler(SocketServer.StreamRequestHandler):
+	"""Serves the requests of one client connection, one after another.
+	   Every command handler reads and decodes its whole request and
+	   returns a function doing the table operation, which alone runs
+	   with the database locked and returns the response"""
+
+	def setup(self):
+		SocketServer.StreamRequestHandler.setup(self)
+		if self.server.address_family != getattr(socket, "AF_UNIX", None):
+			## Every response goes out in a single send
+			self.connection.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+		self.db = self.server.db
+
+	def handle(self):
+		try:
+			self.serveRequests()
+		except socket.error, err:
+			logging.debug("Connection from %s closed: %s" % (self.client_address, err))
+
+	def serveRequests(self):
+		read = self.rfile.read
+		while True:
+			header = read(2)
+			if len(header) < 2:
+				return
+			magic, command = struct.unpack(">BB", header)
+			if magic != 0xc8:
+				logging.warn("Bad magic number %#x from %s" % (magic, self.client_address))
+				return
+			handler = self.COMMANDS.get(command)
+			if handler is None:
+				logging.warn("Unsupported command %#x from %s" % (command, self.client_address))
+				return
+			try:
+				apply = handler(self)
+				with self.db.lock:
+					response = apply()
+			except Failure:
+				response = "\x01"
+			except struct.error:
+				## The client went away in the middle of a request
+				return
+			if response is not None:
+				self.connection.sendall(response)
+		## WHILE
+
+	##-----------------------------------------------
+	## Request decoding
+	##-----------------------------------------------
+	def ints(self, n):
+		return struct.unpack(">%dI" % n, self.rfile.read(4 * n))
+
+	def readList(self, n):
+		items = [ ]
+		for i in xrange(n):
+			size, = self.ints(1)
+			items.append(self.rfile.read(size))
+		return items
+
+	##-----------------------------------------------
+	## Commands
+	##-----------------------------------------------
+	def doPut(self):
+		ksiz, vsiz = self.ints(2)
+		key = self.rfile.read(ksiz)
+		cols = decodeRecord(self.rfile.read(vsiz))
+		def apply():
+			self.db.put(key, cols)
+			return "\x00"
+		return apply
+
+	def doPutKeep(self):
+		ksiz, vsiz = self.ints(2)
+		key = self.rfile.read(ksiz)
+		cols = decodeRecord(self.rfile.read(vsiz))
+		def apply():
+			if self.db.get(key) is not None: raise Failure()
+			self.db.put(key, cols)
+			return "\x00"
+		return apply
+
+	def doPutCat(self):
+		ksiz, vsiz = self.ints(2)
+		key = self.rfile.read(ksiz)
+		added = decodeRecord(self.rfile.read(vsiz))
+		def apply():
+			cols = dict(self.db.get(key) or { })
+			cols.update(added)
+			self.db.put(key, cols)
+			return "\x00"
+		return apply
+
+	def doPutNr(self):
+		put = self.doPut()
+		def apply():
+			put()
+			return None
+		return apply
+
+	def doOut(self):
+		ksiz, = self.ints(1)
+		key = self.rfile.read(ksiz)
+		def apply():
+			if not self.db.out(key): raise Failure()
+			return "\x00"
+		return apply
+
+	def doGet(self):
+		ksiz, = self.ints(1)
+		key = self.rfile.read(ksiz)
+		def apply():
+			cols = self.db.get(key)
+			if cols is None: raise Failure()
+			value = encodeRecord(cols)
+			return struct.pack(">BI", 0, len(value)) + value
+		return apply
+
+	def doMget(self):
+		rnum, = self.ints(1)
+		keys = self.readList(rnum)
+		def apply():
+			out = [ ]
+			for key in keys:
+				cols = self.db.get(key)
+				if cols is None: continue
+				value = encodeRecord(cols)
+				out.append(struct.pack(">II", len(key), len(value)) + key + value)
+			return struct.pack(">BI", 0, len(out)) + "".join(out)
+		return apply
+
+	def doVsiz(self):
+		ksiz, = self.ints(1)
+		key = self.rfile.read(ksiz)
+		def apply():
+			cols = self.db.get(key)
+			if cols is None: raise Failure()
+			return struct.pack(">BI", 0, len(encodeRecord(cols)))
+		return apply
+
+	def doIterInit(self):
+		def apply():
+			self.iterator = iter(list(self.db.keys))
+			return "\x00"
+		return apply
+
+	def doIterNext(self):
+		def apply():
+			try:
+				key = self.iterator.next()
+			except (AttributeError, StopIteration):
+				raise Failure()
+			return struct.pack(">BI", 0, len(key)) + key
+		return apply
+
+	def doFwmkeys(self):
+		psiz, maxkeys = struct.unpack(">Ii", self.rfile.read(8))
+		prefix = self.rfile.read(psiz)
+		def apply():
+			keys = self.db.keys.prefixed(prefix, maxkeys if maxkeys >= 0 else None)
+			return struct.pack(">BI", 0, len(keys)) + "".join(struct.pack(">I", len(k)) + k for k in keys)
+		return apply
+
+	def doAddInt(self):
+		ksiz, num = struct.unpack(">Ii", self.rfile.read(8))
+		key = self.rfile.read(ksiz)
+		def apply():
+			return struct.pack(">Bi", 0, self.db.addint(key, num))
+		return apply
+
+	def doSync(self):
+		return lambda: "\x00"
+
+	def doVanish(self):
+		def apply():
+			self.db.vanish()
+			return "\x00"
+		return apply
+
+	def doRnum(self):
+		return lambda: struct.pack(">BQ", 0, len(self.db.records))
+
+	def doSize(self):
+		def apply():
+			size = sum(len(k) + len(encodeRecord(c)) for k, c in self.db.records.iteritems())
+			return struct.pack(">BQ", 0, size)
+		return apply
+
+	def doStat(self):
+		def apply():
+			stats = "type\ttable\nrnum\t%d\npath\t*\n" % len(self.db.records)
+			if self.server.master is not None:
+				host, port = self.server.master if isinstance(self.server.master, tuple) else (self.server.master, 0)
+				stats += "mhost\t%s\nmport\t%d\ndelay\t0.000000\n" % (host, port)
+			return struct.pack(">BI", 0, len(stats)) + stats
+		return apply
+
+	def doMisc(self):
+		nsiz, opts, rnum = self.ints(3)
+		name = self.rfile.read(nsiz)
+		args = self.readList(rnum)
+		func = self.MISC.get(name)
+		def apply():
+			if func is None: raise Failure()
+			out = func(self, args)
+			return struct.pack(">BI", 0, len(out)) + "".join(struct.pack(">I", len(v)) + v for v in out)
+		return apply
+
+	COMMANDS = {
+		TyrantProtocol.PUT: doPut,
+		TyrantProtocol.PUTKEEP: doPutKeep,
+		TyrantProtocol.PUTCAT: doPutCat,
+		TyrantProtocol.PUTNR: doPutNr,
+		TyrantProtocol.OUT: doOut,
+		TyrantProtocol.GET: doGet,
+		TyrantProtocol.MGET: doMget,
+		TyrantProtocol.VSIZ: doVsiz,
+		TyrantProtocol.ITERINIT: doIterInit,
+		TyrantProtocol.ITERNEXT: doIterNext,
+		TyrantProtocol.FWMKEYS: doFwmkeys,
+		TyrantProtocol.ADDINT: doAddInt,
+		TyrantProtocol.SYNC: doSync,
+		TyrantProtocol.VANISH: doVanish,
+		TyrantProtocol.RNUM: doRnum,
+		TyrantProtocol.SIZE: doSize,
+		TyrantProtocol.STAT: doStat,
+		TyrantProtocol.MISC: doMisc,
+	}
+
+	##-----------------------------------------------
+	## Misc functions
+	##-----------------------------------------------
+	def miscPut(self, args):
+		if not args: raise Failure()
+		self.db.put(args[0], dict(zip(args[1::2], args[2::2])))
+		return [ ]
+
+	def miscPutKeep(self, args):
+		if not args or self.db.get(args[0]) is not None: raise Failure()
+		return self.miscPut(args)
+
+	def miscPutCat(self, args):
+		if not args: raise Failure()
+		cols = dict(self.db.get(args[0]) or { })
+		cols.update(zip(args[1::2], args[2::2]))
+		self.db.put(args[0], cols)
+		return [ ]
+
+	def miscOut(self, args):
+		if not args or not self.db.out(args[0]): raise Failure()
+		return [ ]
+
+	def miscGet(self, args):
+		cols = self.db.get(args[0]) if args else None
+		if cols is None: raise Failure()
+		out = [ ]
+		for item in cols.iteritems():
+			out.extend(item)
+		return out
+
+	def miscPutList(self, args):
+		for i in xrange(0, len(args) - 1, 2):
+			self.db.put(args[i], decodeRecord(args[i+1]))
+		return [ ]
+
+	def miscOutList(self, args):
+		for key in args:
+			self.db.out(key)
+		return [ ]
+
+	def miscGetList(self, args):
+		out = [ ]
+		for key in args:
+			cols = self.db.get(key)
+			if cols is not None:
+				out.append(key)
+				out.append(encodeRecord(cols))
+		return out
+
+	def miscSetIndex(self, args):
+		if len(args) < 2 or not self.db.setIndex(args[0], int(args[1])): raise Failure()
+		return [ ]
+
+	def miscGenuid(self, args):
+		return [ str(self.db.genuid()) ]
+
+	def miscSearch(self, args):
+		conditions = [ ]
+		orderBy = None
+		orderType = TyrantProtocol.RDBQOSTRASC
+		limit = -1
+		skip = 0
+		columns = None
+		out = count = False
+		for arg in args:
+			parts = arg.split("\0")
+			if parts[0] == "addcond" and len(parts) == 4:
+				conditions.append((parts[1], int(parts[2]), parts[3]))
+			elif parts[0] == "setorder" and len(parts) == 3:
+				orderBy, orderType = parts[1], int(parts[2])
+			elif parts[0] == "setlimit":
+				limit = int(parts[1])
+				skip = int(parts[2]) if len(parts) > 2 else 0
+			elif parts[0] == "get":
+				columns = parts[1:]
+			elif parts[0] == "out":
+				out = True
+			elif parts[0] == "count":
+				count = True
+			elif parts[0] == "hint":
+				pass
+			else:
+				## Meta search is not supported
+				raise Failure()
+		## FOR
+
+		try:
+			keys = self.db.search(conditions, orderBy, orderType, limit, skip)
+		except (ValueError, re.error):
+			raise Failure()
+
+		if out:
+			for key in keys:
+				self.db.out(key)
+			return [ ]
+		if count:
+			return [ str(len(keys)) ]
+		if columns is not None:
+			## The primary key comes back as a column with an empty name
+			records = [ ]
+			for key in keys:
+				cols = self.db.get(key)
+				if columns:
+					cols = dict((c, cols[c]) for c in columns if c in cols)
+				records.append(encodeRecord(cols) + "\0\0" + key if cols else "\0" + key)
+			return records
+		return keys
+
+	MISC = {
+		"put": miscPut,
+		"putkeep": miscPutKeep,
+		"putcat": miscPutCat,
+		"out": miscOut,
+		"get": miscGet,
+		"putlist": miscPutList,
+		"outlist": miscOutList,
+		"getlist": miscGetList,
+		"setindex": miscSetIndex,
+		"genuid": miscGenuid,
+		"search": miscSearch,
+	}
+
+## CLASS
+
+class TyrantServer(SocketServer.ThreadingMixIn, SocketServer.TCPServer):
+	"""Serves one TableDatabase over TCP, one thread per connection. A
+	   server given the address of its master serves the master's database
+	   as a replica"""
+	daemon_threads = True
+	allow_reuse_address = True
+
+	def __init__(self, address, db=None, master=None):
+		SocketServer.TCPServer.__init__(self, address, TyrantHandler)
+		self.db = db if db is not None else TableDatabase()
+		self.master = master
+		self.replicas = [ ]
+
+## CLASS
+
+if hasattr(socket, "AF_UNIX"):
+	class UnixTyrantServer(SocketServer.ThreadingMixIn, SocketServer.UnixStreamServer):
+		"""Serves one TableDatabase over a Unix socket"""
+		daemon_threads = True
+
+		def __init__(self, path, db=None, master=None):
+			if os.path.exists(path):
+				os.unlink(path)
+			SocketServer.UnixStreamServer.__init__(self, path, TyrantHandler)
+			self.db = db if db is not None else TableDatabase()
+			self.master = master
+			self.replicas = [ ]
+
+	## CLASS
+
+##-----------------------------------------------
+## startServers
+##-----------------------------------------------
+def startServers(count, host="127.0.0.1", port=0, path=None, replicas=0):
+	"""Start count servers in background threads, each on its own port
+	   (consecutive ones from port, or free ones if port is 0) or on Unix
+	   socket path.N. Each one gets replicas replicas, in its replicas
+	   list, on the ports after those of the servers or on Unix sockets
+	   path.N.M. Returns the servers."""
+	servers = [ ]
+	for i in xrange(count):
+		if path is not None:
+			server = UnixTyrantServer("%s.%d" % (path, i))
+		else:
+			server = TyrantServer((host, port + i if port else 0))
+		for j in xrange(replicas):
+			if path is not None:
+				replica = UnixTyrantServer("%s.%d.%d" % (path, i, j), server.db, server.server_address)
+			else:
+				replicaPort = port + count + i * replicas + j if port else 0
+				replica = TyrantServer((host, replicaPort), server.db, server.server_address)
+			server.replicas.append(replica)
+		## FOR
+		for s in [ server ] + server.replicas:
+			thread = threading.Thread(target=s.serve_forever)
+			thread.daemon = True
+			thread.start()
+		servers.append(server)
+	## FOR
+	return servers
+
+##-----------------------------------------------
+## spawnServers
+##-----------------------------------------------
+def spawnServers(tables, host="127.0.0.1"):
+	"""Serve a database for each table name in a child process, so the
+	   server does not compete with the caller for the interpreter. Returns
+	   (process, {table: {"host": host, "port": port}}); terminate the
+	   process to stop them."""
+	parent, child = multiprocessing.Pipe()
+	process = multiprocessing.Process(target=_serve, args=(len(tables), host, child))
+	process.daemon = True
+	process.start()
+	ports = parent.recv()
+	return process, dict((tables[i], {"host": host, "port": ports[i]}) for i in xrange(len(tables)))
+
+def _serve(count, host, pipe):
+	servers = startServers(count, host)
+	pipe.send([ s.server_address[1] for s in servers ])
+	threading.Event().wait(1 << 30)
+
+##-----------------------------------------------
+## main
+##-----------------------------------------------
+def main():
+	parser = optparse.OptionParser(description="In-memory Tokyo Tyrant table database server")
+	parser.add_option("--host", default="127.0.0.1", help="address to listen on")
+	parser.add_option("--port", type="int", default=1978, help="port of the first database")
+	parser.add_option("--count", type="int", default=1, help="number of databases, one per port")
+	parser.add_option("--socket", metavar="PATH", help="listen on Unix sockets PATH.N instead")
+	parser.add_option("--replicas", type="int", default=0, help="number of replicas of each database")
+	options, args = parser.parse_args()
+
+	logging.basicConfig(level=logging.INFO, format="%(asctime)s [%(funcName)s:%(lineno)03d] %(levelname)-5s: %(message)s")
+	servers = startServers(options.count, options.host, options.port, options.socket, options.replicas)
+	for server in servers:
+		logging.info("Serving a table database on %s" % (server.server_address,))
+		for replica in server.replicas:
+			logging.info("Serving a replica of it on %s" % (replica.server_address,))
+	try:
+		threading.Event().wait(1 << 30)
+	except KeyboardInterrupt:
+		pass
+
+if __name__ == "__main__":
+	main()
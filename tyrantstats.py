@@ -0,0 +1,361 @@
+# -*- coding: utf-8 -*-
+# -----------------------------------------------------------------------
+# Copyright (C) 2011
+# Marcelo Martins
+# http://www.cs.brown.edu/~martins/
+#
+# Permission is hereby granted, free of charge, to any person obtaining
+# a copy of this software and associated documentation files (the
+# "Software"), to deal in the Software without restriction, including
+# without limitation the rights to use, copy, modify, merge, publish,
+# distribute, sublicense, and/or sell copies of the Software, and to
+# permit persons to whom the Software is furnished to do so, subject to
+# the following conditions:
+#
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT
+# IN NO EVENT SHALL THE AUTHORS BE LIABLE FOR ANY CLAIM, DAMAGES OR
+# OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE,
+# ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR
+# OTHER DEALINGS IN THE SOFTWARE.
+# -----------------------------------------------------------------------
+
+
+from __future__ import with_statement
+
+import array
+import threading
+import time
+
+from pyrant.protocol import TyrantProtocol
+
+class Histogram(object):
+	"""Log-linear latency histogram in the style of HdrHistogram. Values
+	   (integer microseconds) below 2^SUB_BITS are counted exactly; above
+	   that every power of two is split into 2^(SUB_BITS-1) equal buckets,
+	   so any value is known within 1/2^(SUB_BITS-1) of itself. Recording
+	   is a couple of shifts and an array increment."""
+
+	SUB_BITS = 8
+	SUB_COUNT = 1 << SUB_BITS
+	HALF_COUNT = SUB_COUNT >> 1
+
+	def __init__(self):
+		self.counts = array.array("l", [ 0 ]) * Histogram.SUB_COUNT
+		self.count = 0
+		self.total = 0
+		self.min = None
+		self.max = 0
+
+	##-----------------------------------------------
+	## record
+	##-----------------------------------------------
+	def record(self, value):
+		value = int(value)
+		if value < 0: value = 0
+		shift = value.bit_length() - Histogram.SUB_BITS
+		if shift < 0: shift = 0
+		index = shift * Histogram.HALF_COUNT + (value >> shift)
+		if index >= len(self.counts):
+			self.counts.extend([ 0 ] * (index + 1 - len(self.counts)))
+		self.counts[index] += 1
+
+		self.count += 1
+		self.total += value
+		if value > self.max: self.max = value
+		if self.min is None or value < self.min: self.min = value
+
+	##-----------------------------------------------
+	## bucketMax
+	##-----------------------------------------------
+	def bucketMax(self, index):
+		"""Highest value counted in bucket index"""
+		if index < Histogram.SUB_COUNT:
+			return index
+		shift = (index - Histogram.SUB_COUNT) / Histogram.HALF_COUNT + 1
+		low = (index - shift * Histogram.HALF_COUNT) << shift
+		return low + (1 << shift) - 1
+
+	##-----------------------------------------------
+	## percentile
+	##-----------------------------------------------
+	def percentile(self, p):
+		"""Smallest recorded value v such that p percent of the values are <= v
+		   (up to the bucket precision)"""
+		if not self.count: return 0
+		target = max(1, int(round(self.count * p / 100.0)))
+		seen = 0
+		for index in xrange(len(self.counts)):
+			seen += self.counts[index]
+			if seen >= target:
+				return min(self.bucketMax(index), self.max)
+		return self.max
+
+	def mean(self):
+		return float(self.total) / self.count if self.count else 0.0
+
+	##-----------------------------------------------
+	## merge
+	##-----------------------------------------------
+	def merge(self, other):
+		"""Add the values of another Histogram to this one"""
+		if len(other.counts) > len(self.counts):
+			self.counts.extend([ 0 ] * (len(other.counts) - len(self.counts)))
+		for index in xrange(len(other.counts)):
+			self.counts[index] += other.counts[index]
+		self.count += other.count
+		self.total += other.total
+		self.max = max(self.max, other.max)
+		if other.min is not None and (self.min is None or other.min < self.min):
+			self.min = other.min
+
+## CLASS
+
+class Lap(object):
+	"""Times consecutive stages of one transaction: each call records the
+	   time elapsed since the previous call (or since the Lap was created)
+	   under the given stage name. This is wall time: for a task on
+	   executeAsync's event loop a stage also includes the turns other
+	   tasks took before it was resumed, not just its own requests."""
+	__slots__ = ("stats", "txn", "last")
+
+	def __init__(self, stats, txn):
+		self.stats = stats
+		self.txn = txn
+		self.last = time.time()
+
+	def __call__(self, stage):
+		now = time.time()
+		self.stats.record(self.txn, stage, now - self.last)
+		self.last = now
+
+## CLASS
+
+def _noLap(stage):
+	pass
+
+class LatencyStats(object):
+	"""Latency histograms per transaction type and per stage. A transaction's
+	   overall latency is kept under the stage TOTAL. Disabled stats hand out
+	   laps that do nothing. The terminal threads of a client share one
+	   LatencyStats, so histograms are only touched under lock."""
+
+	TOTAL = "TOTAL"
+	PERCENTILES = (50, 95, 99, 99.9)
+
+	def __init__(self, enabled=True):
+		self.enabled = enabled
+		self.histograms = dict()
+		self.lock = threading.Lock()
+
+	##-----------------------------------------------
+	## lap
+	##-----------------------------------------------
+	def lap(self, txn):
+		"""Start timing the stages of a transaction of type txn"""
+		if not self.enabled: return _noLap
+		return Lap(self, txn)
+
+	##-----------------------------------------------
+	## record
+	##-----------------------------------------------
+	def record(self, txn, stage, seconds):
+		if not self.enabled: return
+		with self.lock:
+			histogram = self.histograms.get((txn, stage))
+			if histogram is None:
+				histogram = self.histograms[(txn, stage)] = Histogram()
+			histogram.record(seconds * 1000000)
+		## WITH
+
+	##-----------------------------------------------
+	## merge
+	##-----------------------------------------------
+	def merge(self, other):
+		"""Add the histograms of another LatencyStats to these"""
+		with self.lock:
+			for key, histogram in other.histograms.iteritems():
+				if not key in self.histograms:
+					self.histograms[key] = Histogram()
+				self.histograms[key].merge(histogram)
+		## WITH
+
+	##-----------------------------------------------
+	## summary
+	##-----------------------------------------------
+	def summary(self):
+		"""Table of count, mean, p50, p95, p99, p99.9 and max (in ms) for
+		   every transaction type, followed by its stages"""
+		header = "%-32s %9s %9s" % ("", "count", "mean") + \
+			"".join("%9s" % ("p%g" % p) for p in LatencyStats.PERCENTILES) + "%9s" % "max"
+		lines = [ header ]
+		with self.lock:
+			histograms = dict(self.histograms)
+		for txn in sorted(set(key[0] for key in histograms.keys())):
+			stages = [ key[1] for key in histograms.keys() if key[0] == txn and key[1] != LatencyStats.TOTAL ]
+			for stage in [ LatencyStats.TOTAL ] + sorted(stages):
+				histogram = histograms.get((txn, stage))
+				if histogram is None: continue
+				name = txn if stage == LatencyStats.TOTAL else "  " + stage
+				lines.append("%-32s %9d %9.3f" % (name, histogram.count, histogram.mean() / 1000.0) + \
+					"".join("%9.3f" % (histogram.percentile(p) / 1000.0) for p in LatencyStats.PERCENTILES) + \
+					"%9.3f" % (histogram.max / 1000.0))
+			## FOR
+		## FOR
+		return "\n".join(lines)
+
+## CLASS
+
+## Request kinds counted by WireStats
+KINDS = ("get", "put", "query", "delete", "other")
+
+_COMMAND_KINDS = {
+	TyrantProtocol.GET: "get",
+	TyrantProtocol.MGET: "get",
+	TyrantProtocol.VSIZ: "get",
+	TyrantProtocol.PUT: "put",
+	TyrantProtocol.PUTKEEP: "put",
+	TyrantProtocol.PUTCAT: "put",
+	TyrantProtocol.PUTSHL: "put",
+	TyrantProtocol.PUTNR: "put",
+	TyrantProtocol.ADDINT: "put",
+	TyrantProtocol.ADDDOUBLE: "put",
+	TyrantProtocol.OUT: "delete",
+	TyrantProtocol.VANISH: "delete",
+	TyrantProtocol.FWMKEYS: "query",
+	TyrantProtocol.ITERINIT: "query",
+	TyrantProtocol.ITERNEXT: "query",
+}
+
+_MISC_KINDS = {
+	"get": "get",
+	"getlist": "get",
+	"put": "put",
+	"putkeep": "put",
+	"putcat": "put",
+	"putlist": "put",
+	"out": "delete",
+	"outlist": "delete",
+	"search": "query",
+}
+
+##-----------------------------------------------
+## requestKind
+##-----------------------------------------------
+def requestKind(command, func=None):
+	"""Kind of a Tyrant request, given its command code and, for misc
+	   calls, the function name"""
+	if command == TyrantProtocol.MISC:
+		return _MISC_KINDS.get(func, "other")
+	return _COMMAND_KINDS.get(command, "other")
+
+class WireStats(object):
+	"""Round trips, requests by kind and bytes sent and received, per
+	   transaction type and per server. Requests are charged to the
+	   transaction type in context (set by the driver around each
+	   transaction, for the calling thread only) unless the caller names
+	   another one. Counters are shared by every thread of the client and
+	   only updated under lock."""
+
+	ROUND_TRIPS = 0
+	SENT = len(KINDS) + 1
+	RECEIVED = len(KINDS) + 2
+	OTHER = "OTHER"
+
+	def __init__(self, enabled=True):
+		self.enabled = enabled
+		self.local = threading.local()
+		self.counters = dict()
+		self.lock = threading.Lock()
+		self.kindIndex = dict((KINDS[i], i + 1) for i in xrange(len(KINDS)))
+
+	def getContext(self):
+		return getattr(self.local, "context", None)
+
+	def setContext(self, context):
+		self.local.context = context
+
+	context = property(getContext, setContext)
+
+	def counter(self, serverId, context):
+		"""Counters of serverId and context. Callers hold the lock"""
+		key = (context or self.context or WireStats.OTHER, serverId)
+		counter = self.counters.get(key)
+		if counter is None:
+			counter = self.counters[key] = [ 0 ] * (len(KINDS) + 3)
+		return counter
+
+	##-----------------------------------------------
+	## request
+	##-----------------------------------------------
+	def request(self, serverId, kind, context=None, roundTrip=True):
+		"""Count one request. Requests sent without waiting for a reply
+		   are not round trips"""
+		if not self.enabled: return
+		with self.lock:
+			counter = self.counter(serverId, context)
+			if roundTrip: counter[WireStats.ROUND_TRIPS] += 1
+			counter[self.kindIndex[kind]] += 1
+		## WITH
+
+	def sent(self, serverId, nbytes, context=None):
+		if not self.enabled: return
+		with self.lock:
+			self.counter(serverId, context)[WireStats.SENT] += nbytes
+
+	def received(self, serverId, nbytes, context=None):
+		if not self.enabled: return
+		with self.lock:
+			self.counter(serverId, context)[WireStats.RECEIVED] += nbytes
+
+	##-----------------------------------------------
+	## merge
+	##-----------------------------------------------
+	def merge(self, other):
+		"""Add the counters of another WireStats to these"""
+		with self.lock:
+			for key, counter in other.counters.iteritems():
+				mine = self.counters.setdefault(key, [ 0 ] * len(counter))
+				for i in xrange(len(counter)):
+					mine[i] += counter[i]
+		## WITH
+
+	##-----------------------------------------------
+	## summary
+	##-----------------------------------------------
+	def summary(self, txnCounts=None):
+		"""Table of the counters per transaction type and server, each
+		   transaction type followed by its totals. txnCounts maps a
+		   transaction type to the number of transactions run, to show round
+		   trips and bytes per transaction as well."""
+		header = "%-14s %-10s %10s" % ("", "server", "trips") + \
+			"".join("%9s" % k for k in KINDS) + "%12s %12s" % ("KB sent", "KB recv")
+		if txnCounts: header += "%10s %10s" % ("trips/txn", "KB/txn")
+		lines = [ header ]
+		for txn in sorted(set(key[0] for key in self.counters.keys())):
+			total = [ 0 ] * (len(KINDS) + 3)
+			for key in sorted(key for key in self.counters.keys() if key[0] == txn):
+				counter = self.counters[key]
+				for i in xrange(len(counter)):
+					total[i] += counter[i]
+				lines.append(self.format(txn, key[1], counter))
+			## FOR
+			line = self.format(txn, "*", total)
+			count = txnCounts.get(txn) if txnCounts else None
+			if count:
+				line += "%10.2f %10.2f" % (float(total[WireStats.ROUND_TRIPS]) / count,
+						(total[WireStats.SENT] + total[WireStats.RECEIVED]) / 1024.0 / count)
+			lines.append(line)
+		## FOR
+		return "\n".join(lines)
+
+	def format(self, txn, serverId, counter):
+		return "%-14s %-10s %10d" % (txn, serverId, counter[WireStats.ROUND_TRIPS]) + \
+			"".join("%9d" % counter[i + 1] for i in xrange(len(KINDS))) + \
+			"%12.1f %12.1f" % (counter[WireStats.SENT] / 1024.0, counter[WireStats.RECEIVED] / 1024.0)
+
+## CLASS